@@ -16,23 +16,40 @@ def create_app(config = None):
         app.config['SECRET_KEY'] = getenv("SECRET_KEY")
         app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{DB_NAME}"
         app.config["BASEDIR"] = path.abspath(path.dirname(__file__))
+        app.config["DATABASE_PROFILE"] = getenv("DATABASE_PROFILE", "default")
     if config:
         for key, value in config.items():
             app.config[key] = value
 
-    initialize(app)
-    create_database(app)
-    register_blueprints(app)
+    from .startup import timed_phases
+    timed_phases(app, [initialize, create_database, register_blueprints, register_commands, precompile_templates])
 
     return app
 
 def initialize(app):
+    from .startup import init_template_cache
+    init_template_cache(app)
     db.init_app(app)
+    from .database import init_database_profile
+    init_database_profile(app)
     login_manager.init_app(app)
     from .models import User
+    from . import search #registers the full text index with create_all
+    from .cache import init_entity_caches, cached_get
+    from .instrumentation import init_instrumentation
+    from .fragments import init_fragment_cache
+    from .events import init_events
+    init_entity_caches(app)
+    init_fragment_cache(app)
+    init_events(app)
+    init_instrumentation(app)
     @login_manager.user_loader
     def load_user(id):
-        return User.query.get(int(id))
+        return cached_get(db.session, User, int(id))
+
+def register_commands(app):
+    from . import commands
+    commands.register_commands(app)
 
 def register_blueprints(app):
     from .views import views
@@ -44,7 +61,10 @@ def register_blueprints(app):
     app.register_blueprint(request_endpoints, url_prefix = "/")
 
 def create_database(app):
-    '''Create db if it does not exist already'''
-    if not path.exists("SupportTicketSystem/" + DB_NAME):
-        db.create_all(app = app)
-        print("Created Datbase")
\ No newline at end of file
+    '''Create the tables if they do not exist already, when SCHEMA_CHECK says'''
+    from .startup import schedule_schema_check
+    schedule_schema_check(app)
+
+def precompile_templates(app):
+    from . import startup
+    startup.precompile_templates(app)
\ No newline at end of file
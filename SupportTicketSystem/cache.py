@@ -0,0 +1,239 @@
+import sys
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from types import MappingProxyType
+from flask import current_app
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import inspect, event
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from .models import User, Groups, User_Groups, Version_Stamps
+
+DEFAULT_ENTITY_CACHE_SIZE = 1024
+DEFAULT_ENTITY_CACHE_TTL = 300 #seconds
+UNCACHED_COLUMNS = {"password"} #never kept in process memory, loaded from the database when read
+
+class LRUCache:
+    '''
+    Thread safe least recently used cache.
+    Bounded by number of entries, and entries expire ttl seconds after they were set.
+    Counts hits and misses for monitoring.
+    '''
+    def __init__(self, max_entries = DEFAULT_ENTITY_CACHE_SIZE, ttl = DEFAULT_ENTITY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        '''
+        Returns the value stored at the key, or None if it is missing or expired
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        '''
+        Stores the value at the key, evicting the least recently used entries if the cache is full
+        '''
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits" : self.hits, "misses" : self.misses, "evictions" : self.evictions,
+                "entries" : len(self._entries), "max_entries" : self.max_entries}
+
+
+class SizedLRUCache(LRUCache):
+    '''
+    LRUCache bounded by the memory its values take instead of their number.
+    The size of a value is measured once by sizeof when it is set.
+    '''
+    def __init__(self, max_bytes, ttl = DEFAULT_ENTITY_CACHE_TTL, sizeof = sys.getsizeof):
+        super().__init__(max_entries = None, ttl = ttl)
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (monotonic() + self.ttl, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits" : self.hits, "misses" : self.misses, "evictions" : self.evictions,
+                "entries" : len(self._entries), "bytes" : self.bytes, "max_bytes" : self.max_bytes}
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+
+def init_entity_caches(app):
+    '''
+    Gives the app its own User and Groups row caches and membership cache, sized by ENTITY_CACHE_SIZE and ENTITY_CACHE_TTL
+    '''
+    max_entries = app.config.get("ENTITY_CACHE_SIZE", DEFAULT_ENTITY_CACHE_SIZE)
+    ttl = app.config.get("ENTITY_CACHE_TTL", DEFAULT_ENTITY_CACHE_TTL)
+    app.extensions["entity_caches"] = {model.__tablename__ : LRUCache(max_entries, ttl) for model in (User, Groups, User_Groups)}
+
+def entity_cache(model):
+    return current_app.extensions["entity_caches"][model.__tablename__]
+
+def cached_get(session, model, id):
+    '''
+    Returns the row of the model (User or Groups) with the given id, or None if there is none.
+    Loaded rows already in the session are returned as is, otherwise the cached column values are
+    attached to the session without a query. Misses are read from the database and cached.
+    Columns in UNCACHED_COLUMNS are left unloaded on cached rows and read with a query if they are accessed.
+    '''
+    if not isinstance(id, int) or isinstance(id, bool):
+        return session.query(model).get(id)
+    instance = session.identity_map.get(identity_key(model, id))
+    if instance is not None:
+        state = inspect(instance)
+        if state.modified or not state.expired_attributes:
+            return instance
+    cache = entity_cache(model)
+    values = cache.get(id)
+    if values is None:
+        instance = session.query(model).get(id)
+        if instance is not None:
+            cache.set(id, {attr.key : getattr(instance, attr.key) for attr in inspect(model).column_attrs if attr.key not in UNCACHED_COLUMNS})
+        return instance
+    instance = inspect(model).class_manager.new_instance()
+    for attr, value in values.items():
+        set_committed_value(instance, attr, value)
+    make_transient_to_detached(instance)
+    return session.merge(instance, load = False)
+
+def invalidate_entity(model, id):
+    '''
+    Drops the cached row, call after writing to it
+    '''
+    try:
+        entity_cache(model).invalidate(int(id))
+    except (TypeError, ValueError):
+        pass #ids that are not integers are never cached
+
+def invalidate_on_commit(session, model, id):
+    '''
+    Drops the cached row now and again when the transaction commits or rolls back, call when writing to it in a
+    transaction. Otherwise a request reading the row before the commit would put the old values back in the cache.
+    '''
+    session.info.setdefault("invalidated_entities", set()).add((model, id))
+    invalidate_entity(model, id)
+
+def memberships(session, user_id):
+    '''
+    Read only dict of group id -> rank of every group the user is in, for permission and visibility checks.
+    The cached map is checked against the user's version stamp, which every membership write bumps, so a change made
+    by another process is seen by the next check. A hit costs that one primary key read, a miss one more query.
+    '''
+    from .versions import user_scope #versions imports this module through counters
+    version = session.query(Version_Stamps.version).filter(Version_Stamps.scope == user_scope(user_id)).scalar() or 0
+    cache = entity_cache(User_Groups)
+    cached = cache.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    #read after the version, so a write committed in between leaves a stale version and is reloaded, never the reverse
+    ranks = MappingProxyType(dict(session.query(User_Groups.group_id, User_Groups.rank_in_group)\
+        .filter(User_Groups.user_id == user_id).order_by(User_Groups.group_id)))
+    cache.set(user_id, (version, ranks))
+    return ranks
+
+def invalidate_memberships(session, user_id = None):
+    '''
+    Drops the cached memberships of the user, or of everyone if user_id is None. Call when writing memberships.
+    They are dropped again when the transaction commits or rolls back, so memberships read from the uncommitted
+    transaction are not kept: a rolled back version number can be reused by the next write.
+    '''
+    session.info.setdefault("invalidated_memberships", set()).add(user_id)
+    _invalidate_memberships([user_id])
+
+def _invalidate_memberships(user_ids):
+    cache = entity_cache(User_Groups)
+    if None in user_ids:
+        cache.clear()
+    for user_id in user_ids:
+        cache.invalidate(user_id)
+
+def _invalidate_pending(session, keep = False):
+    get = session.info.get if keep else session.info.pop
+    _invalidate_memberships(get("invalidated_memberships", set()))
+    for model, id in get("invalidated_entities", set()):
+        invalidate_entity(model, id)
+
+@event.listens_for(SignallingSession, "after_commit")
+def _invalidate_committed(session):
+    _invalidate_pending(session)
+
+@event.listens_for(SignallingSession, "after_soft_rollback")
+def _invalidate_rolled_back(session, previous_transaction):
+    #the rolled back rows may have been read in the meantime, and the rest of a transaction whose savepoint was rolled
+    #back may still write some
+    _invalidate_pending(session, keep = previous_transaction.parent is not None)
+
+def clear_entity_caches():
+    for cache in current_app.extensions["entity_caches"].values():
+        cache.clear()
+
+def entity_cache_stats():
+    '''
+    Hit and miss counters of each entity cache, keyed by table name (user__groups is the membership cache)
+    '''
+    return {name : cache.stats() for name, cache in current_app.extensions["entity_caches"].items()}
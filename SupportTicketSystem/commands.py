@@ -0,0 +1,98 @@
+import click
+import os
+from flask import current_app
+from flask.cli import with_appcontext
+from . import db
+from .export import export_tickets, parse_time, FORMATS
+from .importer import import_tickets, read_records, IMPORT_BATCH_SIZE
+from .counters import reconcile_counters
+from .startup import profile_startup
+
+def register_commands(app):
+    '''
+    Adds the maintenance commands to the app's flask CLI
+    '''
+    app.cli.add_command(export_tickets_command)
+    app.cli.add_command(import_tickets_command)
+    app.cli.add_command(reconcile_counters_command)
+    app.cli.add_command(startup_profile_command)
+
+@click.command("export-tickets")
+@with_appcontext
+@click.option("--format", "format", type = click.Choice(list(FORMATS)), default = "ndjson", show_default = True)
+@click.option("--group-id", type = int, help = "Only export the tickets of this group.")
+@click.option("--since", help = "Only export tickets posted on or after this ISO date or datetime.")
+@click.option("--until", help = "Only export tickets posted before this ISO datetime, or on or before this ISO date.")
+@click.option("--comments", is_flag = True, help = "Include the comments of each ticket.")
+@click.option("--output", type = click.File("w"), default = "-", help = "File to write to, standard output by default.")
+def export_tickets_command(format, group_id, since, until, comments, output):
+    '''
+    Export tickets as CSV or NDJSON, read in batches so any number of tickets can be exported.
+    '''
+    try:
+        since, until = parse_time(since), parse_time(until, end = True)
+    except ValueError:
+        raise click.BadParameter("dates must be ISO formatted, e.g. 2022-01-31 or 2022-01-31T12:00:00")
+    for chunk in export_tickets(db, format = format, group_id = group_id, since = since, until = until, comments = comments):
+        output.write(chunk)
+
+@click.command("import-tickets")
+@with_appcontext
+@click.argument("input", type = click.File("r", encoding = "utf-8"))
+@click.option("--format", "format", type = click.Choice(["auto"] + list(FORMATS)), default = "auto", show_default = True,
+    help = "Input format, auto picks csv for .csv files and ndjson otherwise.")
+@click.option("--batch-size", type = click.IntRange(min = 1), default = IMPORT_BATCH_SIZE, show_default = True, help = "Tickets written per transaction.")
+@click.option("--checkpoint", help = "Name the progress is saved under, the absolute path of the input by default.")
+@click.option("--restart", is_flag = True, help = "Import from the first record even if an earlier run got further.")
+@click.option("--create-users/--no-create-users", default = True, show_default = True, help = "Create users for unknown author emails.")
+def import_tickets_command(input, format, batch_size, checkpoint, restart, create_users):
+    '''
+    Import tickets and comments from an NDJSON or CSV export of another tracker.
+    An interrupted import continues after the last committed batch when run again.
+    '''
+    if format == "auto":
+        format = "csv" if input.name.endswith(".csv") else "ndjson"
+    source = checkpoint or (os.path.abspath(input.name) if input.name != "<stdin>" else "stdin")
+    progress = lambda counts, elapsed: click.echo(f"\r{counts['tickets']:,} tickets, {counts['comments']:,} comments, "
+        f"{counts['tickets'] / elapsed if elapsed else 0:,.0f} tickets/s", nl = False, err = True)
+    try:
+        summary = import_tickets(db, read_records(input, format), source, batch_size = batch_size, restart = restart,
+            create_missing_users = create_users, progress = progress)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo("", err = True)
+    if summary["resumed_after"]:
+        click.echo(f"Resumed after record {summary['resumed_after']:,}")
+    click.echo(f"Imported {summary['tickets']:,} tickets and {summary['comments']:,} comments in {summary['elapsed']:.1f}s "
+        f"({summary['tickets_per_second']:,.0f} tickets/s, {summary['rows_per_second']:,.0f} rows/s). "
+        f"Created {summary['users']:,} users, {summary['groups']:,} groups, and {summary['memberships']:,} memberships.")
+
+@click.command("reconcile-counters")
+@with_appcontext
+def reconcile_counters_command():
+    '''
+    Rebuild the member and unresolved ticket counters from the tables, e.g. after rows were edited by hand.
+    Also adds the counters to databases created before they existed.
+    '''
+    fixed = reconcile_counters(db)
+    click.echo(f"Corrected {fixed['groups']:,} member counts and {fixed['ticket_counts']:,} unresolved ticket counts.")
+
+@click.command("startup-profile")
+@with_appcontext
+@click.option("--top", type = click.IntRange(min = 0), default = 15, show_default = True, help = "Number of the slowest imports to list.")
+def startup_profile_command(top):
+    '''
+    Time importing the app and each phase of create_app in a fresh interpreter, and list the slowest imports.
+    '''
+    try:
+        profile = profile_startup(os.path.dirname(current_app.root_path), top = top)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"{'import SupportTicketSystem':<40}{profile['import'] * 1000:>10.1f} ms")
+    click.echo(f"{'create_app':<40}{profile['create_app'] * 1000:>10.1f} ms")
+    for phase, seconds in profile["phases"].items():
+        click.echo(f"  {phase:<38}{seconds * 1000:>10.1f} ms")
+    if profile["imports"]:
+        click.echo(f"\n{'slowest imports':<40}{'self':>10}{'cumulative':>14}")
+    for row in profile["imports"]:
+        click.echo(f"{row['module']:<40}{row['self'] * 1000:>7.1f} ms{row['cumulative'] * 1000:>11.1f} ms")
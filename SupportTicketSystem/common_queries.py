@@ -1,33 +1,56 @@
 from .models import *
 from . import db
+from .database import reader
+from .cache import memberships
 from .crud_operations import *
+from .search import search_enabled, usable_terms, phrase, match, ticket_fts, comment_fts
+from sqlalchemy import select, or_, and_, literal, literal_column, func, union_all, exists
+from datetime import datetime
+from collections import namedtuple
+import base64
+import json
 
-def ordered_ticket_display(base_query):
+SEARCH_LIMIT = 50
+FEED_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+#(column, descending) pairs. The id is always last so every row has a unique position in the order
+HOME_FEED_ORDER = ((Ticket.priority, True), (Ticket.time_posted, False), (Ticket.id, False))
+MY_TICKETS_ORDER = ((Ticket.resolved, False), (Ticket.time_posted, True), (Ticket.id, True))
+
+Member = namedtuple("Member", ["id", "username", "email", "rank"])
+GroupView = namedtuple("GroupView", ["id", "group_name", "members", "member_count", "viewer_rank", "open_tickets"])
+
+def ordered_ticket_display(base_query, *order_by, limit = None):
     '''
     Given a base query of tickets,
-    returns a zip object of tickets, usernames of creators, and priority level
+    returns a list of tickets, usernames of creators, priority level, and group names
 
-    Ordered by: Highest priority and age of ticket. The oldest high priority ticket is displayed at the top.
+    The author and group are joined onto the base query, so the whole display is loaded with a single statement.
+    Ordered by: Highest priority and age of ticket unless order_by is given. The oldest high priority ticket is displayed at the top.
     '''
-    universal_tickets = base_query.order_by(Ticket.priority.desc(),Ticket.time_posted.asc()).all()
-    user_names = [User.query.filter_by(id = ticket.user_id).first().username for ticket in universal_tickets]
-    priorities = [ticket_priority_map[ticket.priority] for ticket in universal_tickets]
-    group_names = [Groups.query.get(ticket.group_id).group_name if ticket.group_id is not None else "No Group" for ticket in universal_tickets]
-    ticket_user_priority_group = zip(universal_tickets, user_names, priorities, group_names)
+    if not order_by:
+        order_by = (Ticket.priority.desc(), Ticket.time_posted.asc())
+    rows = base_query.join(User, User.id == Ticket.user_id)\
+        .outerjoin(Groups, Groups.id == Ticket.group_id)\
+        .add_columns(User.username, Groups.group_name)\
+        .order_by(*order_by).limit(limit).all()
+    ticket_user_priority_group = [(ticket, username, ticket_priority_map[ticket.priority], group_name if group_name is not None else "No Group")\
+        for ticket, username, group_name in rows]
     return ticket_user_priority_group
 
 def read_users_groups(user_id):
     '''
     Returns all the groups that the given user belongs to
     '''
-    all_groups = Groups.query.join(User_Groups, Groups.id == User_Groups.group_id).filter(User_Groups.user_id == user_id).order_by(Groups.group_name.asc()).all()
+    all_groups = reader().query(Groups).join(User_Groups, Groups.id == User_Groups.group_id).filter(User_Groups.user_id == user_id).order_by(Groups.group_name.asc()).all()
     return all_groups
 
 def read_all_users_in_group(group_id):
     '''
     Returns all users that belong to this group
     '''
-    all_users = User.query.join(User_Groups, User_Groups.group_id == group_id).filter(User_Groups.user_id == User.id).all()
+    all_users = reader().query(User).join(User_Groups, User_Groups.group_id == group_id).filter(User_Groups.user_id == User.id).all()
     return all_users
 
 def read_all_groups_not_userin(user_id):
@@ -35,9 +58,54 @@ def read_all_groups_not_userin(user_id):
     Returns all the groups that the user is not currently in
     '''
     all_users_groups = read_users_groups(user_id)
-    out_groups = Groups.query.filter(Groups.id.not_in([group.id for group in all_users_groups]))
+    out_groups = reader().query(Groups).filter(Groups.id.not_in([group.id for group in all_users_groups]))
     return out_groups
 
+def group_memberships(group_ids = None):
+    '''
+    Returns a dict of group id -> list of Members (ordered by user id) for the given groups, or every group if None.
+    Loaded with a single statement.
+    '''
+    q = reader().query(User_Groups.group_id, User.id, User.username, User.email, User_Groups.rank_in_group)\
+        .join(User, User.id == User_Groups.user_id)
+    if group_ids is not None:
+        q = q.filter(User_Groups.group_id.in_(group_ids))
+    members = {}
+    for group_id, *member in q.order_by(User_Groups.group_id, User.id):
+        members.setdefault(group_id, []).append(Member(*member))
+    return members
+
+def groups_page(user_id):
+    '''
+    Returns the groups the user is in and the groups they are not in as GroupViews ordered by name,
+    with their members, member count, number of unresolved tickets, and the user's rank in each group
+    (None if not a member) already filled in. The counts come from the counters, see counters.py.
+    '''
+    users_groups, out_groups = [], []
+    for group in _group_views(user_id):
+        (out_groups if group.viewer_rank is None else users_groups).append(group)
+    return users_groups, out_groups
+
+def group_view(group_id, user_id):
+    '''
+    Returns the GroupView of one group as the user sees it on the groups page, or None if the group does not exist
+    '''
+    return next(iter(_group_views(user_id, [group_id])), None)
+
+def _group_views(user_id, group_ids = None):
+    open_tickets = select(func.coalesce(func.sum(Group_Ticket_Counts.unresolved), 0))\
+        .where(Group_Ticket_Counts.group_id == Groups.id).scalar_subquery()
+    q = reader().query(Groups.id, Groups.group_name, Groups.member_count, open_tickets)
+    if group_ids is not None:
+        q = q.filter(Groups.id.in_(group_ids))
+    members = group_memberships(group_ids)
+    views = []
+    for group_id, group_name, member_count, group_open_tickets in q.order_by(Groups.group_name.asc()):
+        group_members = members.get(group_id, [])
+        viewer_rank = next((member.rank for member in group_members if member.id == user_id), None)
+        views.append(GroupView(group_id, group_name, group_members, member_count, viewer_rank, group_open_tickets))
+    return views
+
 def read_all_tickets_in_group(group_id):
     '''
     Returns all tickets that belong to this group
@@ -50,36 +118,198 @@ def read_rank(user_id, group_id):
     '''
     return read_user_group(db, user_id, group_id)
 
+def user_ranks(user_id):
+    '''
+    Returns a read only dict of group id -> the user's rank for every group the user is in.
+    Cached until the user's memberships change, so permission and visibility checks do not query.
+    '''
+    return memberships(reader(), user_id)
+
+def ticket_groups(ticket_ids):
+    '''
+    Returns the set of the group ids of the tickets, with None for tickets in no group
+    '''
+    return {group_id for group_id, in reader().query(Ticket.group_id).filter(Ticket.id.in_(list(ticket_ids))).distinct()}
+
 def all_unrestickets_for_user(user_id):
     '''
     Returns all tickets from all the groups that the user is currently in that they need to resolve
     '''
-    q = Ticket.query.join(User_Groups, (Ticket.group_id == User_Groups.group_id)).\
-        filter(User_Groups.user_id == user_id, Ticket.user_id != user_id, Ticket.resolved == False)\
-            .union(Ticket.query.filter(Ticket.group_id == None, Ticket.user_id != user_id, Ticket.resolved == False))
-    return ordered_ticket_display(q)
+    return ordered_ticket_display(unrestickets_for_user_query(user_id), *order_by_keys(HOME_FEED_ORDER))
+
+def unrestickets_for_user_query(user_id):
+    '''
+    Base query of the unresolved tickets by other users in the user's groups or in no group
+    '''
+    return reader().query(Ticket).filter(Ticket.user_id != user_id, Ticket.resolved == False, visible_to_user(user_id))
+
+def unrestickets_page_for_user(user_id, after = None, before = None, per_page = None):
+    '''
+    One page of all_unrestickets_for_user, see keyset_paginate
+    '''
+    return keyset_paginate(unrestickets_for_user_query(user_id), HOME_FEED_ORDER, after = after, before = before, per_page = per_page)
 
 def all_unrestickets_by_user(user_id):
     '''
     Displayable format of all unresolved tickets by a user
     '''
-    q = Ticket.query.filter(Ticket.user_id == user_id, Ticket.resolved == False)
+    q = reader().query(Ticket).filter(Ticket.user_id == user_id, Ticket.resolved == False)
     return ordered_ticket_display(q)
 
 def all_tickets_by_user(user_id):
     '''
     Displayable format of all tickets by a user
     '''
-    tickets = Ticket.query.filter(Ticket.user_id == user_id).order_by(Ticket.resolved.asc(), Ticket.time_posted.desc())
-    user_names = [User.query.filter_by(id = ticket.user_id).first().username for ticket in tickets]
-    priorities = [ticket_priority_map[ticket.priority] for ticket in tickets]
-    group_names = [Groups.query.get(ticket.group_id).group_name if ticket.group_id is not None else "No Group" for ticket in tickets]
-    ticket_user_priority_group = zip(tickets, user_names, priorities, group_names)
-    return ticket_user_priority_group
+    q = reader().query(Ticket).filter(Ticket.user_id == user_id)
+    return ordered_ticket_display(q, *order_by_keys(MY_TICKETS_ORDER))
+
+def tickets_page_by_user(user_id, after = None, before = None, per_page = None):
+    '''
+    One page of all_tickets_by_user, see keyset_paginate
+    '''
+    q = reader().query(Ticket).filter(Ticket.user_id == user_id)
+    return keyset_paginate(q, MY_TICKETS_ORDER, after = after, before = before, per_page = per_page)
 
-# def all_comments_for_ticket(ticket_id):
-#     q = Comment.query.order_by(Comment.time_posted).filter(Comment.ticket_id == ticket_id).all()
-#     return q
+def keyset_paginate(base_query, sort_keys, after = None, before = None, per_page = None):
+    '''
+    Returns one page of ordered_ticket_display for the base query.
+    Pages are found by seeking past the sort key values of the cursor row instead of using OFFSET,
+    so every page costs the same no matter how deep it is.
+
+    Parameters
+    ----------
+    base_query : query of tickets to paginate
+    sort_keys : sequence of (column, descending) pairs that uniquely order the tickets
+    after : cursor, the page will hold the tickets directly after this position
+    before : cursor, the page will hold the tickets directly before this position
+    per_page : number of tickets on the page, capped at MAX_PAGE_SIZE
+
+    Returns
+    -------
+    (ticket_user_priority_group, prev_cursor, next_cursor) : the page, and cursors for the neighbouring pages (None if there are none)
+    '''
+    if after is not None and before is not None:
+        raise ValueError("Only one of after and before can be given")
+    per_page = min(max(per_page or FEED_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    forward = before is None
+    cursor = after if forward else before
+    query = base_query
+    if cursor is not None:
+        query = query.filter(_seek_past(sort_keys, decode_cursor(cursor, sort_keys), forward))
+    rows = ordered_ticket_display(query, *order_by_keys(sort_keys, forward), limit = per_page + 1)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if forward:
+        prev_cursor = encode_cursor(rows[0][0], sort_keys) if cursor is not None and rows else None
+        next_cursor = encode_cursor(rows[-1][0], sort_keys) if has_more else None
+    elif not has_more:
+        #Walked back to the start, show a full first page instead of the leftovers
+        return keyset_paginate(base_query, sort_keys, per_page = per_page)
+    else:
+        rows.reverse()
+        prev_cursor = encode_cursor(rows[0][0], sort_keys)
+        next_cursor = encode_cursor(rows[-1][0], sort_keys)
+    return rows, prev_cursor, next_cursor
+
+def order_by_keys(sort_keys, forward = True):
+    '''
+    ORDER BY clauses for the sort keys, reversed if not forward
+    '''
+    return [column.desc() if descending == forward else column.asc() for column, descending in sort_keys]
+
+def _seek_past(sort_keys, values, forward):
+    '''
+    Filter for the rows strictly after (or before if not forward) the given sort key values
+    '''
+    clauses = []
+    for i, (column, descending) in enumerate(sort_keys):
+        value = literal(values[i], column.type)
+        past = column < value if descending == forward else column > value
+        clauses.append(and_(*[sort_keys[j][0] == literal(values[j], sort_keys[j][0].type) for j in range(i)], past))
+    return or_(*clauses)
+
+def encode_cursor(ticket, sort_keys):
+    '''
+    Encodes the ticket's sort key values as an opaque url-safe string
+    '''
+    values = [getattr(ticket, column.key) for column, _ in sort_keys]
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, sort_keys):
+    '''
+    Decodes a cursor made by encode_cursor. Throws a ValueError if it is malformed.
+    '''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(sort_keys):
+            raise ValueError
+        return [_cursor_value(value, column) for value, (column, _) in zip(values, sort_keys)]
+    except (ValueError, TypeError):
+        raise ValueError("Malformed page cursor")
+
+def _cursor_value(value, column):
+    #values go straight into the query, so anything but the column's type is rejected
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if not isinstance(value, python_type) or (python_type is int and isinstance(value, bool)):
+        raise ValueError
+    return value
+
+def ticket_detail(ticket_id):
+    '''
+    Returns the ticket, its author's username, and a list of its comments with their authors' usernames ordered by time posted.
+    Returns None if the ticket does not exist.
+
+    Loaded with two statements no matter how many comments the ticket has.
+    '''
+    ticket_author = reader().query(Ticket, User.username).join(User, User.id == Ticket.user_id).filter(Ticket.id == ticket_id).first()
+    if ticket_author is None:
+        return None
+    comment_authors = reader().query(Comment, User.username).join(User, User.id == Comment.user_id)\
+        .filter(Comment.ticket_id == ticket_id).order_by(Comment.time_posted.asc(), Comment.id.asc()).all()
+    return ticket_author[0], ticket_author[1], comment_authors
+
+def visible_to_user(user_id):
+    '''
+    Filter for the tickets the user can see, those in their groups or in no group
+    '''
+    users_groups = select(User_Groups.group_id).where(User_Groups.user_id == user_id)
+    return or_(Ticket.group_id == None, Ticket.group_id.in_(users_groups))
+
+def search_tickets(user_id, terms, limit = SEARCH_LIMIT):
+    '''
+    Searches the titles, contents and comments of the tickets the user can see for all of the given words.
+
+    Ranked by bm25 with the best match first when the full text index is available, and the best
+    scoring of a ticket and its comments counts for the ticket. Words shorter than the index can match
+    are ignored. Otherwise, or when every word is that short, falls back to substring matching
+    ordered by newest first.
+
+    Returns
+    -------
+    list : ordered_ticket_display rows of at most limit tickets
+    '''
+    words = usable_terms(terms)
+    if words and search_enabled(db):
+        query = " ".join(phrase(word) for word in words) #space separated phrases must all match
+        scores = union_all(
+            select(ticket_fts.c.rowid.label("ticket_id"), func.bm25(literal_column(ticket_fts.name)).label("score"))\
+                .where(match(ticket_fts, query)),
+            select(Comment.ticket_id, func.bm25(literal_column(comment_fts.name))).select_from(comment_fts)\
+                .join(Comment, Comment.id == comment_fts.c.rowid).where(match(comment_fts, query))
+        ).subquery()
+        best = select(scores.c.ticket_id, func.min(scores.c.score).label("score")).group_by(scores.c.ticket_id).subquery()
+        q = reader().query(Ticket).join(best, best.c.ticket_id == Ticket.id).filter(visible_to_user(user_id))
+        return ordered_ticket_display(q, best.c.score.asc(), Ticket.id.asc(), limit = limit)
+    words = terms.split()
+    if not words:
+        return []
+    matches_word = lambda word: or_(Ticket.title.ilike(f"%{word}%"), Ticket.content.ilike(f"%{word}%"),\
+        exists().where(Comment.ticket_id == Ticket.id, Comment.content.ilike(f"%{word}%")))
+    q = reader().query(Ticket).filter(visible_to_user(user_id), *[matches_word(word) for word in words])
+    return ordered_ticket_display(q, Ticket.time_posted.desc(), Ticket.id.desc(), limit = limit)
 
 def read_username(user_id):
     return read_user(db, user_id = user_id).username
@@ -0,0 +1,142 @@
+from collections import Counter
+from sqlalchemy import select, update, delete, func, bindparam, tuple_, text
+from sqlalchemy.dialects.sqlite import insert
+from .models import Groups, Ticket, User_Groups, Group_Ticket_Counts
+from .cache import invalidate_on_commit, entity_cache
+
+'''
+Denormalized counters, so checks like "is this group empty" and badges like "3 open tickets" are single row reads:
+    - Groups.member_count, the number of members of each group
+    - Group_Ticket_Counts, the number of unresolved tickets of each group and priority, with tickets in no group under NO_GROUP
+
+crud_operations updates them in the same transaction as the rows they count, with one statement per write no matter
+how many rows it touches. Rows written around crud_operations (e.g. by hand in the sqlite shell) make them drift,
+reconcile_counters (flask reconcile-counters) rebuilds them from the tables.
+'''
+
+NO_GROUP = 0
+
+groups = Groups.__table__
+ticket_counts = Group_Ticket_Counts.__table__
+
+def ticket_key(group_id, priority):
+    '''
+    The Group_Ticket_Counts key a ticket is counted under
+    '''
+    return (NO_GROUP if group_id is None else group_id, priority)
+
+def add_members(db, deltas):
+    '''
+    Adds to the member counts of groups
+
+    Parameters
+    ----------
+    deltas : dict of group id -> change in the number of members
+    '''
+    rows = [{"group_key" : group_id, "delta" : delta} for group_id, delta in deltas.items() if delta]
+    if not rows:
+        return
+    db.session.execute(update(groups).where(groups.c.id == bindparam("group_key"))\
+        .values(member_count = groups.c.member_count + bindparam("delta")), rows)
+    for row in rows:
+        invalidate_on_commit(db.session, Groups, row["group_key"])
+
+def remove_members(db, *criteria):
+    '''
+    Subtracts the memberships matching the criteria from the member counts of their groups, call before deleting them.
+    The group ids are selected first, so the cached rows of those groups can be invalidated.
+    '''
+    group_ids = db.session.execute(select(User_Groups.group_id).where(*criteria).distinct()).scalars().all()
+    if not group_ids:
+        return
+    members = select(func.count()).select_from(User_Groups).where(*criteria, User_Groups.group_id == groups.c.id).scalar_subquery()
+    db.session.execute(update(groups).where(groups.c.id.in_(group_ids))\
+        .values(member_count = groups.c.member_count - members), execution_options = {"synchronize_session" : False})
+    for group_id in group_ids:
+        invalidate_on_commit(db.session, Groups, group_id)
+
+def add_unresolved(db, deltas):
+    '''
+    Adds to the unresolved ticket counts
+
+    Parameters
+    ----------
+    deltas : dict of ticket_key -> change in the number of unresolved tickets
+    '''
+    rows = [{"group_id" : group_id, "priority" : priority, "unresolved" : delta} for (group_id, priority), delta in deltas.items() if delta]
+    if not rows:
+        return
+    upsert = insert(ticket_counts)
+    db.session.execute(upsert.on_conflict_do_update(index_elements = [ticket_counts.c.group_id, ticket_counts.c.priority],
+        set_ = {"unresolved" : ticket_counts.c.unresolved + upsert.excluded.unresolved}), rows)
+
+def count_unresolved(tickets):
+    '''
+    Counter of ticket_key -> number of unresolved tickets, for dicts or rows with group_id, priority, and resolved
+    '''
+    get = lambda ticket, key: ticket[key] if isinstance(ticket, dict) else getattr(ticket, key)
+    return Counter(ticket_key(get(ticket, "group_id"), get(ticket, "priority")) for ticket in tickets if not get(ticket, "resolved"))
+
+def remove_unresolved(db, *criteria):
+    '''
+    Subtracts the unresolved tickets matching the criteria from the counts, call before deleting them
+    '''
+    matching = lambda *columns: select(*columns).where(*criteria, Ticket.resolved == False)
+    key = (func.coalesce(Ticket.group_id, NO_GROUP), Ticket.priority)
+    tickets = matching(func.count()).where(key[0] == ticket_counts.c.group_id, key[1] == ticket_counts.c.priority).scalar_subquery()
+    db.session.execute(update(ticket_counts).where(tuple_(ticket_counts.c.group_id, ticket_counts.c.priority).in_(matching(*key)))\
+        .values(unresolved = ticket_counts.c.unresolved - tickets), execution_options = {"synchronize_session" : False})
+
+def add_unresolved_matching(db, *criteria):
+    '''
+    Adds the unresolved tickets matching the criteria to the counts, call after changing them in bulk
+    '''
+    key = (func.coalesce(Ticket.group_id, NO_GROUP), Ticket.priority)
+    tickets = select(*key, func.count()).where(*criteria, Ticket.resolved == False).group_by(*key)
+    upsert = insert(ticket_counts).from_select([ticket_counts.c.group_id, ticket_counts.c.priority, ticket_counts.c.unresolved], tickets)
+    db.session.execute(upsert.on_conflict_do_update(index_elements = [ticket_counts.c.group_id, ticket_counts.c.priority],
+        set_ = {"unresolved" : ticket_counts.c.unresolved + upsert.excluded.unresolved}))
+
+def remove_group_counts(db, group_id):
+    db.session.execute(delete(ticket_counts).where(ticket_counts.c.group_id == group_id), execution_options = {"synchronize_session" : False})
+
+def member_count(db, group_id):
+    '''
+    Number of members of the group, 0 if it does not exist
+    '''
+    return db.session.execute(select(groups.c.member_count).where(groups.c.id == group_id)).scalar() or 0
+
+def unresolved_counts(db, group_id):
+    '''
+    Dict of priority -> number of unresolved tickets in the group, or in no group if group_id is None
+    '''
+    rows = db.session.execute(select(ticket_counts.c.priority, ticket_counts.c.unresolved)\
+        .where(ticket_counts.c.group_id == ticket_key(group_id, None)[0], ticket_counts.c.unresolved != 0))
+    return dict(rows.all())
+
+def reconcile_counters(db):
+    '''
+    Rebuilds every counter from the rows it counts and commits.
+    Databases created before the counters existed get the member_count column and Group_Ticket_Counts table here.
+
+    Returns
+    -------
+    fixed : dict of the number of wrong member counts ("groups") and unresolved ticket counts ("ticket_counts") that were corrected
+    '''
+    columns = [row[1] for row in db.session.execute(text(f"PRAGMA table_info({groups.name})"))]
+    if "member_count" not in columns:
+        db.session.execute(text(f"ALTER TABLE {groups.name} ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0"))
+    ticket_counts.create(db.session.connection(), checkfirst = True)
+    members = select(func.count()).select_from(User_Groups).where(User_Groups.group_id == groups.c.id).scalar_subquery()
+    fixed_groups = db.session.execute(update(groups).where(groups.c.member_count != members).values(member_count = members),
+        execution_options = {"synchronize_session" : False}).rowcount
+    actual = {ticket_key(group_id, priority) : count for group_id, priority, count in db.session.execute(
+        select(Ticket.group_id, Ticket.priority, func.count()).where(Ticket.resolved == False).group_by(Ticket.group_id, Ticket.priority))}
+    stored = {(group_id, priority) : count for group_id, priority, count in db.session.execute(
+        select(ticket_counts.c.group_id, ticket_counts.c.priority, ticket_counts.c.unresolved)) if count != 0}
+    fixed_counts = sum(1 for key in actual.keys() | stored.keys() if actual.get(key) != stored.get(key))
+    db.session.execute(delete(ticket_counts))
+    add_unresolved(db, actual)
+    db.session.commit()
+    entity_cache(Groups).clear()
+    return {"groups" : fixed_groups, "ticket_counts" : fixed_counts}
@@ -1,11 +1,25 @@
 from .models import *
+from .cache import cached_get, invalidate_entity, invalidate_memberships
+from .search import ticket_fts, comment_fts, index_tickets, index_comments, index_rows, unindex, contains
+from .counters import add_members, remove_members, add_unresolved, add_unresolved_matching, count_unresolved, remove_unresolved, remove_group_counts
+from .fragments import invalidate_card
+from .versions import bump, bump_tickets, bump_members, ticket_scope, group_scope, user_scope, GROUPS, USERS
+from .events import queue_event, listening, snapshot
+from collections import Counter
+from sqlalchemy import text, select, case, literal
+from sqlalchemy.orm.util import identity_key
+from datetime import datetime
 import re
 from werkzeug.security import generate_password_hash
 
 '''
 CREATE
+Every create function takes commit = False to only flush the new row, so several writes can be committed together.
+Creating memberships and unresolved tickets also updates the counters in counters.py, and every write bumps the
+version stamps of the pages it changes (see versions.py). Tickets, comments, and memberships also queue the live
+events of events.py, published to open pages when the transaction commits.
 '''
-def create_user(db, email, password, username):
+def create_user(db, email, password, username, commit = True):
     '''
     Will create a user and commit them to the database. 
     Throws an ValueError if email, password, or username is invalid.
@@ -15,25 +29,19 @@ def create_user(db, email, password, username):
     email : the user's email address. UNIQUE NOT NULL
     password : the user's password. NOT NULL
     username : the user's username. NOT NULL
+    commit : whether to commit, or only flush the user to the current transaction
 
     Returns
     -------
     User : The created user object
     '''
-    if (email is None or password is None or username is None):
-        raise ValueError("Email, password, and username must be provided to create a user")
-    if not (re.fullmatch(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', email)):
-        raise ValueError("Email must be of the format: address@host.ext")
-    if len(password) < 7:
-        raise ValueError("Password is too short")
-    if len(username) < 1:
-        raise ValueError("Username can not be an empty string")
+    _validate_user(email, password, username)
     user = User(email = email, password = password, username = username)
     db.session.add(user)
-    db.session.commit()
+    _finish(db, commit)
     return user
 
-def create_comment(db, user_id, ticket_id, content, time_posted = None):
+def create_comment(db, user_id, ticket_id, content, time_posted = None, commit = True):
     '''
     Will create a comment and commit them to the database.
     Throws an argument error if any entry is None.
@@ -44,22 +52,27 @@ def create_comment(db, user_id, ticket_id, content, time_posted = None):
     ticket_id : the id of the ticket the comment belongs to
     content : The comment's content
     time_posted : The timestamp for the comment, if not input, one will be generated for you
+    commit : whether to commit, or only flush the comment to the current transaction
 
     Returns
     -------
     comment : the comment created
     '''
-    if (user_id is None or ticket_id is None or content is None):
-        raise ValueError("User id, ticket id, and content must be provided for the comment to be made")
+    _validate_comment(user_id, ticket_id, content)
     if time_posted is not None:
         comment = Comment(user_id = user_id, ticket_id = ticket_id, content = content, time_posted = time_posted)
     else:
         comment = Comment(user_id = user_id, ticket_id = ticket_id, content = content)
     db.session.add(comment)
-    db.session.commit()
+    db.session.flush()
+    index_comments(db, [comment])
+    bump(db, [ticket_scope(ticket_id)])
+    if listening():
+        queue_event(db, "comment_created", _ticket_group(db, ticket_id), comment = snapshot(comment))
+    _finish(db, commit)
     return comment
 
-def create_group(db, group_name):
+def create_group(db, group_name, commit = True):
     '''
     Will create a group and commit it to the database.
     Throws an argument error if the group name is None, or already exists.
@@ -67,6 +80,7 @@ def create_group(db, group_name):
     Parameters
     ----------
     group_name : the name of the group. UNIQUE NOT NULL
+    commit : whether to commit, or only flush the group to the current transaction
 
     Returns
     -------
@@ -78,10 +92,11 @@ def create_group(db, group_name):
         raise ValueError("Group names must be unique!")
     group = Groups(group_name = group_name)
     db.session.add(group)
-    db.session.commit()
+    bump(db, [GROUPS])
+    _finish(db, commit)
     return group
 
-def create_ticket(db, user_id, group_id, title, content, resolved = False, priority = 0, time_posted = None):
+def create_ticket(db, user_id, group_id, title, content, resolved = False, priority = 0, time_posted = None, commit = True):
     '''
     Will create a ticket and commit it to the database.
 
@@ -92,6 +107,7 @@ def create_ticket(db, user_id, group_id, title, content, resolved = False, prior
     priority : the tickets priority. 0, 1, 2
     user_id : the user the ticket belongs to. NOT NULL
     group_id : the group the ticket belongs to. NOT NULL
+    commit : whether to commit, or only flush the ticket to the current transaction
 
     Returns
     -------
@@ -105,10 +121,16 @@ def create_ticket(db, user_id, group_id, title, content, resolved = False, prior
     else:
         ticket = Ticket(user_id = user_id, group_id = group_id, title = title, content = content, resolved = resolved, time_posted = time_posted, priority=priority)
     db.session.add(ticket)
-    db.session.commit()
+    db.session.flush()
+    index_tickets(db, [ticket])
+    add_unresolved(db, count_unresolved([ticket]))
+    bump(db, [group_scope(group_id), user_scope(user_id)])
+    if listening():
+        queue_event(db, "ticket_created", group_id, ticket = snapshot(ticket))
+    _finish(db, commit)
     return ticket
 
-def create_user_group(db, user_id, group_id, rank_in_group = 0):
+def create_user_group(db, user_id, group_id, rank_in_group = 0, commit = True):
     '''
     Creates an entry in the User Groups table.
 
@@ -117,25 +139,217 @@ def create_user_group(db, user_id, group_id, rank_in_group = 0):
     user_id : the id of the user in this group
     group_id : the id of the group the user will be in
     rank_in_group : the user's rank in this group. Must be an element of {0,1,2}
+    commit : whether to commit, or only flush the user group to the current transaction
 
     Returns
     -------
     user_groups : the created user group
     '''
+    _validate_user_group(user_id, group_id, rank_in_group)
+    user_group = User_Groups(user_id = user_id, group_id = group_id, rank_in_group = rank_in_group)
+    db.session.add(user_group)
+    db.session.flush()
+    add_members(db, {group_id : 1})
+    bump(db, [GROUPS, user_scope(user_id), group_scope(group_id)])
+    invalidate_memberships(db.session, user_id)
+    queue_event(db, "membership_created", group_id, user_id = user_id, rank = rank_in_group)
+    _finish(db, commit)
+    return user_group
+
+'''
+BULK CREATE
+Validate every row in Python first, then insert them all with one executemany inside a single transaction.
+Nothing is written if any row is invalid.
+'''
+
+def create_users_bulk(db, users, commit = True):
+    '''
+    Will create many users with a single INSERT.
+    Throws a ValueError if any user is invalid, or if an email appears twice.
+
+    Parameters
+    ----------
+    users : iterable of dicts with email, password, and username keys
+    commit : whether to commit, or leave the users in the current transaction
+
+    Returns
+    -------
+    ids : the ids of the created users, in input order
+    '''
+    rows, emails = [], set()
+    for user in users:
+        _validate_user(user.get("email"), user.get("password"), user.get("username"))
+        if user["email"] in emails:
+            raise ValueError(f"Email {user['email']} appears more than once")
+        emails.add(user["email"])
+        rows.append({"email" : user["email"], "password" : generate_password_hash(user["password"], method = 'sha256'), "username" : user["username"]})
+    ids = _insert_many(db, User, rows)
+    _finish(db, commit)
+    return ids
+
+def create_comments_bulk(db, comments, commit = True):
+    '''
+    Will create many comments with a single INSERT.
+    Throws a ValueError if any comment is missing its user id, ticket id, or content.
+
+    Parameters
+    ----------
+    comments : iterable of dicts with user_id, ticket_id, content, and optionally time_posted keys
+    commit : whether to commit, or leave the comments in the current transaction
+
+    Returns
+    -------
+    ids : the ids of the created comments, in input order
+    '''
+    rows = []
+    for comment in comments:
+        _validate_comment(comment.get("user_id"), comment.get("ticket_id"), comment.get("content"))
+        rows.append({"user_id" : comment["user_id"], "ticket_id" : comment["ticket_id"], "content" : comment["content"],
+            "time_posted" : comment.get("time_posted") or datetime.utcnow()})
+    ids = _insert_many(db, Comment, rows)
+    index_rows(db, comment_fts, [{"rowid" : id, "content" : row["content"]} for id, row in zip(ids, rows)])
+    bump(db, [ticket_scope(row["ticket_id"]) for row in rows])
+    _finish(db, commit)
+    return ids
+
+def create_groups_bulk(db, group_names, commit = True):
+    '''
+    Will create many groups with a single INSERT.
+    Throws a ValueError if any name is None, appears twice, or already exists.
+
+    Parameters
+    ----------
+    group_names : iterable of the names of the groups
+    commit : whether to commit, or leave the groups in the current transaction
+
+    Returns
+    -------
+    ids : the ids of the created groups, in input order
+    '''
+    names = list(group_names)
+    if any(name is None for name in names):
+        raise ValueError("Group name can not be None")
+    if len(set(names)) != len(names) or (names and db.session.query(Groups.id).filter(Groups.group_name.in_(names)).first() is not None):
+        raise ValueError("Group names must be unique!")
+    ids = _insert_many(db, Groups, [{"group_name" : name} for name in names])
+    if ids:
+        bump(db, [GROUPS])
+    _finish(db, commit)
+    return ids
+
+def create_tickets_bulk(db, tickets, commit = True):
+    '''
+    Will create many tickets with a single INSERT.
+    Throws a ValueError if any ticket is missing its user id, title, or content, or has an invalid priority.
+
+    Parameters
+    ----------
+    tickets : iterable of dicts with user_id, group_id, title, content, and optionally resolved, priority, time_posted, and time_resolved keys
+    commit : whether to commit, or leave the tickets in the current transaction
+
+    Returns
+    -------
+    ids : the ids of the created tickets, in input order
+    '''
+    rows = []
+    for ticket in tickets:
+        if (ticket.get("user_id") is None or ticket.get("title") is None or ticket.get("content") is None):
+            raise ValueError("One or more necessary inputs is null")
+        if ticket.get("priority", 0) not in [0,1,2,3]:
+            raise ValueError(f"Priority must be 0,1,2 or 3. Entered value: {ticket['priority']} is invalid")
+        rows.append({"user_id" : ticket["user_id"], "group_id" : ticket.get("group_id"), "title" : ticket["title"], "content" : ticket["content"],
+            "resolved" : bool(ticket.get("resolved", False)), "priority" : ticket.get("priority", 0),
+            "time_posted" : ticket.get("time_posted") or datetime.utcnow(), "time_resolved" : ticket.get("time_resolved")})
+    ids = _insert_many(db, Ticket, rows)
+    index_rows(db, ticket_fts, [{"rowid" : id, "title" : row["title"], "content" : row["content"]} for id, row in zip(ids, rows)])
+    add_unresolved(db, count_unresolved(rows))
+    bump(db, [group_scope(row["group_id"]) for row in rows] + [user_scope(row["user_id"]) for row in rows])
+    _finish(db, commit)
+    return ids
+
+def create_user_groups_bulk(db, user_groups, commit = True):
+    '''
+    Will create many entries in the User Groups table with a single INSERT.
+    Throws a ValueError if any entry is missing an id or has an invalid rank.
+
+    Parameters
+    ----------
+    user_groups : iterable of dicts with user_id, group_id, and optionally rank_in_group keys
+    commit : whether to commit, or leave the entries in the current transaction
+
+    Returns
+    -------
+    keys : the (user_id, group_id) primary keys of the created entries, in input order
+    '''
+    rows = []
+    for user_group in user_groups:
+        _validate_user_group(user_group.get("user_id"), user_group.get("group_id"), user_group.get("rank_in_group", 0))
+        rows.append({"user_id" : user_group["user_id"], "group_id" : user_group["group_id"], "rank_in_group" : user_group.get("rank_in_group", 0)})
+    if rows:
+        db.session.execute(User_Groups.__table__.insert(), rows)
+    add_members(db, Counter(row["group_id"] for row in rows))
+    if rows:
+        bump(db, [GROUPS] + [user_scope(row["user_id"]) for row in rows] + [group_scope(row["group_id"]) for row in rows])
+    for user_id in {row["user_id"] for row in rows}:
+        invalidate_memberships(db.session, user_id)
+    _finish(db, commit)
+    return [(row["user_id"], row["group_id"]) for row in rows]
+
+def _insert_many(db, model, rows):
+    '''
+    Inserts the rows with one executemany and returns their ids.
+    SQLite hands out rowids one above the current maximum, and the transaction holds the write lock
+    for the whole statement, so the new ids are the consecutive run ending at last_insert_rowid().
+    '''
+    if not rows:
+        return []
+    db.session.execute(model.__table__.insert(), rows)
+    last_id = db.session.execute(text("SELECT last_insert_rowid()")).scalar()
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+def _ticket_group(db, ticket_id):
+    return db.session.query(Ticket.group_id).filter(Ticket.id == ticket_id).scalar()
+
+def _ticket_scopes(ticket):
+    return [ticket_scope(ticket.id), group_scope(ticket.group_id), user_scope(ticket.user_id)]
+
+def _finish(db, commit):
+    '''
+    Commits, or flushes so the new rows get their ids while the transaction stays open
+    '''
+    if commit:
+        db.session.commit()
+    else:
+        db.session.flush()
+
+def _validate_user(email, password, username):
+    if (email is None or password is None or username is None):
+        raise ValueError("Email, password, and username must be provided to create a user")
+    if not (re.fullmatch(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', email)):
+        raise ValueError("Email must be of the format: address@host.ext")
+    if len(password) < 7:
+        raise ValueError("Password is too short")
+    if len(username) < 1:
+        raise ValueError("Username can not be an empty string")
+
+def _validate_comment(user_id, ticket_id, content):
+    if (user_id is None or ticket_id is None or content is None):
+        raise ValueError("User id, ticket id, and content must be provided for the comment to be made")
+
+def _validate_user_group(user_id, group_id, rank_in_group):
     if rank_in_group not in [0,1,2]:
         raise ValueError("Rank must be an element of {0,1,2}, provided rank: {rank_in_group} is invalid.")
     if (user_id is None or group_id is None):
         raise ValueError("Both user id and group id must be provided")
-    user_group = User_Groups(user_id = user_id, group_id = group_id, rank_in_group = rank_in_group)
-    db.session.add(user_group)
-    db.session.commit()
-    return user_group
 
 '''
 READ
+Every read function can also stream its results, or load only some columns. With either option the results are always
+a list or iterator, even when looking up a single id.
 '''
+STREAM_BATCH_SIZE = 1000
 
-def read_user(db, user_id = None, email = None, username = None):
+def read_user(db, user_id = None, email = None, username = None, stream = False, batch_size = STREAM_BATCH_SIZE, columns = None):
     '''
     Will attempt to query users by the specified parameters.
     If no parameters are passed, it will return ALL users in the database.
@@ -143,16 +357,23 @@ def read_user(db, user_id = None, email = None, username = None):
 
     Parameters
     ----------
-    id : the user's unique id in the database.
+    id : the user's unique id in the database. Looked up through the entity cache when it is the only parameter.
     email : the user's email address.
     username : the user's username.
-    
+    stream : return an iterator that loads batch_size rows at a time instead of a list, to walk large tables in constant memory
+    batch_size : number of rows loaded per batch when streaming
+    columns : model columns to load instead of whole objects, e.g. [Ticket.id, Ticket.title]. The results are then rows of those values.
+
     Returns
     -------
     User(s) : User(s) that match the specified parameters
     '''
-    if (user_id is None and email is None and username is None):
-        return db.session.query(User).all()
+    if not (stream or columns):
+        if (user_id is None and email is None and username is None):
+            return db.session.query(User).all()
+        if email is None and username is None:
+            user = cached_get(db.session, User, user_id)
+            return user if user is not None else []
     query = db.session.query(User)
     if user_id is not None:
         query = query.filter(User.id == user_id)
@@ -160,12 +381,14 @@ def read_user(db, user_id = None, email = None, username = None):
         query = query.filter(User.email == email)
     if username is not None:
         query = query.filter(User.username == username)
+    if stream or columns:
+        return _results(query, stream, batch_size, columns)
     if query.all() and len(query.all()) == 1:
         return query.first()
     else:
         return query.all()
 
-def read_comment(db, id = None, time_posted = None, content = None, ticket_id = None, user_id = None):
+def read_comment(db, id = None, time_posted = None, content = None, ticket_id = None, user_id = None, stream = False, batch_size = STREAM_BATCH_SIZE, columns = None):
     '''
     Will attempt to query comments by the specified parameters.
     If no parameters are passed, it will return ALL comments in the database.
@@ -174,56 +397,66 @@ def read_comment(db, id = None, time_posted = None, content = None, ticket_id =
     ----------
     id : the comment's id in the database
     time_posted : Length 2 indexable. Will include all tickets posted in the time between entry 0 and 1 inclusive.
-    content : String of ticket content, will find all comments that contain that string
+    content : String of ticket content, will find all comments that contain that string. Uses the full text index when possible.
     ticket_id : the id of the ticket in the database
     user_id : the id of the user in the database
+    stream : return an iterator that loads batch_size rows at a time instead of a list, to walk large tables in constant memory
+    batch_size : number of rows loaded per batch when streaming
+    columns : model columns to load instead of whole objects, e.g. [Ticket.id, Ticket.title]. The results are then rows of those values.
 
     Returns
     -------
     comment(s) : all comment(s) that match the specified search criteria
     '''
-    if (id is None and time_posted is None and content is None and ticket_id is None and user_id is None):
-        return db.session.query(Comment).all()
-    if id is not None:
+    if id is not None and not (stream or columns):
         return db.session.query(Comment).get(id)
     query = db.session.query(Comment)
+    if id is not None:
+        query = query.filter(Comment.id == id)
     if time_posted is not None:
         if len(time_posted) != 2:
             raise ValueError("Time posted must be given as an indexable data structure with 2 entries where the element at 0 is the minimum time, and the element at 1 is the maximum time")
         else:
             query = query.filter(Comment.time_posted >= time_posted[0]).filter(Comment.time_posted <= time_posted[1])
     if content is not None:
-        query = query.filter(Comment.content.ilike(f"%{content}%"))
+        query = query.filter(contains(db, Comment.content, comment_fts, content))
     if ticket_id is not None:
         query = query.filter(Comment.ticket_id == ticket_id)
     if user_id is not None:
         query = query.filter(Comment.user_id == user_id)
-    return query.all()
+    return _results(query, stream, batch_size, columns)
 
-def read_group(db, id = None, group_name = None, approximate_match = False):
+def read_group(db, id = None, group_name = None, approximate_match = False, stream = False, batch_size = STREAM_BATCH_SIZE, columns = None):
     '''
     Will attempt to query groups by the specified parameters
     If no parameters are passed, it will return ALL groups in the database.
 
     Parameters
     ----------
+    id : the group's id, looked up through the entity cache
     group_name : the name of the group
     approximate_search : whether to conduct an ILIKE query. By default looks for an exact match. 
+    stream : return an iterator that loads batch_size rows at a time instead of a list, to walk large tables in constant memory
+    batch_size : number of rows loaded per batch when streaming
+    columns : model columns to load instead of whole objects, e.g. [Ticket.id, Ticket.title]. The results are then rows of those values.
 
     Returns
     -------
     group(s) : all groups that match the search parameters
     '''
-    if id is None and group_name is None:
-        return db.session.query(Groups).all()
-    elif id is not None:
-        return db.session.query(Groups).get(id)
-    elif not approximate_match:
-        return db.session.query(Groups).filter(Groups.group_name == group_name).all()
-    else:
-        return db.session.query(Groups).filter(Groups.group_name.ilike(f"%{group_name}%")).all()
+    if id is not None and not (stream or columns):
+        return cached_get(db.session, Groups, id)
+    query = db.session.query(Groups)
+    if id is not None:
+        query = query.filter(Groups.id == id)
+    elif group_name is not None and not approximate_match:
+        query = query.filter(Groups.group_name == group_name)
+    elif group_name is not None:
+        query = query.filter(Groups.group_name.ilike(f"%{group_name}%"))
+    return _results(query, stream, batch_size, columns)
 
-def read_ticket(db, id = None, time_posted = None, time_resolved = None, title = None, content = None, resolved = None, priority = None, user_id = None, group_id = None):
+def read_ticket(db, id = None, time_posted = None, time_resolved = None, title = None, content = None, resolved = None, priority = None, user_id = None, group_id = None,
+    stream = False, batch_size = STREAM_BATCH_SIZE, columns = None):
     '''
     Will attempt to find all tickets matching the input criteria
 
@@ -232,23 +465,25 @@ def read_ticket(db, id = None, time_posted = None, time_resolved = None, title =
     id : ticket id
     time_posted : indexable length-2 structure that specifies a time range of when tickets were posted. (inclusive)
     time_resolved : indexable length-2 structure that specifies a time range of when tickets were resolved. (inclusive)
-    title : string to search for in the titles, does an approximate match. (not case sensitive)
-    content : string to search for in the contnet, does an approximate match. (not case sensitive)
+    title : string to search for in the titles, does an approximate match. (not case sensitive, uses the full text index when possible)
+    content : string to search for in the contnet, does an approximate match. (not case sensitive, uses the full text index when possible)
     resolved : filter by whether tickets were resolved or not
     priority : filter by the priority rank of the tickets. DOES NOT check for valid priority range, if invalid the results will simply be empty.
     user_id : filter tickets by the id of the user who made them
     group_id : filter tickets by the id of the group they belong to
-    
+    stream : return an iterator that loads batch_size rows at a time instead of a list, to walk large tables in constant memory
+    batch_size : number of rows loaded per batch when streaming
+    columns : model columns to load instead of whole objects, e.g. [Ticket.id, Ticket.title]. The results are then rows of those values.
+
     Returns
     -------
     ticket(s) : all ticket(s) matching search criteria
     '''
-    if id is None and time_posted is None and time_resolved is None and title is None and content is None and resolved is None and priority is None\
-        and user_id is None and group_id is None:
-        return db.session.query(Ticket).all()
-    if id is not None:
+    if id is not None and not (stream or columns):
         return db.session.query(Ticket).get(id)
     query = db.session.query(Ticket)
+    if id is not None:
+        query = query.filter(Ticket.id == id)
     if time_posted is not None:
         if len(time_posted) != 2:
             raise ValueError("time posted must be a valid time range, or contain 2 entries of the same time")
@@ -260,9 +495,9 @@ def read_ticket(db, id = None, time_posted = None, time_resolved = None, title =
         else:
             query = query.filter(Ticket.time_resolved >= time_resolved[0]).filter(Ticket.time_resolved <= time_resolved[1])
     if title is not None:
-        query = query.filter(Ticket.title.ilike(f"%{title}%"))
+        query = query.filter(contains(db, Ticket.title, ticket_fts, title))
     if content is not None:
-        query = query.filter(Ticket.content.ilike(f"%{content}%"))
+        query = query.filter(contains(db, Ticket.content, ticket_fts, content))
     if resolved is not None:
         query = query.filter(Ticket.resolved == resolved)
     if priority is not None:
@@ -271,9 +506,9 @@ def read_ticket(db, id = None, time_posted = None, time_resolved = None, title =
         query = query.filter(Ticket.user_id == user_id)
     if group_id is not None:
         query = query.filter(Ticket.group_id == group_id)
-    return query.all()
+    return _results(query, stream, batch_size, columns)
 
-def read_user_group(db, user_id = None, group_id = None, rank_in_group = None):
+def read_user_group(db, user_id = None, group_id = None, rank_in_group = None, stream = False, batch_size = STREAM_BATCH_SIZE, columns = None):
     '''
     Will attempt to search for all user groups matching the specified critera.
 
@@ -282,10 +517,11 @@ def read_user_group(db, user_id = None, group_id = None, rank_in_group = None):
     user_id : the user id for this assignment
     group_id : the group id for this assignment
     rank_in_group : the rank of the user in this group
+    stream : return an iterator that loads batch_size rows at a time instead of a list, to walk large tables in constant memory
+    batch_size : number of rows loaded per batch when streaming
+    columns : model columns to load instead of whole objects, e.g. [Ticket.id, Ticket.title]. The results are then rows of those values.
     '''
-    if user_id is None and group_id is None and rank_in_group is None:
-        return db.session.query(User_Groups).all()
-    if user_id is not None and group_id is not None:
+    if user_id is not None and group_id is not None and not (stream or columns):
         return db.session.query(User_Groups).get((user_id, group_id)) #the 2 ids are the primary keys
     query = db.session.query(User_Groups)
     if user_id is not None:
@@ -294,11 +530,24 @@ def read_user_group(db, user_id = None, group_id = None, rank_in_group = None):
         query = query.filter(User_Groups.group_id == group_id)
     if rank_in_group is not None:
         query = query.filter(User_Groups.rank_in_group == rank_in_group)
+    return _results(query, stream, batch_size, columns)
+
+def _results(query, stream, batch_size, columns):
+    '''
+    The rows of the query as a list, or as an iterator when streaming. yield_per fetches and builds batch_size rows
+    at a time, and the session only holds weak references to unmodified objects, so rows the caller is done with are freed.
+    '''
+    if columns:
+        query = query.with_entities(*columns)
+    if stream:
+        return iter(query.yield_per(batch_size))
     return query.all()
 
 '''
 UPDATE 
 Must specify id of the exact entry you are updating, no wide-sweeping updates are allowed.
+update_ticket and update_user_group also take commit = False, so they can be committed together with other writes.
+update_tickets_bulk changes many tickets with one UPDATE, for triage.
 '''
 
 def update_user(db, id, email = None, password = None, username = None):
@@ -336,7 +585,9 @@ def update_user(db, id, email = None, password = None, username = None):
             raise ValueError("Username must contain at least 1 character")
         else:
             user.username = username
+    bump(db, [USERS])
     db.session.commit()
+    invalidate_entity(User, id)
     return user
     
 
@@ -364,6 +615,7 @@ def update_comment(db, id, time_posted = None, content = None, ticket_id = None,
         raise ValueError("ID does not belong to a commment in the database")
     if time_posted is None and content is None and ticket_id is None and user_id is None:
         return comment
+    bump(db, [ticket_scope(comment.ticket_id), ticket_scope(ticket_id if ticket_id is not None else comment.ticket_id)])
     if time_posted is not None:
         comment.time_posted = time_posted
     if content is not None:
@@ -372,6 +624,8 @@ def update_comment(db, id, time_posted = None, content = None, ticket_id = None,
         comment.ticket_id = ticket_id
     if user_id is not None:
         comment.user_id = user_id
+    if content is not None:
+        index_comments(db, [comment])
     db.session.commit()
     return comment
 
@@ -395,11 +649,13 @@ def update_group(db, id, group_name = None):
         return group
     else:
         group.group_name = group_name
+    bump(db, [GROUPS])
     db.session.commit()
+    invalidate_entity(Groups, id)
     return group
 
 def update_ticket(db, id, time_posted = None, time_resolved = None, title = None, content = None,\
-     resolved = None, priority = None, user_id = None, group_id = None, nullgroup = False):
+     resolved = None, priority = None, user_id = None, group_id = None, nullgroup = False, commit = True):
     '''
     Will update the ticket's entries to the given inputs
 
@@ -415,6 +671,7 @@ def update_ticket(db, id, time_posted = None, time_resolved = None, title = None
     user_id : The creator of the ticket
     group_id : The group that this ticket belongs to. (NULLABLE)
     nullgroup : Whether to move this ticket to the null group.
+    commit : whether to commit, or only flush the changes to the current transaction
 
     Returns
     -------
@@ -423,6 +680,9 @@ def update_ticket(db, id, time_posted = None, time_resolved = None, title = None
     ticket = read_ticket(db, id = id)
     if ticket is None:
         raise ValueError("ID provided does not correspond to a ticket in the database")
+    counted = count_unresolved([ticket])
+    scopes = _ticket_scopes(ticket)
+    was_resolved, old_group_id = ticket.resolved, ticket.group_id
     if time_posted is not None:
         ticket.time_posted = time_posted
     if time_resolved is not None:
@@ -444,11 +704,116 @@ def update_ticket(db, id, time_posted = None, time_resolved = None, title = None
         ticket.group_id = group_id
     if nullgroup:
         ticket.group_id = None
-    db.session.commit()
+    if title is not None or content is not None:
+        index_tickets(db, [ticket])
+    moved = count_unresolved([ticket])
+    moved.subtract(counted)
+    add_unresolved(db, moved)
+    bump(db, scopes + _ticket_scopes(ticket))
+    _queue_ticket_change(db, ticket, old_group_id, was_resolved)
+    _finish(db, commit)
+    invalidate_card(id)
     return ticket
-    
 
-def update_user_group(db, user_id, group_id, rank_in_group = None):
+def update_tickets_bulk(db, ids, resolved = None, time_resolved = None, priority = None, group_id = None, nullgroup = False, commit = True):
+    '''
+    Will update many tickets with a single UPDATE ... WHERE id IN (...), e.g. to resolve, reprioritize, or move them after triage.
+    The counters and version stamps are updated with a fixed number of statements however many tickets change.
+    Resolving sets time_resolved to now for the tickets that were not resolved yet, and reopening clears it, unless a
+    time_resolved is given.
+    Throws a ValueError if there is nothing to change or the priority is invalid.
+
+    Parameters
+    ----------
+    ids : the ids of the tickets to update, ids of tickets that do not exist are ignored
+    resolved : whether the tickets are resolved
+    time_resolved : the datetime they were resolved
+    priority : their new priority level [0,1,2,3]
+    group_id : the group to move them to
+    nullgroup : whether to move them to the null group
+    commit : whether to commit, or only flush the changes to the current transaction
+
+    Returns
+    -------
+    int : the number of tickets updated
+    '''
+    values = {}
+    if resolved is not None:
+        values[Ticket.resolved] = resolved
+        if resolved and time_resolved is None:
+            time_resolved = case((Ticket.resolved == True, Ticket.time_resolved), else_ = literal(datetime.utcnow(), Ticket.time_resolved.type))
+        elif time_resolved is None:
+            values[Ticket.time_resolved] = None #reopened tickets have not been resolved
+    if time_resolved is not None:
+        values[Ticket.time_resolved] = time_resolved
+    if priority is not None:
+        if priority not in [0,1,2,3]:
+            raise ValueError(f"Priority must be 0,1,2 or 3. Entered value: {priority} is invalid")
+        values[Ticket.priority] = priority
+    moved = group_id is not None or nullgroup
+    if moved:
+        values[Ticket.group_id] = None if nullgroup else group_id
+    if not values:
+        raise ValueError("No changes were given")
+    ids = sorted(set(ids))
+    if not ids:
+        return 0
+    criteria = [Ticket.id.in_(ids)]
+    before = db.session.query(Ticket.id, Ticket.group_id, Ticket.resolved).filter(*criteria).all() if listening() else []
+    remove_unresolved(db, *criteria)
+    bump_tickets(db, *criteria)
+    updated = db.session.query(Ticket).filter(*criteria).update(values, synchronize_session = False)
+    add_unresolved_matching(db, *criteria)
+    if moved:
+        bump(db, [group_scope(values[Ticket.group_id])])
+    keys = {identity_key(Ticket, id) for id in ids} #matched by key, reading ticket.id would load expired tickets
+    for key, ticket in list(db.session.identity_map.items()):
+        if key in keys:
+            db.session.expire(ticket)
+    if before:
+        tickets = {ticket.id : ticket for ticket in db.session.query(Ticket).filter(*criteria)}
+        for id, old_group_id, was_resolved in before:
+            _queue_ticket_change(db, tickets[id], old_group_id, was_resolved)
+    _finish(db, commit)
+    for id in ids:
+        invalidate_card(id)
+    return updated
+
+def _queue_ticket_change(db, ticket, old_group_id, was_resolved):
+    if ticket.group_id != old_group_id: #leaves the pages of the old group's members, and appears on the new group's
+        queue_event(db, "ticket_deleted", old_group_id, ticket_id = ticket.id)
+        queue_event(db, "ticket_created", ticket.group_id, ticket = snapshot(ticket))
+    elif ticket.resolved != was_resolved:
+        queue_event(db, "ticket_resolved" if ticket.resolved else "ticket_reopened", ticket.group_id, ticket = snapshot(ticket))
+
+RESOLVE_COMMENT = "I resolved this ticket"
+
+def resolve_ticket(db, id, user_id, commit = True):
+    '''
+    Will mark the ticket resolved and post the comment identifying who resolved it, in one transaction.
+    Throws a ValueError if the ticket does not exist or is already resolved.
+
+    Parameters
+    ----------
+    id : the id of the ticket to resolve
+    user_id : the user resolving it, the author of the comment
+    commit : whether to commit, or only flush the changes to the current transaction
+
+    Returns
+    -------
+    (ticket, comment) : the resolved ticket and the comment posted
+    '''
+    ticket = read_ticket(db, id = id)
+    if ticket is None:
+        raise ValueError("ID provided does not correspond to a ticket in the database")
+    if ticket.resolved:
+        raise ValueError("Ticket is already resolved")
+    comment = create_comment(db, user_id, id, RESOLVE_COMMENT, commit = False)
+    ticket = update_ticket(db, id, resolved = True, time_resolved = datetime.utcnow(), commit = commit)
+    return ticket, comment
+
+
+def update_user_group(db, user_id, group_id, rank_in_group = None, commit = True):
     '''
     Will update the given user-group. The user's and group's ids are both primary keys for this table, so both
     are required to uniquely identify the specific usergroup. These ids are not supposed to change, so to move a user to
@@ -459,6 +824,7 @@ def update_user_group(db, user_id, group_id, rank_in_group = None):
     user_id : the user's id
     group_id : the group's id
     rank_in_group : this user's rank in this group
+    commit : whether to commit, or only flush the change to the current transaction
 
     Returns
     -------
@@ -472,17 +838,24 @@ def update_user_group(db, user_id, group_id, rank_in_group = None):
             raise ValueError("Attempting to rerank user to an invalid rating")
         else:
             user_group.rank_in_group = rank_in_group
-    db.session.commit()
+    bump(db, [GROUPS, user_scope(user_id), group_scope(group_id)])
+    invalidate_memberships(db.session, user_id)
+    _finish(db, commit)
     return user_group
 
 '''
 DELETE
 Must specify the id of the exact item you are deleting. No wide-sweeping deletions of data allowed.
+Deleting a user, group, or ticket also deletes the rows that belong to it, with one set based DELETE per table in a single transaction.
+The counters in counters.py and the version stamps in versions.py are updated in the same transaction, and the cached
+memberships of the users affected are invalidated.
+delete_ticket, delete_comment, and delete_user_group also take commit = False.
 '''
 
 def delete_user(db, id):
     '''
-    Will delete a user given the user's id in the database
+    Will delete a user given the user's id in the database,
+    along with their group memberships, their comments, and their tickets and every comment on them
 
     Parameters
     ----------
@@ -493,34 +866,49 @@ def delete_user(db, id):
     None : user deleted, null value output
     '''
     if id is not None:
+        _delete_tickets(db, Ticket.user_id == id)
+        unindex(db, comment_fts, select(Comment.id).where(Comment.user_id == id))
+        db.session.query(Comment).filter(Comment.user_id == id).delete(synchronize_session = "fetch")
+        remove_members(db, User_Groups.user_id == id)
+        db.session.query(User_Groups).filter(User_Groups.user_id == id).delete(synchronize_session = "fetch")
         db.session.query(User).filter(User.id == id).delete()
+        bump(db, [USERS, GROUPS, user_scope(id)])
+        invalidate_memberships(db.session, id)
         db.session.commit()
+        invalidate_entity(User, id)
         return None
     else:
         raise ValueError("ID is not defined")
 
-def delete_comment(db, id):
+def delete_comment(db, id, commit = True):
     '''
     Will delete a comment with the given id
 
     Parameters
     ----------
     id : the comment's id - if provided, it will ONLY delete this comment
+    commit : whether to commit, or only flush the deletion to the current transaction
 
     Returns
     -------
     None : comment deleted
     '''
     if id is not None:
+        ticket_id = db.session.query(Comment.ticket_id).filter(Comment.id == id).scalar()
         db.session.query(Comment).filter(Comment.id == id).delete()
-        db.session.commit()
+        unindex(db, comment_fts, [id])
+        if ticket_id is not None:
+            bump(db, [ticket_scope(ticket_id)])
+            if listening():
+                queue_event(db, "comment_deleted", _ticket_group(db, ticket_id), comment_id = id, ticket_id = ticket_id)
+        _finish(db, commit)
         return None
     else:
         raise ValueError("ID is not defined")
 
 def delete_group(db, id):
     '''
-    Will delete group with the given id
+    Will delete group with the given id, along with its memberships, and its tickets and every comment on them
 
     Parameters
     ----------
@@ -531,32 +919,58 @@ def delete_group(db, id):
     None : group has been deleted
     '''
     if id is not None:
+        _delete_tickets(db, Ticket.group_id == id)
+        remove_group_counts(db, id)
+        bump_members(db, User_Groups.group_id == id)
+        db.session.query(User_Groups).filter(User_Groups.group_id == id).delete(synchronize_session = "fetch")
         db.session.query(Groups).filter(Groups.id == id).delete()
+        bump(db, [GROUPS, group_scope(id)])
+        invalidate_memberships(db.session) #any number of users lost the group
         db.session.commit()
+        invalidate_entity(Groups, id)
         return None
     else:
         raise ValueError("ID is not defined")
 
-def delete_ticket(db, id):
+def delete_ticket(db, id, commit = True):
     '''
-    Will delete ticket with the given id
+    Will delete ticket with the given id, along with every comment on it
 
     Parameters
     ----------
     id : the id of the ticket
+    commit : whether to commit, or only flush the deletion to the current transaction
 
     Returns
     -------
     None : ticket has been deleted
     '''
     if id is not None:
-        db.session.query(Ticket).filter(Ticket.id == id).delete()
-        db.session.commit()
+        if listening():
+            queue_event(db, "ticket_deleted", _ticket_group(db, id), ticket_id = id)
+        _delete_tickets(db, Ticket.id == id)
+        _finish(db, commit)
+        invalidate_card(id)
         return None
     else:
         raise ValueError("ID is not defined")
 
-def delete_user_group(db, user_id, group_id):
+def _delete_tickets(db, *criteria):
+    '''
+    Deletes the tickets matching the criteria, their comments, and their index rows without committing.
+    Each table is cleared with one DELETE no matter how many rows match, the "fetch" synchronization adds one SELECT
+    of the matching ids so deleted rows are dropped from the session.
+    '''
+    remove_unresolved(db, *criteria)
+    bump_tickets(db, *criteria)
+    ticket_ids = select(Ticket.id).where(*criteria)
+    comment_ids = select(Comment.id).where(Comment.ticket_id.in_(ticket_ids))
+    unindex(db, comment_fts, comment_ids)
+    db.session.query(Comment).filter(Comment.ticket_id.in_(ticket_ids)).delete(synchronize_session = "fetch")
+    unindex(db, ticket_fts, ticket_ids)
+    db.session.query(Ticket).filter(*criteria).delete(synchronize_session = "fetch")
+
+def delete_user_group(db, user_id, group_id, commit = True):
     '''
     Will delete user_group with the given id
 
@@ -564,14 +978,20 @@ def delete_user_group(db, user_id, group_id):
     ----------
     user_id : the id of the user for the group
     group_id : the id of the group the user is in
+    commit : whether to commit, or only flush the deletion to the current transaction
 
     Returns
     -------
     None : user_group has been deleted
     '''
     if id is not None:
-        db.session.query(User_Groups).filter(User_Groups.user_id == user_id).filter(User_Groups.group_id == group_id).delete()
-        db.session.commit()
+        removed = db.session.query(User_Groups).filter(User_Groups.user_id == user_id).filter(User_Groups.group_id == group_id).delete()
+        add_members(db, {group_id : -removed})
+        bump(db, [GROUPS, user_scope(user_id), group_scope(group_id)])
+        invalidate_memberships(db.session, user_id)
+        if removed:
+            queue_event(db, "membership_deleted", group_id, user_id = user_id)
+        _finish(db, commit)
         return None
     else:
         raise ValueError("ID is not defined")
\ No newline at end of file
@@ -0,0 +1,142 @@
+from functools import partial
+from urllib.parse import quote
+from flask import current_app
+from sqlalchemy import event, create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from . import db
+try:
+    from greenlet import getcurrent as _scope_ident #the same scope as db.session: the current greenlet, or thread
+except ImportError:
+    from threading import get_ident as _scope_ident
+
+'''
+Database profiles, chosen with the DATABASE_PROFILE config value.
+
+"default" leaves SQLite as it is. "production" is for a file database shared by many concurrent requests:
+    - WAL journaling, so readers never block the writer and the writer never blocks readers
+    - synchronous = NORMAL, which is durable against application crashes in WAL mode and much faster than FULL
+    - a busy timeout, so a writer waits for the lock instead of failing with "database is locked"
+    - a memory mapped file and a larger page cache per connection, kept alive by a connection pool
+    - foreign key enforcement
+    - reads routed to a separate read only engine, see below
+
+Individual pragmas can be overridden with the SQLITE_PRAGMAS config dict, and engine options with SQLALCHEMY_ENGINE_OPTIONS.
+
+Read routing: the pages that only read (the feed, my tickets, the groups page, ticket detail, search, and export) query
+through reader(), while crud_operations keeps writing through db.session. With SEPARATE_READS on (the production default),
+reader() is a session on a second engine with its own connection pool, opened on the same file with mode=ro, or on
+SQLALCHEMY_READ_DATABASE_URI when a replica is configured. In WAL mode long reads then never wait on, or hold up, a
+write. Reads made through reader() do not see writes of the same request that are not committed yet.
+In memory databases cannot be opened twice, so there reader() is always db.session.
+
+Savepoints: the sqlite3 driver only opens a transaction before INSERT, UPDATE, and DELETE, so a SAVEPOINT issued first
+would open it instead, and releasing that savepoint would commit everything. A BEGIN is sent before such savepoints.
+'''
+
+DATABASE_PROFILES = {
+    "default" : {"pragmas" : {}, "engine_options" : {}, "separate_reads" : False},
+    "production" : {
+        "pragmas" : {
+            "journal_mode" : "WAL",
+            "synchronous" : "NORMAL",
+            "busy_timeout" : 5000, #milliseconds
+            "mmap_size" : 256 * 1024 * 1024, #bytes
+            "cache_size" : -64000, #negative sizes are in KiB, so 64MB
+            "foreign_keys" : "ON",
+            "temp_store" : "MEMORY",
+        },
+        #Only used for file databases, in memory databases always use a single shared connection
+        "engine_options" : {
+            "poolclass" : QueuePool,
+            "pool_size" : 5,
+            "max_overflow" : 10,
+            "pool_timeout" : 30,
+            "connect_args" : {"check_same_thread" : False}, #pooled connections move between request threads
+        },
+        "separate_reads" : True,
+    },
+}
+
+def init_database_profile(app):
+    '''
+    Applies the app's DATABASE_PROFILE. Must run after db.init_app and before anything else uses the engine.
+    Throws a ValueError if the profile does not exist.
+    '''
+    name = app.config.get("DATABASE_PROFILE", "default")
+    if name not in DATABASE_PROFILES:
+        raise ValueError(f"DATABASE_PROFILE must be one of {', '.join(DATABASE_PROFILES)}, not {name}")
+    profile = DATABASE_PROFILES[name]
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {**profile["engine_options"], **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})}
+    pragmas = {**profile["pragmas"], **app.config.get("SQLITE_PRAGMAS", {})}
+    app.config["SQLITE_PRAGMAS"] = pragmas
+    with app.app_context():
+        engine = db.get_engine()
+    if engine.dialect.name == "sqlite" and pragmas:
+        event.listen(engine, "connect", partial(apply_pragmas, pragmas))
+    app.extensions["read_engine"] = create_read_engine(app, engine, profile) #None when reads share db.session
+    app.teardown_appcontext(_remove_read_session)
+
+def create_read_engine(app, engine, profile):
+    '''
+    The engine reader() uses, or None if reads should go through db.session
+    '''
+    replica = app.config.get("SQLALCHEMY_READ_DATABASE_URI")
+    if replica is None and not app.config.get("SEPARATE_READS", profile["separate_reads"]):
+        return None
+    url = make_url(replica) if replica is not None else engine.url
+    if url.get_backend_name() != "sqlite":
+        return create_engine(url, **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    if url.database in (None, "", ":memory:"):
+        return None
+    if replica is None:
+        #engine.url has the path already resolved against the app's root path
+        url = url.set(database = "file:" + quote(url.database), query = {"mode" : "ro", "uri" : "true"})
+    read_engine = create_engine(url, **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    #journal_mode is a property of the file, set through the primary, and a read only connection cannot change it
+    pragmas = {pragma : value for pragma, value in app.config["SQLITE_PRAGMAS"].items() if pragma != "journal_mode"}
+    event.listen(read_engine, "connect", partial(apply_pragmas, {**pragmas, "query_only" : "ON"}))
+    return read_engine
+
+class ReadSession(Session):
+    '''
+    Session bound to the read engine of the current app
+    '''
+    def get_bind(self, mapper = None, clause = None, **kwargs):
+        return current_app.extensions["read_engine"]
+
+read_session = scoped_session(sessionmaker(class_ = ReadSession, query_cls = db.Query, autoflush = False), scopefunc = _scope_ident)
+
+def reader():
+    '''
+    The session to run read only queries with: read_session if the app routes reads to a read engine, otherwise db.session
+    '''
+    return read_session if current_app.extensions.get("read_engine") is not None else db.session
+
+@event.listens_for(Engine, "savepoint")
+def _begin_before_savepoint(conn, name):
+    if conn.dialect.name == "sqlite" and not conn.connection.connection.in_transaction:
+        conn.exec_driver_sql("BEGIN")
+
+def _remove_read_session(exception):
+    read_session.remove()
+
+def apply_pragmas(pragmas, dbapi_connection, connection_record):
+    '''
+    Runs on every new connection, pragmas other than journal_mode only last as long as the connection
+    '''
+    cursor = dbapi_connection.cursor()
+    for pragma, value in pragmas.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+def pragma(engine, name):
+    '''
+    The current value of a pragma on a pooled connection of the engine
+    '''
+    with engine.connect() as connection:
+        return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
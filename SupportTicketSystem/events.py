@@ -0,0 +1,172 @@
+from queue import Queue, Empty, Full
+from threading import Lock
+from types import SimpleNamespace
+from flask import current_app
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, inspect
+
+'''
+Live updates for the pages that are open, pushed to the browser over Server-Sent Events by /events.
+
+crud_operations queues an event for every ticket created, resolved, reopened, moved, or deleted, every comment posted
+or deleted, and every membership created or deleted. The events of a transaction are published to the app's
+EventBroker when it commits, and dropped if it rolls back, so a stream never shows a write that did not happen.
+Rolling back a SAVEPOINT drops only the events queued since it began.
+Events are only built while someone is subscribed, so writes cost nothing extra when no page is listening.
+
+The broker is in process: each /events stream subscribes with the groups its user is in and only receives the
+events of those groups and of tickets without a group. Membership events keep those groups up to date. A ticket's author
+is not sent its ticket_created and ticket_reopened events, because the home feed leaves out the viewer's own tickets. Each
+subscriber has a bounded queue, a subscriber that falls behind is sent "overflow" instead of the events it missed
+and should reload. With several worker processes a stream only hears about the writes of its own process.
+Bulk creates (e.g. imports) and deleting a user or a group do not publish events for the rows they write.
+'''
+
+DEFAULT_EVENT_QUEUE_SIZE = 256
+DEFAULT_EVENT_KEEPALIVE = 15 #seconds between comments that keep idle connections open
+
+OVERFLOW = {"type" : "overflow"}
+FEED_INSERTS = ("ticket_created", "ticket_reopened") #add a ticket to the home feed, which leaves out the viewer's own tickets
+
+class Subscription:
+    '''
+    One stream's view of the broker: the user it belongs to, the groups it hears about, and its queue of events
+    '''
+    def __init__(self, user_id, group_ids, queue_size):
+        self.user_id = user_id
+        self.group_ids = set(group_ids) | {None} #tickets without a group are visible to everyone
+        self.overflowed = False
+        self._queue = Queue(queue_size)
+
+    def next(self, timeout = None):
+        '''
+        Returns the next event, or None if there was none within timeout seconds
+        '''
+        if self.overflowed:
+            self.overflowed = False
+            return OVERFLOW
+        try:
+            return self._queue.get(timeout = timeout)
+        except Empty:
+            return None
+
+    def _put(self, event):
+        if self.overflowed:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except Full:
+            #the missed events cannot be replayed, so the page is told to reload instead
+            with self._queue.mutex:
+                self._queue.queue.clear()
+            self.overflowed = True
+
+class EventBroker:
+    '''
+    Thread safe in process publish and subscribe of the events of committed writes
+    '''
+    def __init__(self, queue_size = DEFAULT_EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.published = 0
+        self._subscriptions = set()
+        self._lock = Lock()
+
+    def subscribe(self, user_id, group_ids):
+        '''
+        Starts delivering the events of the groups (and of tickets without a group) to a new subscription
+        '''
+        subscription = Subscription(user_id, group_ids, self.queue_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def listening(self):
+        '''
+        Whether anyone is subscribed, writes skip building events when no one is
+        '''
+        return bool(self._subscriptions)
+
+    def publish(self, events):
+        '''
+        Delivers each event to the subscriptions that can see it.
+        Membership events first add or remove the group of the user's subscriptions, so the user hears about it.
+        The author of a ticket is not sent the events that would add it to their feed.
+        '''
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            self.published += len(events)
+        for event in events:
+            for subscription in subscriptions:
+                if event["type"] == "membership_created" and subscription.user_id == event["user_id"]:
+                    subscription.group_ids.add(event["group_id"])
+                own_ticket = event["type"] in FEED_INSERTS and event["ticket"].user_id == subscription.user_id
+                if event["group_id"] in subscription.group_ids and not own_ticket:
+                    subscription._put(event)
+                if event["type"] == "membership_deleted" and subscription.user_id == event["user_id"]:
+                    subscription.group_ids.discard(event["group_id"])
+
+    def stats(self):
+        return {"subscribers" : len(self._subscriptions), "published" : self.published}
+
+def init_events(app):
+    '''
+    Gives the app its event broker
+    '''
+    app.extensions["event_broker"] = EventBroker(app.config.get("EVENT_QUEUE_SIZE", DEFAULT_EVENT_QUEUE_SIZE))
+
+def event_broker():
+    return current_app.extensions["event_broker"]
+
+def listening():
+    '''
+    Whether any stream of this app is subscribed. False outside of apps without a broker, e.g. in scripts.
+    '''
+    broker = current_app.extensions.get("event_broker")
+    return broker is not None and broker.listening()
+
+def queue_event(db, type, group_id, **fields):
+    '''
+    Adds an event to the current transaction, it is published when the transaction commits.
+    Callers check listening() first when building the event needs queries.
+
+    Parameters
+    ----------
+    type : e.g. ticket_created, see the module docstring for the others
+    group_id : the group whose members may see the event, None if everyone may
+    fields : the rest of the event, e.g. ticket = snapshot(ticket)
+    '''
+    if listening():
+        db.session.info.setdefault("pending_events", []).append(dict(fields, type = type, group_id = group_id))
+
+def snapshot(row):
+    '''
+    The column values of the row as they are now, safe to read from other threads after the session moved on
+    '''
+    return SimpleNamespace(**{attr.key : getattr(row, attr.key) for attr in inspect(row).mapper.column_attrs})
+
+@event.listens_for(SignallingSession, "after_commit")
+def _publish_pending(session):
+    session.info.pop("savepoint_marks", None)
+    events = session.info.pop("pending_events", None)
+    if events:
+        event_broker().publish(events)
+
+@event.listens_for(SignallingSession, "after_transaction_create")
+def _mark_savepoint(session, transaction):
+    if transaction.nested:
+        session.info.setdefault("savepoint_marks", {})[transaction] = len(session.info.get("pending_events", []))
+
+@event.listens_for(SignallingSession, "after_soft_rollback")
+def _drop_rolled_back(session, previous_transaction):
+    #after_rollback also fires when only a SAVEPOINT was rolled back, this tells them apart
+    if previous_transaction.parent is None:
+        session.info.pop("savepoint_marks", None)
+        session.info.pop("pending_events", None)
+        return
+    mark = session.info.get("savepoint_marks", {}).pop(previous_transaction, None)
+    if mark is not None and "pending_events" in session.info:
+        del session.info["pending_events"][mark:]
@@ -0,0 +1,129 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from .models import Ticket, Comment, User, Groups
+from .common_queries import visible_to_user
+from .database import reader
+
+'''
+Streams tickets, optionally with their comments, as CSV or NDJSON.
+
+Tickets are read in batches of batch_size ordered by id, each batch seeking past the last id of the previous one,
+and the read transaction is ended between batches. Memory stays constant however many tickets are exported, and
+SQLite is never held in one long read that would keep writers waiting. Reads go through reader(), so with separate
+reads on an export never shares a connection with the writes of the app.
+'''
+
+EXPORT_BATCH_SIZE = 1000
+FORMATS = {"csv" : "text/csv", "ndjson" : "application/x-ndjson"}
+TICKET_FIELDS = ("id", "title", "content", "priority", "resolved", "time_posted", "time_resolved", "user_id", "author_email", "group_id", "group_name")
+COMMENT_FIELDS = ("id", "content", "time_posted", "user_id", "author_email")
+
+def export_tickets(db, format = "ndjson", group_id = None, since = None, until = None, comments = False, visible_to = None, batch_size = EXPORT_BATCH_SIZE):
+    '''
+    Generator of the export, one chunk of text per batch of tickets.
+    Ends the session's transaction between batches, so it must not be run with uncommitted changes.
+
+    Parameters
+    ----------
+    format : "csv" or "ndjson"
+    group_id : only export the tickets of this group
+    since : only export tickets posted at or after this datetime
+    until : only export tickets posted before this datetime
+    comments : whether to include the comments of each ticket. NDJSON nests them in a comments list, CSV repeats the
+        ticket on one row per comment with the comment_ columns filled in.
+    visible_to : only export the tickets this user id can see
+    batch_size : number of tickets read per batch
+
+    Returns
+    -------
+    generator : str chunks of the export
+    '''
+    if format not in FORMATS:
+        raise ValueError(f"Format must be one of {', '.join(FORMATS)}")
+    write = _csv_writer(comments) if format == "csv" else _ndjson_writer
+    header = write(None, None)
+    if header:
+        yield header
+    query = select(Ticket.id, Ticket.title, Ticket.content, Ticket.priority, Ticket.resolved, Ticket.time_posted, Ticket.time_resolved,
+        Ticket.user_id, User.email.label("author_email"), Ticket.group_id, Groups.group_name)\
+        .join(User, User.id == Ticket.user_id).outerjoin(Groups, Groups.id == Ticket.group_id)\
+        .order_by(Ticket.id).limit(batch_size)
+    if group_id is not None:
+        query = query.where(Ticket.group_id == group_id)
+    if since is not None:
+        query = query.where(Ticket.time_posted >= since)
+    if until is not None:
+        query = query.where(Ticket.time_posted < until)
+    if visible_to is not None:
+        query = query.where(visible_to_user(visible_to))
+    session = reader()
+    last_id = 0
+    while True:
+        tickets = session.execute(query.where(Ticket.id > last_id)).all()
+        if not tickets:
+            break
+        last_id = tickets[-1].id
+        ticket_comments = _comments_of(session, [ticket.id for ticket in tickets]) if comments else None
+        session.commit() #end the read transaction while the batch is sent
+        yield write(tickets, ticket_comments)
+        if len(tickets) < batch_size:
+            break
+
+def _comments_of(session, ticket_ids):
+    '''
+    Dict of ticket id -> comment rows in posting order, for all the tickets with one statement
+    '''
+    rows = session.execute(select(Comment.ticket_id, Comment.id, Comment.content, Comment.time_posted, Comment.user_id, User.email.label("author_email"))\
+        .join(User, User.id == Comment.user_id).where(Comment.ticket_id.in_(ticket_ids))\
+        .order_by(Comment.ticket_id, Comment.time_posted, Comment.id))
+    comments = {}
+    for row in rows:
+        comments.setdefault(row.ticket_id, []).append(row)
+    return comments
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _ndjson_writer(tickets, comments):
+    if tickets is None:
+        return "" #no header
+    lines = []
+    for ticket in tickets:
+        record = {field : _value(getattr(ticket, field)) for field in TICKET_FIELDS}
+        if comments is not None:
+            record["comments"] = [{field : _value(getattr(comment, field)) for field in COMMENT_FIELDS} for comment in comments.get(ticket.id, [])]
+        lines.append(json.dumps(record) + "\n")
+    return "".join(lines)
+
+def _csv_writer(with_comments):
+    columns = TICKET_FIELDS + tuple("comment_" + field for field in COMMENT_FIELDS) if with_comments else TICKET_FIELDS
+    def write(tickets, comments):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if tickets is None:
+            writer.writerow(columns)
+            return buffer.getvalue()
+        for ticket in tickets:
+            values = [_value(getattr(ticket, field)) for field in TICKET_FIELDS]
+            if comments is None:
+                writer.writerow(values)
+                continue
+            for comment in comments.get(ticket.id) or [None]: #a ticket without comments still gets its row
+                writer.writerow(values + [_value(getattr(comment, field)) if comment else None for field in COMMENT_FIELDS])
+        return buffer.getvalue()
+    return write
+
+def parse_time(value, end = False):
+    '''
+    Parses an ISO date or datetime. A bare date used as the end of a range means the end of that day.
+    Throws a ValueError if the value is malformed.
+    '''
+    if value is None or value == "":
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10: #YYYY-MM-DD
+        parsed += timedelta(days = 1)
+    return parsed
@@ -0,0 +1,58 @@
+from flask import current_app
+from markupsafe import Markup
+from .cache import SizedLRUCache
+
+'''
+Cache of the rendered HTML of ticket cards, so the feeds, my tickets, and search results mostly concatenate
+cached cards and only render the cards of tickets that changed.
+
+A card is cached under the ticket's id with a fingerprint of everything it shows. When any of that changed
+(e.g. update_ticket moved it, or its author was renamed) the fingerprint no longer matches and the card is
+rendered again, so a stale card is never shown, even when another process made the change. Each process only
+holds one card per ticket, and the cache is bounded by FRAGMENT_CACHE_BYTES.
+'''
+
+DEFAULT_FRAGMENT_CACHE_BYTES = 16 * 1024 * 1024
+DEFAULT_FRAGMENT_CACHE_TTL = 3600 #seconds
+
+def init_fragment_cache(app):
+    '''
+    Gives the app its card cache, and makes ticket_card available to templates
+    '''
+    app.extensions["fragment_cache"] = SizedLRUCache(app.config.get("FRAGMENT_CACHE_BYTES", DEFAULT_FRAGMENT_CACHE_BYTES),
+        app.config.get("FRAGMENT_CACHE_TTL", DEFAULT_FRAGMENT_CACHE_TTL), sizeof = lambda entry: len(entry[1]) + 200)
+    app.add_template_global(ticket_card)
+
+def fragment_cache():
+    return current_app.extensions["fragment_cache"]
+
+def ticket_card(ticket, name, priority, group_name, show_resolved = False):
+    '''
+    The card of a ticket in a list of tickets, rendered from ticket_card.html or taken from the cache
+
+    Parameters
+    ----------
+    ticket : the ticket
+    name : username of the ticket's author
+    priority : display name of the ticket's priority
+    group_name : name of the ticket's group
+    show_resolved : whether to show when the ticket was resolved
+    '''
+    key = (ticket.id, show_resolved)
+    fingerprint = (ticket.title, priority, ticket.time_posted, ticket.time_resolved if show_resolved else None, name, group_name)
+    cache = fragment_cache()
+    cached = cache.get(key)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    card = Markup(current_app.jinja_env.get_template("ticket_card.html").render(ticket = ticket, name = name, priority = priority,
+        group_name = group_name, show_resolved = show_resolved))
+    cache.set(key, (fingerprint, card))
+    return card
+
+def invalidate_card(ticket_id):
+    '''
+    Drops the cached cards of the ticket, so the memory is freed before the cards would be evicted
+    '''
+    if "fragment_cache" in current_app.extensions:
+        for show_resolved in (False, True):
+            fragment_cache().invalidate((ticket_id, show_resolved))
@@ -0,0 +1,187 @@
+import csv
+import json
+import secrets
+from datetime import datetime
+from time import perf_counter
+from sqlalchemy import select
+from .models import User, Groups, User_Groups, Import_Checkpoint
+from .crud_operations import create_users_bulk, create_groups_bulk, create_user_groups_bulk, create_tickets_bulk, create_comments_bulk
+from .export import TICKET_FIELDS, COMMENT_FIELDS
+
+'''
+Imports tickets and their comments from NDJSON or CSV in the format written by export.py, e.g. when migrating from another tracker.
+
+The input is read as a stream and written in batches, one transaction per batch. Authors are matched to users by
+email and groups by name through lookup tables loaded once at the start. Unknown users (with a random password)
+and groups are created, and authors and commenters of group tickets are made members of the group.
+Ticket and comment ids of the source are not kept.
+
+Every batch saves how many records of the source have been imported in the same transaction, so an interrupted
+import resumes after the last committed batch when run again.
+'''
+
+IMPORT_BATCH_SIZE = 5000
+
+class TicketImporter:
+    '''
+    Writes batches of ticket records, keeping the email, group name, and membership lookups up to date as it creates rows
+    '''
+    def __init__(self, db, create_missing_users = True):
+        self.db = db
+        self.create_missing_users = create_missing_users
+        self.users = dict(db.session.execute(select(User.email, User.id)).all())
+        self.groups = dict(db.session.execute(select(Groups.group_name, Groups.id)).all())
+        self.memberships = set(db.session.execute(select(User_Groups.user_id, User_Groups.group_id)).all())
+        self.groups_with_members = {group_id for _, group_id in self.memberships}
+        self.counts = {"tickets" : 0, "comments" : 0, "users" : 0, "groups" : 0, "memberships" : 0}
+
+    def import_batch(self, records):
+        '''
+        Inserts the records without committing. Throws a ValueError naming the record if one is invalid.
+
+        Parameters
+        ----------
+        records : list of (record number, ticket dict) pairs, see read_records
+        '''
+        for number, record in records:
+            _validate(number, record)
+        self._create_users({record["author_email"] for _, record in records} |
+            {comment["author_email"] for _, record in records for comment in record["comments"]})
+        self._create_groups({record["group_name"] for _, record in records if record.get("group_name")})
+        memberships = []
+        for _, record in records:
+            group_id = self.groups.get(record.get("group_name"))
+            if group_id is None:
+                continue
+            for email in [record["author_email"]] + [comment["author_email"] for comment in record["comments"]]:
+                key = (self.users[email], group_id)
+                if key not in self.memberships:
+                    self.memberships.add(key)
+                    memberships.append({"user_id" : key[0], "group_id" : group_id, "rank_in_group" : 0 if group_id in self.groups_with_members else 2})
+                    self.groups_with_members.add(group_id) #the first member of a group is its admin
+        create_user_groups_bulk(self.db, memberships, commit = False)
+        ticket_ids = create_tickets_bulk(self.db, [{"user_id" : self.users[record["author_email"]], "group_id" : self.groups.get(record.get("group_name")),
+            "title" : record["title"], "content" : record["content"], "priority" : record["priority"], "resolved" : record["resolved"],
+            "time_posted" : record["time_posted"], "time_resolved" : record["time_resolved"]} for _, record in records], commit = False)
+        comment_ids = create_comments_bulk(self.db, [{"user_id" : self.users[comment["author_email"]], "ticket_id" : ticket_id,
+            "content" : comment["content"], "time_posted" : comment["time_posted"]}
+            for ticket_id, (_, record) in zip(ticket_ids, records) for comment in record["comments"]], commit = False)
+        self.counts["tickets"] += len(ticket_ids)
+        self.counts["comments"] += len(comment_ids)
+        self.counts["memberships"] += len(memberships)
+
+    def _create_users(self, emails):
+        missing = sorted(email for email in emails if email not in self.users)
+        if not missing:
+            return
+        if not self.create_missing_users:
+            raise ValueError(f"No user has the email {missing[0]}")
+        ids = create_users_bulk(self.db, [{"email" : email, "password" : secrets.token_urlsafe(16), "username" : email.split("@")[0][:50]}
+            for email in missing], commit = False)
+        self.users.update(zip(missing, ids))
+        self.counts["users"] += len(ids)
+
+    def _create_groups(self, names):
+        missing = sorted(name for name in names if name not in self.groups)
+        if missing:
+            self.groups.update(zip(missing, create_groups_bulk(self.db, missing, commit = False)))
+            self.counts["groups"] += len(missing)
+
+def import_tickets(db, records, source, batch_size = IMPORT_BATCH_SIZE, restart = False, create_missing_users = True, progress = None):
+    '''
+    Imports a stream of ticket records in batches, resuming after the checkpoint of the source unless restart is True.
+
+    Parameters
+    ----------
+    records : iterable of ticket dicts, see read_records
+    source : name the checkpoint is saved under, e.g. the path of the file being imported
+    batch_size : number of tickets written per transaction
+    restart : import from the first record even if an earlier run of the source got further
+    create_missing_users : create users for unknown emails instead of failing
+    progress : optional callable(counts, elapsed seconds) called after every batch
+
+    Returns
+    -------
+    summary : dict of the number of rows created in each table, the record the import resumed after, the elapsed
+        seconds, and the tickets and rows written per second
+    '''
+    checkpoint = db.session.get(Import_Checkpoint, source)
+    resumed_after = 0 if restart or checkpoint is None else checkpoint.position
+    importer = TicketImporter(db, create_missing_users)
+    start = perf_counter()
+    batch = []
+    def write(position):
+        try:
+            importer.import_batch(batch)
+            db.session.merge(Import_Checkpoint(source = source, position = position, updated_at = datetime.utcnow()))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        batch.clear()
+        if progress:
+            progress(importer.counts, perf_counter() - start)
+    position = 0
+    for position, record in enumerate(records, 1):
+        if position <= resumed_after:
+            continue
+        batch.append((position, record))
+        if len(batch) == batch_size:
+            write(position)
+    if batch:
+        write(position)
+    elapsed = perf_counter() - start
+    counts = importer.counts
+    rows = sum(counts.values())
+    return dict(counts, resumed_after = resumed_after, elapsed = elapsed,
+        tickets_per_second = counts["tickets"] / elapsed if elapsed else 0, rows_per_second = rows / elapsed if elapsed else 0)
+
+def read_records(file, format):
+    '''
+    Generator of the tickets in an export file, as dicts with the TICKET_FIELDS and a list of comment dicts.
+    CSV rows of the same ticket id (one per comment) are merged into one ticket.
+    '''
+    if format == "ndjson":
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                record["comments"] = [_comment(comment) for comment in record.get("comments") or []]
+                yield _ticket(record)
+        return
+    if format != "csv":
+        raise ValueError("Format must be csv or ndjson")
+    ticket, last_id = None, None
+    for row in csv.DictReader(file):
+        row = {key : value if value != "" else None for key, value in row.items()}
+        if ticket is None or row.get("id") is None or row["id"] != last_id:
+            if ticket is not None:
+                yield ticket
+            ticket, last_id = _ticket(dict(row, comments = [])), row.get("id")
+        if row.get("comment_content") is not None:
+            ticket["comments"].append(_comment({field : row.get("comment_" + field) for field in COMMENT_FIELDS}))
+    if ticket is not None:
+        yield ticket
+
+def _ticket(record):
+    ticket = {field : record.get(field) for field in TICKET_FIELDS}
+    ticket["priority"] = int(ticket["priority"]) if ticket["priority"] is not None else 0
+    ticket["resolved"] = ticket["resolved"] in (True, 1, "1", "True", "true")
+    ticket["time_posted"] = _time(ticket["time_posted"])
+    ticket["time_resolved"] = _time(ticket["time_resolved"])
+    ticket["comments"] = record["comments"]
+    return ticket
+
+def _comment(record):
+    return {"content" : record.get("content"), "author_email" : record.get("author_email"), "time_posted" : _time(record.get("time_posted"))}
+
+def _time(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def _validate(number, record):
+    if not record.get("title") or record.get("content") is None or not record.get("author_email"):
+        raise ValueError(f"Record {number}: title, content, and author_email are required")
+    if record["priority"] not in (0, 1, 2, 3):
+        raise ValueError(f"Record {number}: priority must be 0, 1, 2, or 3")
+    for comment in record["comments"]:
+        if comment["content"] is None or not comment["author_email"]:
+            raise ValueError(f"Record {number}: comments need content and an author_email")
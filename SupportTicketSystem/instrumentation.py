@@ -0,0 +1,94 @@
+import json
+import logging
+from contextlib import contextmanager
+from time import perf_counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+Counts the SQL statements each request issues and the time spent in them.
+
+Every response carries the counts in the X-SQL-Statements and X-SQL-Time-Ms headers, and one JSON line
+per request is logged to the "SupportTicketSystem.instrumentation" logger, keyed by the endpoint (e.g. views.groups).
+Turned off with SQL_INSTRUMENTATION = False.
+
+query_budget is the test side of the same counting, it fails when a block issues more statements than allowed.
+'''
+
+STATEMENTS_HEADER = "X-SQL-Statements"
+TIME_HEADER = "X-SQL-Time-Ms"
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(AssertionError):
+    '''
+    Raised by query_budget when the block issued more statements than its budget
+    '''
+    pass
+
+def init_instrumentation(app):
+    '''
+    Starts counting the statements of every request made to the app
+    '''
+    if not app.config.get("SQL_INSTRUMENTATION", True):
+        return
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+def _start_request():
+    g.sql_statements = 0
+    g.sql_time = 0.0
+    g.request_start = perf_counter()
+
+def _finish_request(response):
+    if "request_start" not in g:
+        return response #a before_request hook registered earlier returned a response
+    sql_ms = round(g.sql_time * 1000, 3)
+    response.headers[STATEMENTS_HEADER] = str(g.sql_statements)
+    response.headers[TIME_HEADER] = str(sql_ms)
+    logger.info(json.dumps({"endpoint" : request.endpoint, "method" : request.method, "status" : response.status_code,
+        "statements" : g.sql_statements, "sql_ms" : sql_ms, "request_ms" : round((perf_counter() - g.request_start) * 1000, 3)}))
+    return response
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.statement_start = perf_counter() #kept on the execution, so failed statements leave nothing behind
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "sql_statements" in g:
+        g.sql_statements += 1
+        g.sql_time += perf_counter() - getattr(context, "statement_start", perf_counter())
+
+@contextmanager
+def record_statements():
+    '''
+    Records the (statement, parameters) of everything executed on any engine while the block runs
+    '''
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+@contextmanager
+def query_budget(max_statements):
+    '''
+    Fails with QueryBudgetExceeded if the block executes more than max_statements statements.
+
+        with query_budget(3):
+            client.get("/groups")
+
+    Yields the list of recorded (statement, parameters), so the count can also be inspected.
+    '''
+    with record_statements() as statements:
+        yield statements
+    if len(statements) > max_statements:
+        listing = "\n".join(f"  {statement}" for statement, _ in statements)
+        raise QueryBudgetExceeded(f"{len(statements)} statements were executed, the budget is {max_statements}:\n{listing}")
@@ -32,6 +32,11 @@ class Ticket(db.Model):
     '''
     Ticket Schema
     '''
+    __table_args__ = (
+        db.Index("ix_ticket_group_feed", "group_id", "resolved", "priority", "time_posted"), #feeds and group listings
+        db.Index("ix_ticket_user_feed", "user_id", "resolved", "time_posted"), #a user's own tickets
+    )
+
     id = db.Column(db.Integer, primary_key = True)
 
     time_posted = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
@@ -53,6 +58,10 @@ class Comment(db.Model):
     '''
     Comment schema
     '''
+    __table_args__ = (
+        db.Index("ix_comment_ticket_time", "ticket_id", "time_posted"), #comments of a ticket in posting order
+    )
+
     id = db.Column(db.Integer, primary_key = True)
     time_posted = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
     content = db.Column(db.Text, nullable = False)
@@ -66,12 +75,41 @@ class Groups(db.Model):
     '''
     id = db.Column(db.Integer, primary_key = True)
     group_name = db.Column(db.String(100), unique = True, nullable = False)
+    member_count = db.Column(db.Integer, nullable = False, default = 0) #kept up to date by crud_operations, see counters.py
 
 
 class User_Groups(db.Model):
     '''
     User groups schema
     '''
+    __table_args__ = (
+        db.Index("ix_user_groups_group", "group_id", "user_id"), #members of a group, the primary key covers groups of a user
+    )
+
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key = True)
     group_id = db.Column(db.Integer, db.ForeignKey("groups.id"), primary_key = True)
-    rank_in_group = db.Column(db.Integer, nullable = False, default = 0)
\ No newline at end of file
+    rank_in_group = db.Column(db.Integer, nullable = False, default = 0)
+
+class Group_Ticket_Counts(db.Model):
+    '''
+    Number of unresolved tickets of each group and priority, kept up to date by crud_operations, see counters.py
+    '''
+    group_id = db.Column(db.Integer, primary_key = True, autoincrement = False) #0 for tickets in no group, so not a foreign key
+    priority = db.Column(db.Integer, primary_key = True, autoincrement = False)
+    unresolved = db.Column(db.Integer, nullable = False, default = 0)
+
+class Version_Stamps(db.Model):
+    '''
+    Version of a scope of rows (a ticket, a group's tickets, ...) bumped whenever one of them changes, see versions.py
+    '''
+    scope = db.Column(db.String(40), primary_key = True) #e.g. "ticket:12"
+    version = db.Column(db.Integer, nullable = False, default = 0)
+    updated_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+
+class Import_Checkpoint(db.Model):
+    '''
+    How many records of an import source have been imported, saved in the same transaction as each batch
+    '''
+    source = db.Column(db.String(255), primary_key = True)
+    position = db.Column(db.Integer, nullable = False, default = 0)
+    updated_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
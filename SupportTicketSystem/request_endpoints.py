@@ -1,13 +1,26 @@
-from flask import Blueprint, request, flash, jsonify
-from flask_login import login_required
+from flask import Blueprint, request, jsonify, abort, Response, stream_with_context, render_template, current_app
+from flask_login import login_required, current_user
 import json
 from . import db
-from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
 
 from . import crud_operations
+from .cache import entity_cache_stats
+from .counters import member_count
+from .database import reader
+from .events import event_broker, DEFAULT_EVENT_KEEPALIVE
+from .fragments import fragment_cache, ticket_card
+from .models import ticket_priority_map
+from .common_queries import unrestickets_page_for_user, tickets_page_by_user, ticket_detail, group_view, user_ranks, read_username,\
+    read_users_groups, ticket_groups
+from .export import export_tickets, parse_time, FORMATS
 
 request_endpoints = Blueprint('request_endpoints', __name__)
 
+'''
+The actions below return the entity they changed, so the page can patch itself in place instead of reloading
+'''
+
 @request_endpoints.route("/post-comment", methods = ["POST"])
 @login_required
 def post_comment():
@@ -15,8 +28,8 @@ def post_comment():
     user_id = data["userID"]
     ticket_id = data["ticketID"]
     new_comment = data["commentContent"]
-    crud_operations.create_comment(db, content = new_comment, ticket_id = ticket_id, user_id = user_id)
-    return jsonify({}) #Return empty
+    comment = crud_operations.create_comment(db, content = new_comment, ticket_id = ticket_id, user_id = user_id)
+    return jsonify(comment = _comment_json(comment, read_username(user_id)))
 
 @request_endpoints.route("/delete-comment", methods = ["DELETE"])
 @login_required
@@ -24,28 +37,78 @@ def delete_comment():
     data = json.loads(request.data)
     comment_id = data["commentID"]
     crud_operations.delete_comment(db, id = comment_id)
-    return jsonify({}) #Return empty
+    return jsonify(deleted = comment_id)
 
 @request_endpoints.route("/delete-ticket", methods = ["DELETE"])
 @login_required
 def delete_ticket():
     data = json.loads(request.data)
     ticket_id = data["ticketID"]
-    # First delete all the comments belonging to the ticket
-    for comment in crud_operations.read_comment(db, ticket_id = ticket_id):
-        crud_operations.delete_comment(db, id = comment.id)
-    crud_operations.delete_ticket(db, id = ticket_id)
-    return jsonify({}) #Return empty
+    crud_operations.delete_ticket(db, id = ticket_id) #also deletes the ticket's comments
+    return jsonify(deleted = ticket_id)
 
 @request_endpoints.route("/resolve-ticket", methods = ["PATCH"])
 @login_required
 def resolve_ticket():
+    '''
+    Resolves the ticket and posts the resolving comment in one transaction, or reopens the ticket if it was resolved
+    '''
     data = json.loads(request.data)
     ticket_id = data["ticketID"]
     ticket = crud_operations.read_ticket(db, id = ticket_id)
-    crud_operations.update_ticket(db, id = ticket_id, resolved = not ticket.resolved, time_resolved = datetime.utcnow())
-    flash("Successfully resolved the ticket!", category="success")
-    return jsonify({}) #Return empty
+    if ticket is None:
+        abort(404)
+    if ticket.resolved:
+        ticket = crud_operations.update_ticket(db, id = ticket_id, resolved = False)
+        return jsonify(ticket = _ticket_json(ticket), comment = None, message = "Reopened the ticket")
+    ticket, comment = crud_operations.resolve_ticket(db, id = ticket_id, user_id = current_user.id)
+    return jsonify(ticket = _ticket_json(ticket), comment = _comment_json(comment, current_user.username), message = "Successfully resolved the ticket!")
+
+@request_endpoints.route("/update-tickets", methods = ["PATCH"])
+@login_required
+def update_tickets():
+    '''
+    Resolves, reopens, reprioritizes, or moves many tickets with one UPDATE. The body has ticketIDs and any of
+    resolved (true or false), priority, and groupID (null for no group).
+    Permissions are checked once per group of the tickets, with the rules of the single ticket page: members may resolve
+    and reopen, changing the priority or group needs admin rank in the ticket's group and membership in the new one.
+    '''
+    try:
+        data = json.loads(request.data)
+        ticket_ids = [int(ticket_id) for ticket_id in data["ticketIDs"]]
+    except (ValueError, KeyError, TypeError):
+        abort(400)
+    if len(ticket_ids) > current_app.config.get("BATCH_LIMIT", BATCH_LIMIT):
+        abort(400)
+    #checked before the permissions, which compare groupID with the user's groups
+    if "resolved" in data and not isinstance(data["resolved"], bool):
+        abort(400)
+    if "priority" in data and not _is_int(data["priority"]):
+        abort(400)
+    if "groupID" in data and data["groupID"] is not None and not _is_int(data["groupID"]):
+        abort(400)
+    changes = {}
+    if "resolved" in data:
+        changes["resolved"] = data["resolved"]
+    if "priority" in data:
+        changes["priority"] = data["priority"]
+    if "groupID" in data and data["groupID"] is None:
+        changes["nullgroup"] = True
+    elif "groupID" in data:
+        changes["group_id"] = data["groupID"]
+    groups = ticket_groups(ticket_ids)
+    ranks = user_ranks(current_user.id)
+    if any(group_id is not None and group_id not in ranks for group_id in groups):
+        return jsonify(message = "You are not in the group of every ticket"), 403
+    if ("priority" in changes or "groupID" in data) and any(group_id is not None and ranks[group_id] != 2 for group_id in groups):
+        return jsonify(message = "Only a group's admins can change the priority or group of its tickets"), 403
+    if data.get("groupID") is not None and data["groupID"] not in ranks:
+        return jsonify(message = "Tickets can only be moved to your groups"), 403
+    try:
+        updated = crud_operations.update_tickets_bulk(db, ticket_ids, **changes)
+    except ValueError as error:
+        return jsonify(message = str(error)), 400
+    return jsonify(updated = updated, message = f"Updated {updated} ticket{'s' if updated != 1 else ''}")
 
 @request_endpoints.route("/leave-group", methods = ["DELETE"])
 @login_required
@@ -53,14 +116,13 @@ def leave_group():
     data = json.loads(request.data)
     user_id = data["userID"]
     group_id = data["groupID"]
-    user_groups = crud_operations.read_user_group(db, group_id = group_id)
     #If you're leaving the group, and only 1 person will be left, promote them
-    if (len(user_groups) == 2):
-        for user_group in user_groups:
+    if member_count(db, group_id) == 2:
+        for user_group in crud_operations.read_user_group(db, group_id = group_id):
             if user_group.user_id != user_id:
                 crud_operations.update_user_group(db, user_id = user_group.user_id, group_id = group_id, rank_in_group = 2)
     crud_operations.delete_user_group(db, user_id = user_id, group_id= group_id)
-    return jsonify({}) #Return empty
+    return _membership_response(user_id, group_id)
 
 @request_endpoints.route("/join-group", methods = ["POST"])
 @login_required
@@ -68,12 +130,11 @@ def join_group():
     data = json.loads(request.data)
     user_id = data["userID"]
     group_id = data["groupID"]
-    user_groups = crud_operations.read_user_group(db, group_id=group_id)
-    if not user_groups: #If you're joining an empty group, become its admin
+    if member_count(db, group_id) == 0: #If you're joining an empty group, become its admin
         crud_operations.create_user_group(db, user_id = user_id, group_id = group_id, rank_in_group= 2)
     else: #If you're joining a non-empty group, you will be the default rank
         crud_operations.create_user_group(db, user_id = user_id, group_id = group_id)
-    return jsonify({}) #Return empty
+    return _membership_response(user_id, group_id)
 
 @request_endpoints.route("/rerank-user", methods = ["PATCH"])
 @login_required
@@ -85,7 +146,7 @@ def rerank_user():
     #Only rerank if it's a request for a new rank
     if (new_rank != crud_operations.read_user_group(db, user_id, group_id).rank_in_group):
         crud_operations.update_user_group(db, user_id, group_id, rank_in_group = new_rank)
-    return jsonify({}) #Return empty
+    return _membership_response(user_id, group_id)
 
 @request_endpoints.route("/kick-user", methods = ["DELETE"])
 @login_required
@@ -94,5 +155,282 @@ def kick_user():
     user_id = data["userID"]
     group_id = data["groupID"]
     crud_operations.delete_user_group(db, user_id = user_id, group_id = group_id)
-    return jsonify({}) #Return empty
+    return _membership_response(user_id, group_id)
+
+@request_endpoints.route("/batch", methods = ["POST"])
+@login_required
+def batch():
+    '''
+    Applies a list of operations in one transaction, e.g. to triage many tickets in one request. The body is
+    {"operations" : [{"op" : "resolve", "ticketID" : 1}, ...]}, with the fields of the single endpoints:
+        comment : ticketID, commentContent
+        resolve : ticketID
+        delete : ticketID or commentID
+        rerank : userID, groupID, newRank
+        kick : userID, groupID
+    Each operation runs in a SAVEPOINT, so one that fails (e.g. for lack of permission) is undone on its own and the
+    others are still committed. Returns one result per operation, in order, with "ok" and either what the single
+    endpoint would return or an "error".
+    '''
+    try:
+        operations = json.loads(request.data)["operations"]
+    except (ValueError, KeyError, TypeError):
+        abort(400)
+    if not isinstance(operations, list) or len(operations) > current_app.config.get("BATCH_LIMIT", BATCH_LIMIT):
+        abort(400)
+    ranks = user_ranks(current_user.id) #operations can not change the user's own ranks, so they are read once
+    results = []
+    for operation in operations:
+        savepoint = db.session.begin_nested()
+        try:
+            handler = BATCH_OPERATIONS.get(operation.get("op")) if isinstance(operation, dict) else None
+            if handler is None:
+                raise ValueError("Unknown operation")
+            result = handler(operation, ranks)
+            savepoint.commit()
+            results.append(dict(result, ok = True))
+        except KeyError as missing:
+            savepoint.rollback()
+            results.append({"ok" : False, "error" : f"Missing field {missing}"})
+        except (ValueError, TypeError, SQLAlchemyError) as error:
+            savepoint.rollback()
+            results.append({"ok" : False, "error" : str(error) if not isinstance(error, SQLAlchemyError) else "The operation could not be applied"})
+    db.session.commit()
+    return jsonify(results = results)
+
+'''
+JSON reads, for pages that load more items without reloading
+'''
+
+@request_endpoints.route("/api/feed", methods = ["GET"])
+@login_required
+def api_feed():
+    '''
+    A page of the home feed. Query parameters: after or before (page cursors), per_page
+    '''
+    return _ticket_page(unrestickets_page_for_user)
+
+@request_endpoints.route("/api/mytickets", methods = ["GET"])
+@login_required
+def api_my_tickets():
+    '''
+    A page of the user's own tickets. Query parameters: after or before (page cursors), per_page
+    '''
+    return _ticket_page(tickets_page_by_user, show_resolved = True)
+
+@request_endpoints.route("/api/comments", methods = ["GET"])
+@login_required
+def api_comments():
+    '''
+    The comments of a ticket in posting order. Query parameter: ticket_id
+    '''
+    detail = ticket_detail(request.args.get("ticket_id", type = int))
+    if detail is None or not _can_see(detail[0]):
+        abort(404)
+    return jsonify(comments = [_comment_json(comment, author) for comment, author in detail[2]])
+
+@request_endpoints.route("/api/groups", methods = ["GET"])
+@login_required
+def api_groups():
+    '''
+    The groups the user is in, by name
+    '''
+    return jsonify(groups = [{"id" : group.id, "group_name" : group.group_name} for group in read_users_groups(current_user.id)])
+
+@request_endpoints.route("/api/group", methods = ["GET"])
+@login_required
+def api_group():
+    '''
+    A group with its members and the user's rank in it. Query parameter: id
+    '''
+    group = group_view(request.args.get("id", type = int), current_user.id)
+    if group is None:
+        abort(404)
+    return jsonify(group = _group_json(group))
+
+@request_endpoints.route("/events", methods = ["GET"])
+@login_required
+def events():
+    '''
+    Server-Sent Events stream of the writes to the tickets, comments, and memberships the user can see, see events.py
+    '''
+    user_id = current_user.id
+    group_ids = list(user_ranks(user_id))
+    broker = event_broker()
+    subscription = broker.subscribe(user_id, group_ids)
+    keepalive = current_app.config.get("EVENT_KEEPALIVE", DEFAULT_EVENT_KEEPALIVE)
+    def stream():
+        try:
+            yield f"retry: {keepalive * 1000}\n\n"
+            while True:
+                _release_connections() #a stream stays open for as long as the page does
+                event = subscription.next(timeout = keepalive)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(_event_json(event))}\n\n"
+                if event["type"] == "overflow":
+                    return
+        finally:
+            broker.unsubscribe(subscription)
+    return Response(stream_with_context(stream()), mimetype = "text/event-stream",
+        headers = {"Cache-Control" : "no-cache", "X-Accel-Buffering" : "no"}) #proxies must not buffer the stream
+
+@request_endpoints.route("/cache-stats", methods = ["GET"])
+@login_required
+def cache_stats():
+    '''
+    Hit rates of the entity, membership, and fragment caches, for the emails in ADMIN_EMAILS or in debug mode
+    '''
+    if not current_app.debug and current_user.email not in current_app.config.get("ADMIN_EMAILS", ()):
+        abort(403)
+    return jsonify(dict(entity_cache_stats(), fragments = fragment_cache().stats()))
+
+@request_endpoints.route("/export", methods = ["GET"])
+@login_required
+def export():
+    '''
+    Streams the tickets the user can see as CSV or NDJSON.
+    Query parameters: format (csv or ndjson), group_id, since and until (ISO dates), comments (1 to include them)
+    '''
+    format = request.args.get("format", "ndjson")
+    group_id = request.args.get("group_id", type = int)
+    if format not in FORMATS:
+        abort(400)
+    try:
+        since = parse_time(request.args.get("since"))
+        until = parse_time(request.args.get("until"), end = True)
+    except ValueError:
+        abort(400)
+    if group_id is not None and group_id not in user_ranks(current_user.id):
+        abort(403) #only members can export a group
+    chunks = export_tickets(db, format = format, group_id = group_id, since = since, until = until,
+        comments = request.args.get("comments") == "1", visible_to = current_user.id)
+    return Response(stream_with_context(chunks), mimetype = FORMATS[format],
+        headers = {"Content-Disposition" : f"attachment; filename=tickets.{format}"})
+
+BATCH_LIMIT = 100 #operations per request
+
+def _batch_comment(operation, ranks):
+    ticket = _visible_ticket(operation["ticketID"], ranks)
+    comment = crud_operations.create_comment(db, current_user.id, ticket.id, operation["commentContent"], commit = False)
+    return {"comment" : _comment_json(comment, current_user.username)}
+
+def _batch_resolve(operation, ranks):
+    ticket = _visible_ticket(operation["ticketID"], ranks)
+    ticket, comment = crud_operations.resolve_ticket(db, id = ticket.id, user_id = current_user.id, commit = False)
+    return {"ticket" : _ticket_json(ticket), "comment" : _comment_json(comment, current_user.username)}
+
+def _batch_delete(operation, ranks):
+    if "commentID" in operation:
+        comment = crud_operations.read_comment(db, id = operation["commentID"])
+        if comment is None:
+            raise ValueError("Comment not found")
+        _require_moderator(_visible_ticket(comment.ticket_id, ranks).group_id, ranks)
+        crud_operations.delete_comment(db, id = comment.id, commit = False)
+        return {"deleted" : comment.id}
+    ticket = _visible_ticket(operation["ticketID"], ranks)
+    _require_moderator(ticket.group_id, ranks)
+    crud_operations.delete_ticket(db, id = ticket.id, commit = False)
+    return {"deleted" : ticket.id}
+
+def _batch_rerank(operation, ranks):
+    user_group = _managed_membership(operation["userID"], operation["groupID"], ranks)
+    crud_operations.update_user_group(db, user_group.user_id, user_group.group_id, rank_in_group = operation["newRank"], commit = False)
+    return {"membership" : {"user_id" : user_group.user_id, "group_id" : user_group.group_id, "rank" : user_group.rank_in_group}}
+
+def _batch_kick(operation, ranks):
+    user_group = _managed_membership(operation["userID"], operation["groupID"], ranks)
+    user_id, group_id = user_group.user_id, user_group.group_id
+    crud_operations.delete_user_group(db, user_id, group_id, commit = False)
+    return {"membership" : {"user_id" : user_id, "group_id" : group_id, "rank" : None}}
+
+BATCH_OPERATIONS = {"comment" : _batch_comment, "resolve" : _batch_resolve, "delete" : _batch_delete, "rerank" : _batch_rerank, "kick" : _batch_kick}
+
+def _visible_ticket(ticket_id, ranks):
+    ticket = crud_operations.read_ticket(db, id = ticket_id)
+    if ticket is None or (ticket.group_id is not None and ticket.group_id not in ranks):
+        raise ValueError("Ticket not found")
+    return ticket
+
+def _require_moderator(group_id, ranks):
+    #the same rule as the delete buttons of the ticket page: anyone in no group, admins in groups
+    if group_id is not None and ranks.get(group_id) != 2:
+        raise ValueError("Only the group's admins can delete its tickets and comments")
+
+def _managed_membership(user_id, group_id, ranks):
+    #the same rules as the groups page: admins manage the other members, except other admins
+    if ranks.get(group_id) != 2:
+        raise ValueError("Only the group's admins can manage its members")
+    user_group = crud_operations.read_user_group(db, user_id, group_id)
+    if user_group is None:
+        raise ValueError("User is not in the group")
+    if user_id == current_user.id or user_group.rank_in_group == 2:
+        raise ValueError("Admins can not be reranked or kicked")
+    return user_group
+
+def _ticket_page(page_func, show_resolved = False):
+    try:
+        rows, prev_cursor, next_cursor = page_func(current_user.id, after = request.args.get("after"), before = request.args.get("before"),
+            per_page = request.args.get("per_page", type = int))
+    except ValueError:
+        abort(400)
+    items = [dict(_ticket_json(ticket, author = name, group_name = group_name), html = ticket_card(ticket, name, priority, group_name, show_resolved))
+        for ticket, name, priority, group_name in rows]
+    return jsonify(items = items, prev_cursor = prev_cursor, next_cursor = next_cursor)
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) #JSON true and false are bools, which are ints
+
+def _can_see(ticket):
+    return ticket.group_id is None or ticket.group_id in user_ranks(current_user.id)
+
+def _membership_response(user_id, group_id):
+    '''
+    The changed membership, with the group and its card as the current user now sees them
+    '''
+    group = group_view(group_id, current_user.id)
+    rank = next((member.rank for member in group.members if member.id == user_id), None) if group else None
+    return jsonify(membership = {"user_id" : user_id, "group_id" : group_id, "rank" : rank},
+        group = _group_json(group) if group else None, html = render_template("group_card.html", group = group, user = current_user) if group else None)
+
+def _event_json(event):
+    '''
+    The event as sent to the page, with tickets and comments as the API returns them and new tickets' cards
+    '''
+    event = dict(event)
+    if "ticket" in event:
+        ticket = event["ticket"]
+        group = crud_operations.read_group(db, id = ticket.group_id) if ticket.group_id is not None else None
+        group_name = group.group_name if group is not None else "No Group"
+        author = read_username(ticket.user_id)
+        event["ticket"] = _ticket_json(ticket, author = author, group_name = group_name)
+        if event["type"] in ("ticket_created", "ticket_reopened"):
+            event["html"] = ticket_card(ticket, author, ticket_priority_map[ticket.priority], group_name)
+    if "comment" in event:
+        event["comment"] = _comment_json(event["comment"], read_username(event["comment"].user_id))
+    return event
+
+def _release_connections():
+    db.session.close()
+    reader().close()
+
+def _display_time(time):
+    return time.strftime("%a %b %d %Y, at %I:%M %p") if time is not None else None
+
+def _iso(time):
+    return time.isoformat() if time is not None else None
+
+def _ticket_json(ticket, author = None, group_name = None):
+    return {"id" : ticket.id, "title" : ticket.title, "priority" : ticket.priority, "priority_name" : ticket_priority_map[ticket.priority],
+        "resolved" : ticket.resolved, "time_posted" : _iso(ticket.time_posted), "time_resolved" : _iso(ticket.time_resolved),
+        "time_posted_display" : _display_time(ticket.time_posted), "time_resolved_display" : _display_time(ticket.time_resolved),
+        "user_id" : ticket.user_id, "group_id" : ticket.group_id, "author" : author, "group_name" : group_name}
+
+def _comment_json(comment, author):
+    return {"id" : comment.id, "ticket_id" : comment.ticket_id, "user_id" : comment.user_id, "author" : author, "content" : comment.content,
+        "time_posted" : _iso(comment.time_posted), "time_posted_display" : _display_time(comment.time_posted)}
 
+def _group_json(group):
+    return {"id" : group.id, "group_name" : group.group_name, "member_count" : group.member_count, "open_tickets" : group.open_tickets,
+        "viewer_rank" : group.viewer_rank, "members" : [member._asdict() for member in group.members]}
@@ -0,0 +1,133 @@
+from weakref import WeakKeyDictionary
+from sqlalchemy import MetaData, Table, Column, Integer, Text, event, select, delete, insert, literal_column, text
+from sqlalchemy.exc import OperationalError
+from . import db
+
+'''
+Full text search index over Ticket.title, Ticket.content and Comment.content.
+
+The index lives in SQLite FTS5 tables using the trigram tokenizer, so a quoted term matches any
+substring of 3 or more characters, the same rows ILIKE '%term%' would. Each FTS row shares its
+rowid with the ticket or comment it indexes, and crud_operations keeps them in sync.
+
+When FTS5 is not compiled into SQLite the tables are never created and search_enabled is False.
+'''
+
+MIN_TERM_LENGTH = 3 #trigrams can not match anything shorter
+
+#Not part of db.metadata, create_all can not build virtual tables
+fts_metadata = MetaData()
+ticket_fts = Table("ticket_fts", fts_metadata, Column("rowid", Integer), Column("title", Text), Column("content", Text))
+comment_fts = Table("comment_fts", fts_metadata, Column("rowid", Integer), Column("content", Text))
+
+_search_enabled = WeakKeyDictionary() #engine -> whether the index tables exist
+
+def create_search_index(target, connection, **kw):
+    '''
+    Creates the FTS tables after create_all and fills them from any rows that already exist
+    '''
+    if connection.dialect.name != "sqlite":
+        return
+    enabled = True
+    for table, source in ((ticket_fts, "ticket"), (comment_fts, "comment")):
+        if connection.exec_driver_sql(f"SELECT 1 FROM sqlite_master WHERE name = '{table.name}'").first():
+            continue
+        columns = ", ".join(column.name for column in table.columns if column.name != "rowid")
+        try:
+            connection.exec_driver_sql(f"CREATE VIRTUAL TABLE {table.name} USING fts5({columns}, tokenize = 'trigram')")
+        except OperationalError:
+            enabled = False #FTS5 or the trigram tokenizer is not available
+            break
+        connection.exec_driver_sql(f"INSERT INTO {table.name} (rowid, {columns}) SELECT id, {columns} FROM {source}")
+    _search_enabled[connection.engine] = enabled
+
+def drop_search_index(target, connection, **kw):
+    if connection.dialect.name != "sqlite":
+        return
+    for table in (ticket_fts, comment_fts):
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {table.name}")
+    _search_enabled.pop(connection.engine, None)
+
+event.listen(db.metadata, "after_create", create_search_index)
+event.listen(db.metadata, "before_drop", drop_search_index)
+
+def search_enabled(db):
+    '''
+    Whether the full text index exists in the database. Checked once per engine.
+    '''
+    engine = db.engine
+    if engine not in _search_enabled:
+        if engine.dialect.name != "sqlite":
+            _search_enabled[engine] = False
+        else:
+            exists = db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name" : ticket_fts.name}).first()
+            _search_enabled[engine] = exists is not None
+    return _search_enabled[engine]
+
+def usable_terms(terms):
+    '''
+    The words of the search string that are long enough to be matched by the index
+    '''
+    return [term for term in terms.split() if len(term) >= MIN_TERM_LENGTH]
+
+def phrase(term):
+    '''
+    Quotes the term so FTS5 treats it as a literal phrase
+    '''
+    return '"' + term.replace('"', '""') + '"'
+
+def match(table, query):
+    '''
+    WHERE clause matching the table against the FTS5 query
+    '''
+    return literal_column(table.name).op("MATCH")(query)
+
+def matching_ids(table, query):
+    '''
+    Select of the rowids (ticket or comment ids) matching the FTS5 query
+    '''
+    return select(table.c.rowid).where(match(table, query))
+
+def index_tickets(db, tickets):
+    '''
+    Adds or replaces the index rows of the given tickets
+    '''
+    index_rows(db, ticket_fts, [{"rowid" : ticket.id, "title" : ticket.title, "content" : ticket.content} for ticket in tickets])
+
+def index_comments(db, comments):
+    '''
+    Adds or replaces the index rows of the given comments
+    '''
+    index_rows(db, comment_fts, [{"rowid" : comment.id, "content" : comment.content} for comment in comments])
+
+def index_rows(db, table, rows):
+    '''
+    Adds or replaces index rows, given as dicts of the table's columns including the rowid
+    '''
+    if not rows or not search_enabled(db):
+        return
+    unindex(db, table, [row["rowid"] for row in rows])
+    db.session.execute(insert(table), rows)
+
+def unindex(db, table, ids):
+    '''
+    Removes the index rows of the given ticket or comment ids, ids may also be a select of them
+    '''
+    if not search_enabled(db):
+        return
+    db.session.execute(delete(table).where(table.c.rowid.in_(ids)))
+
+def contains(db, column, table, term):
+    '''
+    Filter for the rows whose column contains the term. Goes through the index when the term is long enough,
+    and falls back to ILIKE otherwise.
+
+    Parameters
+    ----------
+    column : the model column to search, e.g. Ticket.title
+    table : the FTS table indexing that column
+    term : the substring to look for (not case sensitive)
+    '''
+    if len(term) >= MIN_TERM_LENGTH and search_enabled(db):
+        return column.table.c.id.in_(matching_ids(table, f"{column.key} : {phrase(term)}"))
+    return column.ilike(f"%{term}%")
@@ -0,0 +1,116 @@
+import json
+import re
+import subprocess
+import sys
+from time import perf_counter
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import inspect
+from . import db
+
+'''
+What create_app does at boot, kept cheap because workers are started and stopped as load changes.
+
+Schema check: SCHEMA_CHECK picks when the tables are created if they are missing.
+    - "startup" (the default) asks the engine for the table names while the app is created, one query
+    - "lazy" does the same before the first request instead, so a worker starts without opening the database
+    - "off" never checks, for databases managed by hand
+create_all only runs when a table is missing, and the full text index is created with it.
+
+Templates: compiled templates are kept as bytecode in TEMPLATE_CACHE_DIR (Jinja's per user temporary directory by default),
+so a new worker loads them instead of compiling them again. An entry is only used while its template's source is unchanged.
+Set TEMPLATE_BYTECODE_CACHE = False to turn it off. With PRECOMPILE_TEMPLATES every template is loaded while the app is
+created, so the first request of each page does not pay for it.
+
+flask startup-profile creates the app in a new interpreter and reports how long each import and each phase of create_app took.
+'''
+
+SCHEMA_CHECKS = ("startup", "lazy", "off")
+PROFILE_SCRIPT = '''
+import json
+from time import perf_counter
+started = perf_counter()
+import SupportTicketSystem
+imported = perf_counter()
+app = SupportTicketSystem.create_app()
+print(json.dumps({"import" : imported - started, "create_app" : perf_counter() - imported, "phases" : app.extensions["startup_timings"]}))
+'''
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| *(\S+)$")
+
+def init_template_cache(app):
+    '''
+    Gives the app's Jinja environment a bytecode cache on disk. Must run before anything renders a template.
+    '''
+    if app.config.get("TEMPLATE_BYTECODE_CACHE", True):
+        app.jinja_options = dict(app.jinja_options, bytecode_cache = FileSystemBytecodeCache(app.config.get("TEMPLATE_CACHE_DIR")))
+
+def precompile_templates(app):
+    '''
+    Loads every template of the app and its blueprints when PRECOMPILE_TEMPLATES is set.
+    Returns the number of templates loaded.
+    '''
+    if not app.config.get("PRECOMPILE_TEMPLATES"):
+        return 0
+    names = [name for name in app.jinja_env.list_templates() if name.endswith(".html")]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def missing_tables(app):
+    '''
+    The names of the tables of the models that are not in the database, read with one query on the engine
+    '''
+    existing = set(inspect(db.get_engine(app)).get_table_names())
+    return sorted(set(db.metadata.tables) - existing)
+
+def check_schema(app):
+    '''
+    Creates the tables if any are missing
+    '''
+    if missing_tables(app):
+        db.create_all(app = app)
+        print("Created Database")
+
+def schedule_schema_check(app):
+    '''
+    Runs check_schema now, before the first request, or never, as SCHEMA_CHECK says
+    '''
+    mode = app.config.get("SCHEMA_CHECK", "startup")
+    if mode not in SCHEMA_CHECKS:
+        raise ValueError(f"SCHEMA_CHECK must be one of {', '.join(SCHEMA_CHECKS)}, not {mode!r}")
+    if mode == "startup":
+        check_schema(app)
+    elif mode == "lazy":
+        app.before_first_request(lambda: check_schema(app))
+
+def timed_phases(app, phases):
+    '''
+    Runs each phase(app) in order and records how long it took in app.extensions["startup_timings"]
+    '''
+    timings = app.extensions.setdefault("startup_timings", {})
+    for phase in phases:
+        started = perf_counter()
+        phase(app)
+        timings[phase.__name__] = perf_counter() - started
+    return timings
+
+def profile_startup(cwd, top = 15):
+    '''
+    Imports the package and creates the app in a new interpreter with -X importtime, so nothing is imported already.
+    cwd is the directory the package is imported from.
+
+    Returns
+    -------
+    profile : dict of the seconds spent importing the package ("import"), in create_app ("create_app"), in each of its
+    phases ("phases"), and the top slowest modules to import with their own and cumulative seconds ("imports")
+    '''
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROFILE_SCRIPT], capture_output = True, text = True, cwd = cwd)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "create_app failed")
+    profile = json.loads(result.stdout.strip().splitlines()[-1])
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            imports.append({"module" : match.group(3), "self" : int(match.group(1)) / 1e6, "cumulative" : int(match.group(2)) / 1e6})
+    profile["imports"] = sorted(imports, key = lambda row: row["cumulative"], reverse = True)[:top]
+    return profile
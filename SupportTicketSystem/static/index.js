@@ -9,17 +9,57 @@ function deleteTicket(ticketID) {
 }
 
 /**
- * PATCH request: resolves ticket.
- *  1. POST new comment identifying resolver
- *  2. PATCH ticket to mark it as resolved.
+ * Parses a JSON response, toasting and rejecting if the request failed.
+ * @param {Response} res 
+ */
+function jsonOrToast(res) {
+    if (!res.ok) {
+        //endpoints that refuse a request explain why in a JSON message
+        return res.json().catch(() => ({})).then((data) => {
+            flashToast(data.message || "Something went wrong, please try again", "error");
+            return Promise.reject(res);
+        });
+    }
+    return res.json();
+}
+
+/**
+ * PATCH request: resolves ticket, the server posts the comment identifying the resolver in the same transaction.
  * @param {int} ticketID 
  * @param {int} userID 
  */
 function resolveTicket(ticketID, userID) {
-    postComment(userID, ticketID, true)
-    fetch("/resolve-ticket", {method : "PATCH", body : JSON.stringify({ ticketID: ticketID})}).then((_res) => {
-        document.location.reload(true);
-    });
+    fetch("/resolve-ticket", {method : "PATCH", body : JSON.stringify({ ticketID: ticketID})}).then(jsonOrToast).then((data) => {
+        showResolved(data.ticket);
+        if (data.comment) {
+            appendComment(data.comment);
+        }
+        flashToast(data.message, "success");
+    }, () => {});
+}
+
+/**
+ * POST many operations to apply in one transaction, e.g. [{op : "resolve", ticketID : 1}, {op : "kick", userID : 2, groupID : 3}]
+ * Resolves to one result per operation, each with ok and either the changed entity or an error.
+ * @param {Array} operations 
+ */
+function runBatch(operations) {
+    return fetch("/batch", {method : "POST", body : JSON.stringify({operations : operations})}).then(jsonOrToast).then((data) => data.results);
+}
+
+/**
+ * Replaces the Mark Resolved button of the ticket page with when the ticket was resolved.
+ * @param {object} ticket : ticket as returned by /resolve-ticket
+ */
+function showResolved(ticket) {
+    let status = document.getElementById("ticket-status");
+    if (status && ticket.resolved) {
+        let alert = document.createElement("div");
+        alert.className = "alert alert-success";
+        alert.textContent = "Resolved: " + ticket.time_resolved_display;
+        status.cells[0].replaceChildren(alert);
+        status.dataset.resolved = "true";
+    }
 }
 
 /**
@@ -37,9 +77,9 @@ function viewTicket(ticketID) {
  * @param {int} groupID 
  */
 function kickFromGroup(userID, groupID) {
-    fetch("/kick-user", {method : "DELETE", body : JSON.stringify({ userID: userID, groupID : groupID})}).then((_res) => {
-        document.location.reload(true);
-    });
+    fetch("/kick-user", {method : "DELETE", body : JSON.stringify({ userID: userID, groupID : groupID})}).then(jsonOrToast).then((data) => {
+        replaceGroupCard(data);
+    }, () => {});
 }
 
 /**
@@ -79,7 +119,9 @@ function flashToast(message, category) {
  * @param {int} newRank 
  */
 function rerankUser(userID, groupID, newRank){
-    fetch("/rerank-user", {method : "PATCH", body : JSON.stringify({ userID: userID, groupID : groupID, newRank : newRank})}).then((_res) => {});
+    fetch("/rerank-user", {method : "PATCH", body : JSON.stringify({ userID: userID, groupID : groupID, newRank : newRank})}).then(jsonOrToast).then((data) => {
+        replaceGroupCard(data); //ranking someone admin disables their radio buttons
+    }, () => {});
 }
 
 /**
@@ -89,9 +131,9 @@ function rerankUser(userID, groupID, newRank){
  */
 function leaveGroup(userID, groupID) {
     //DELETE because leaving a group is the same as deleting an entry that relates a user to a group
-    fetch("/leave-group", {method : "DELETE", body : JSON.stringify({ userID: userID, groupID : groupID})}).then((_res) => {
-        document.location.reload(true);
-    });
+    fetch("/leave-group", {method : "DELETE", body : JSON.stringify({ userID: userID, groupID : groupID})}).then(jsonOrToast).then((data) => {
+        replaceGroupCard(data, "other-groups");
+    }, () => {});
 }
 
 /**
@@ -101,30 +143,75 @@ function leaveGroup(userID, groupID) {
  */
 function joinGroup(userID, groupID) {
     //Post because joining a group creates a new entry that relates a user to a group
-    fetch("/join-group", {method : "POST", body : JSON.stringify({ userID: userID, groupID : groupID})}).then((_res) => {
-        document.location.reload(true);
-    });
+    fetch("/join-group", {method : "POST", body : JSON.stringify({ userID: userID, groupID : groupID})}).then(jsonOrToast).then((data) => {
+        replaceGroupCard(data, "your-groups");
+    }, () => {});
+}
+
+/**
+ * Swaps a group's card for the one returned by a membership request, keeping it open if it was.
+ * @param {object} data : response of a membership request, with the group's new card in data.html
+ * @param {str} containerID : moves the card to the end of this container, it stays in place if not given
+ */
+function replaceGroupCard(data, containerID = null) {
+    if (!data.html) {
+        return;
+    }
+    let old = document.querySelector(`[data-group-id="${data.group.id}"]`);
+    let wasOpen = old && old.querySelector(".collapse.show") !== null;
+    let template = document.createElement("template");
+    template.innerHTML = data.html.trim();
+    let card = template.content.firstElementChild;
+    if (wasOpen) {
+        card.querySelector(".collapse").classList.add("show");
+    }
+    if (containerID) {
+        if (old) {
+            old.remove();
+        }
+        document.getElementById(containerID).appendChild(card);
+    }
+    else if (old) {
+        old.replaceWith(card);
+    }
 }
 
 /**
  * POST new comment for a given ticket buy a given user
  * @param {int} userID 
  * @param {int} ticketID 
- * @param {boolean} resolving : if the comment should be a resolving request rather than the entry in the <text> tag
  */
-function postComment(userID, ticketID, resolving = false) {
+function postComment(userID, ticketID) {
     newComment = document.getElementById("new-comment").value;
-    if (newComment.length > 0 && !resolving) {
-        fetch("/post-comment", {method : "POST", body : JSON.stringify({ userID : userID, ticketID: ticketID, commentContent : newComment})}).then((_res) => {
-            document.location.reload(true);
-        });
+    if (newComment.length > 0) {
+        fetch("/post-comment", {method : "POST", body : JSON.stringify({ userID : userID, ticketID: ticketID, commentContent : newComment})}).then(jsonOrToast).then((data) => {
+            appendComment(data.comment);
+            document.getElementById("new-comment").value = "";
+            resizeTextArea("new-comment");
+        }, () => {});
     }
-    else if (resolving) {
-        newComment = "I resolved this ticket"
-        fetch("/post-comment", {method : "POST", body : JSON.stringify({ userID : userID, ticketID: ticketID, commentContent : newComment})}).then((_res) => {
-            document.location.reload(true);
-        });
+}
+
+/**
+ * Adds a comment card to the end of the ticket's comments, filled in from the page's comment template.
+ * @param {object} comment : comment as returned by /post-comment
+ */
+function appendComment(comment) {
+    if (document.getElementById("comment-" + comment.id)) {
+        return; //already added by the response to posting it
+    }
+    let template = document.getElementById("comment-template");
+    let card = template.content.firstElementChild.cloneNode(true);
+    card.id = "comment-" + comment.id;
+    card.dataset.commentId = comment.id;
+    card.querySelector('[data-field="author"]').textContent = comment.author;
+    card.querySelector('[data-field="time"]').textContent = comment.time_posted_display;
+    card.querySelector('[data-field="content"]').textContent = comment.content;
+    let deleteButton = card.querySelector('[data-field="delete"]');
+    if (deleteButton) {
+        deleteButton.onclick = () => deleteComment(comment.id);
     }
+    document.getElementById("comments").appendChild(card);
 }
 
 /**
@@ -132,11 +219,199 @@ function postComment(userID, ticketID, resolving = false) {
  * @param {int} commentID 
  */
 function deleteComment(commentID) {
-    fetch("/delete-comment", {method : "DELETE", body : JSON.stringify({commentID : commentID})}).then((_res) => {
-        document.location.reload(true);
+    fetch("/delete-comment", {method : "DELETE", body : JSON.stringify({commentID : commentID})}).then(jsonOrToast).then((data) => {
+        let card = document.getElementById("comment-" + data.deleted);
+        if (card) {
+            card.remove();
+        }
+    }, () => {});
+}
+
+/**
+ * Loads the previous or next page of tickets from the JSON feed in place of the current one.
+ * Returns false so the link is not followed, the link still works when scripts are off.
+ * @param {Element} link : a pagination link, with the direction and cursor of the page it points to
+ */
+function loadTicketPage(link) {
+    let nav = document.getElementById("ticket-pages");
+    let params = new URLSearchParams({[link.dataset.direction] : link.dataset.cursor});
+    if (nav.dataset.perPage) {
+        params.set("per_page", nav.dataset.perPage);
+    }
+    showTicketPage(params).then(() => {
+        history.pushState(null, "", nav.dataset.page + "?" + params);
+        window.scrollTo(0, 0);
+    }, () => {});
+    return false;
+}
+
+/**
+ * Replaces the tickets and pagination links with a page of the JSON feed.
+ * @param {URLSearchParams} params : cursor and page size of the page
+ */
+function showTicketPage(params) {
+    let nav = document.getElementById("ticket-pages");
+    return fetch(nav.dataset.api + "?" + params).then(jsonOrToast).then((data) => {
+        document.getElementById("tickets").innerHTML = data.items.map((item) => item.html).join("");
+        setPageLink("prev-page", "before", data.prev_cursor);
+        setPageLink("next-page", "after", data.next_cursor);
+        document.getElementById("select-all-tickets").checked = false;
     });
 }
 
+/**
+ * Ticks or clears every ticket on the page.
+ * @param {boolean} checked 
+ */
+function selectAllTickets(checked) {
+    for (let box of document.querySelectorAll("#tickets .ticket-select")) {
+        box.checked = checked;
+    }
+}
+
+/**
+ * PATCH the selected tickets with one request, then reload the current page of tickets in place.
+ * @param {object} changes : any of resolved, priority, and groupID (null for no group)
+ */
+function bulkUpdate(changes) {
+    let ticketIDs = Array.from(document.querySelectorAll("#tickets .ticket-select:checked")).map((box) => parseInt(box.value));
+    if (ticketIDs.length == 0) {
+        flashToast("Select the tickets to change first", "info");
+        return;
+    }
+    fetch("/update-tickets", {method : "PATCH", body : JSON.stringify({ticketIDs : ticketIDs, ...changes})}).then(jsonOrToast).then((data) => {
+        flashToast(data.message, "success");
+        return showTicketPage(new URLSearchParams(window.location.search));
+    }).catch(() => {});
+}
+
+/**
+ * Fills the move to group menu with the user's groups the first time it is opened.
+ * @param {Element} select 
+ */
+function loadBulkGroups(select) {
+    if (select.dataset.loaded) {
+        return;
+    }
+    select.dataset.loaded = "true";
+    fetch("/api/groups").then(jsonOrToast).then((data) => {
+        for (let group of data.groups) {
+            select.add(new Option(group.group_name, group.id));
+        }
+    }, () => {
+        delete select.dataset.loaded;
+    });
+}
+
+/**
+ * Points a pagination link at a new cursor, hiding it if there is none.
+ * @param {str} id 
+ * @param {str} direction : "before" or "after"
+ * @param {str} cursor 
+ */
+function setPageLink(id, direction, cursor) {
+    let nav = document.getElementById("ticket-pages");
+    let link = document.getElementById(id);
+    let params = new URLSearchParams({[direction] : cursor || ""});
+    if (nav.dataset.perPage) {
+        params.set("per_page", nav.dataset.perPage);
+    }
+    link.dataset.cursor = cursor || "";
+    link.href = nav.dataset.page + "?" + params;
+    link.parentElement.hidden = !cursor;
+}
+
+/**
+ * Applies the live events of /events to the home feed or the ticket page, whichever is open.
+ */
+function startLiveUpdates() {
+    let comments = document.getElementById("comments");
+    let pages = document.getElementById("ticket-pages");
+    let onFeed = pages !== null && pages.dataset.api.endsWith("/api/feed");
+    if ((comments === null && !onFeed) || !window.EventSource) {
+        return;
+    }
+    let source = new EventSource("/events");
+    source.onmessage = (message) => {
+        let event = JSON.parse(message.data);
+        if (event.type == "overflow") { //too many events were missed to catch up on
+            source.close();
+            document.location.reload();
+        }
+        else if (onFeed) {
+            updateFeed(event);
+        }
+        else {
+            updateTicketPage(event, parseInt(comments.dataset.ticketId));
+        }
+    };
+}
+
+/**
+ * Adds new tickets that belong on this page of the feed, and removes resolved and deleted ones.
+ * The feed is ordered by priority, highest first, then by age, oldest first.
+ * @param {object} event 
+ */
+function updateFeed(event) {
+    if (event.type == "ticket_created" || event.type == "ticket_reopened") {
+        if (event.ticket.resolved || document.querySelector(`#tickets [data-ticket-id="${event.ticket.id}"]`)) {
+            return;
+        }
+        let cards = Array.from(document.querySelectorAll("#tickets [data-ticket-id]"));
+        let before = cards.find((card) => parseInt(card.dataset.priority) < event.ticket.priority);
+        let firstPage = document.getElementById("prev-page").parentElement.hidden;
+        let lastPage = document.getElementById("next-page").parentElement.hidden;
+        let template = document.createElement("template");
+        template.innerHTML = event.html.trim();
+        if (before && (before !== cards[0] || firstPage)) {
+            before.before(template.content.firstElementChild);
+        }
+        else if (!before && lastPage) {
+            document.getElementById("tickets").appendChild(template.content.firstElementChild);
+        }
+    }
+    else if (event.type == "ticket_resolved" || event.type == "ticket_deleted") {
+        let card = document.querySelector(`#tickets [data-ticket-id="${event.ticket_id || event.ticket.id}"]`);
+        if (card) {
+            card.remove();
+        }
+    }
+}
+
+/**
+ * Keeps the open ticket's comments and resolution up to date.
+ * @param {object} event 
+ * @param {int} ticketID : the ticket the page shows
+ */
+function updateTicketPage(event, ticketID) {
+    if (event.type == "comment_created" && event.comment.ticket_id == ticketID) {
+        appendComment(event.comment);
+    }
+    else if (event.type == "comment_deleted" && event.ticket_id == ticketID) {
+        let card = document.getElementById("comment-" + event.comment_id);
+        if (card) {
+            card.remove();
+        }
+    }
+    else if (event.type == "ticket_resolved" && event.ticket.id == ticketID) {
+        showResolved(event.ticket);
+    }
+    else if (event.type == "ticket_deleted" && event.ticket_id == ticketID) {
+        flashToast("This ticket was deleted", "error");
+    }
+}
+
+$(document).ready(startLiveUpdates);
+
+/**
+ * Back and forward between pages loaded in place reload the page the URL points to
+ */
+window.addEventListener("popstate", () => {
+    if (document.getElementById("ticket-pages")) {
+        document.location.reload();
+    }
+});
+
 /**
  * Resize the given element to dynamically allocate the necessary space for all the text inside it.
  * @param {str} id 
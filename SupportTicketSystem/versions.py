@@ -0,0 +1,158 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+from flask import request, session, make_response, current_app
+from flask_login import current_user
+from sqlalchemy import select, union_all, literal, cast, String, func, or_
+from sqlalchemy.dialects.sqlite import insert
+from .models import Ticket, User_Groups, Groups, Version_Stamps
+from .counters import NO_GROUP
+from .database import reader
+
+'''
+Conditional GET for the pages, so a refresh of an unchanged page is answered with 304 Not Modified
+before any of its queries run or its template is rendered.
+
+crud_operations bumps the version stamps of everything a write touches, in the same transaction:
+    - "ticket:<id>" a ticket or its comments
+    - "group:<id>" the tickets of a group, group 0 for the tickets in no group
+    - "user:<id>" the tickets a user posted, and their memberships
+    - GROUPS any group or membership
+    - USERS any username or email, or a deleted user
+A page's ETag is a hash of the versions of the scopes it shows, the viewer, and the URL, and its Last-Modified
+is the latest change to any of them. Pages with flashed messages waiting are always rendered.
+'''
+
+GROUPS = "groups"
+USERS = "users"
+CACHE_CONTROL = "private, no-cache" #browsers keep the page but must revalidate it on every visit
+
+stamps = Version_Stamps.__table__
+
+def ticket_scope(ticket_id):
+    return f"ticket:{ticket_id}"
+
+def group_scope(group_id):
+    return f"group:{NO_GROUP if group_id is None else group_id}"
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+def bump(db, scopes):
+    '''
+    Increments the versions of the scopes, without committing
+    '''
+    now = datetime.utcnow()
+    rows = [{"scope" : scope, "version" : 1, "updated_at" : now} for scope in sorted(set(scopes))]
+    if rows:
+        _upsert(db, insert(stamps), rows)
+
+def bump_tickets(db, *criteria):
+    '''
+    Increments the versions of the tickets matching the criteria, their groups, and their authors, with one statement.
+    Call before deleting or changing them.
+    '''
+    now = literal(datetime.utcnow(), stamps.c.updated_at.type)
+    scopes = [literal("ticket:") + cast(Ticket.id, String), literal("group:") + cast(func.coalesce(Ticket.group_id, NO_GROUP), String),
+        literal("user:") + cast(Ticket.user_id, String)]
+    rows = union_all(*[select(scope, literal(1), now).where(*criteria) for scope in scopes])
+    _upsert(db, insert(stamps).from_select(["scope", "version", "updated_at"], rows))
+
+def bump_members(db, *criteria):
+    '''
+    Increments the user versions of the memberships matching the criteria, with one statement. Call before deleting them.
+    '''
+    now = literal(datetime.utcnow(), stamps.c.updated_at.type)
+    rows = select(literal("user:") + cast(User_Groups.user_id, String), literal(1), now).where(*criteria).distinct()
+    _upsert(db, insert(stamps).from_select(["scope", "version", "updated_at"], rows))
+
+def _upsert(db, statement, rows = None):
+    db.session.execute(statement.on_conflict_do_update(index_elements = [stamps.c.scope],
+        set_ = {"version" : stamps.c.version + 1, "updated_at" : statement.excluded.updated_at}), rows)
+
+def scope_filter(*scopes):
+    '''
+    Filter for the stamps of the scopes, given as strings or selects of scope strings
+    '''
+    names = [scope for scope in scopes if isinstance(scope, str)]
+    queries = [scope for scope in scopes if not isinstance(scope, str)]
+    return or_(stamps.c.scope.in_(names), *[stamps.c.scope.in_(query) for query in queries])
+
+def etag_salt():
+    '''
+    Mixed into every ETag so they can not be guessed from the versions. It must be the same in every worker and across
+    restarts, or a refresh would only be answered with 304 by the worker that sent the page: PAGE_ETAG_SALT if set,
+    otherwise the SECRET_KEY.
+    '''
+    return current_app.config.get("PAGE_ETAG_SALT") or current_app.config.get("SECRET_KEY") or ""
+
+def page_version(*scopes):
+    '''
+    Returns (ETag, Last-Modified) of a page showing the scopes, read with one statement.
+    Scopes without a stamp have never changed and count as version 0.
+    '''
+    rows = reader().execute(select(stamps.c.scope, stamps.c.version, stamps.c.updated_at).where(scope_filter(*scopes))\
+        .order_by(stamps.c.scope)).all()
+    key = "|".join([etag_salt(), str(current_user.get_id()), request.full_path]
+        + [f"{scope}={version}" for scope, version, _ in rows])
+    last_modified = max((updated_at for _, _, updated_at in rows), default = None)
+    return hashlib.sha1(key.encode()).hexdigest(), last_modified
+
+def conditional(scopes):
+    '''
+    View decorator answering GET requests with 304 Not Modified when the page has not changed since the client's copy.
+
+    Parameters
+    ----------
+    scopes : callable taking the view's arguments and returning the scopes the page shows (see scope_filter),
+        or None to always render the page
+    '''
+    def decorator(view):
+        @wraps(view)
+        def conditional_view(*args, **kwargs):
+            page_scopes = scopes(*args, **kwargs) if request.method == "GET" and not session.get("_flashes") else None
+            if page_scopes is None:
+                return view(*args, **kwargs)
+            etag, last_modified = page_version(*page_scopes)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                #the header only has whole seconds, a change later in the second the client's copy is from must still show
+                not_modified = last_modified is not None and request.if_modified_since is not None\
+                    and last_modified < request.if_modified_since.replace(tzinfo = None)
+            response = make_response("", 304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                response.headers["Cache-Control"] = CACHE_CONTROL
+            return response
+        return conditional_view
+    return decorator
+
+def feed_scopes():
+    '''
+    The home feed shows the unresolved tickets of the viewer's groups and of no group
+    '''
+    user_id = current_user.id
+    return [USERS, GROUPS, user_scope(user_id), group_scope(None),
+        select(literal("group:") + cast(User_Groups.group_id, String)).where(User_Groups.user_id == user_id)]
+
+def my_tickets_scopes():
+    return [USERS, GROUPS, user_scope(current_user.id)]
+
+def groups_scopes():
+    '''
+    The groups page shows every group with its members and open ticket count
+    '''
+    return [USERS, GROUPS, select(literal("group:") + cast(Groups.id, String))]
+
+def ticket_scopes():
+    '''
+    A ticket page shows the ticket and its comments, and its buttons depend on the viewer's rank.
+    Deleting a ticket bumps its stamp, so its page is rendered again and gets its 404.
+    '''
+    ticket_id = request.args.get("id", type = int)
+    if ticket_id is None:
+        return None
+    return [USERS, ticket_scope(ticket_id), user_scope(current_user.id)]
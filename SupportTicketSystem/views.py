@@ -1,25 +1,47 @@
 import re
-from flask import Blueprint, jsonify, redirect, render_template, request, flash, url_for
+from flask import Blueprint, jsonify, redirect, render_template, request, flash, url_for, abort
 from flask_login import login_required, current_user
 from . import db
-from .common_queries import read_users_groups, read_all_users_in_group, \
-    read_all_groups_not_userin, read_rank, all_unrestickets_for_user, all_tickets_by_user
+from .common_queries import user_ranks, groups_page, ticket_detail, search_tickets, unrestickets_page_for_user, tickets_page_by_user
 from .crud_operations import *
+from .versions import conditional, feed_scopes, my_tickets_scopes, groups_scopes, ticket_scopes
 import json
 
 views = Blueprint('views', __name__)
 
 @views.route("/", methods = ["GET"])
 @login_required
+@conditional(feed_scopes)
 def index():
-    ticket_user_priority_group = all_unrestickets_for_user(current_user.id)
-    return render_template("home.html", user = current_user, ticket_user_priority_group = ticket_user_priority_group)
+    ticket_user_priority_group, prev_cursor, next_cursor = ticket_page(unrestickets_page_for_user)
+    return render_template("home.html", user = current_user, ticket_user_priority_group = ticket_user_priority_group, \
+        prev_cursor = prev_cursor, next_cursor = next_cursor, per_page = request.args.get("per_page", type = int), priority_map = ticket_priority_map)
     
 @views.route("/mytickets", methods = ["GET"])
 @login_required
+@conditional(my_tickets_scopes)
 def my_tickets():
-    ticket_user_priority_group = all_tickets_by_user(current_user.id)
-    return render_template("mytickets.html", user = current_user, ticket_user_priority_group = ticket_user_priority_group)
+    ticket_user_priority_group, prev_cursor, next_cursor = ticket_page(tickets_page_by_user)
+    return render_template("mytickets.html", user = current_user, ticket_user_priority_group = ticket_user_priority_group, \
+        prev_cursor = prev_cursor, next_cursor = next_cursor, per_page = request.args.get("per_page", type = int), priority_map = ticket_priority_map)
+
+def ticket_page(page_func):
+    '''
+    Calls the page function for the current user with the cursor and page size from the query string.
+    Aborts with a 400 if the cursor is malformed.
+    '''
+    try:
+        return page_func(current_user.id, after = request.args.get("after"), before = request.args.get("before"), \
+            per_page = request.args.get("per_page", type = int))
+    except ValueError:
+        abort(400)
+
+@views.route("/search", methods = ["GET"])
+@login_required
+def search():
+    terms = request.args.get("q", "").strip()
+    ticket_user_priority_group = search_tickets(current_user.id, terms) if terms else []
+    return render_template("search.html", user = current_user, terms = terms, ticket_user_priority_group = ticket_user_priority_group)
 
 @views.route("/newticket", methods = ["POST", "GET"])
 @login_required
@@ -41,12 +63,12 @@ def new_ticket():
                 ticket = create_ticket(db,title = ticket_title, content = ticket_content, priority = ticket_priority, user_id = current_user.id, group_id= None)
             flash("Ticket successfully added!", category = "success")
             return redirect(url_for("views.view_ticket", id = ticket.id))
-    u_groups = read_user_group(db, user_id = current_user.id)
-    group_names = [read_group(db, id = group.group_id).group_name for group in u_groups]
+    group_names = [read_group(db, id = group_id).group_name for group_id in user_ranks(current_user.id)]
     return render_template("newticket.html", user=current_user, group_names = group_names)
 
 @views.route("/groups", methods = ["POST", "GET"])
 @login_required
+@conditional(groups_scopes)
 def groups():
     if request.method == "POST":
         new_group_name = request.form.get("new_group_name")
@@ -64,24 +86,24 @@ def groups():
             new_group = create_group(db, group_name = new_group_name)
             create_user_group(db, user_id = current_user.id, group_id=new_group.id, rank_in_group=2)
             return redirect(url_for("views.groups"))
-    groups = read_users_groups(current_user.id)
-    out_groups = read_all_groups_not_userin(current_user.id)
-    return render_template("groups.html", user = current_user, groups = groups, \
-        read_all_users_in_group = read_all_users_in_group, read_rank = read_rank, out_groups = out_groups)
+    groups, out_groups = groups_page(current_user.id)
+    return render_template("groups.html", user = current_user, groups = groups, out_groups = out_groups)
 
 @views.route("/view-ticket", methods = ["GET", "POST"])
 @login_required
+@conditional(ticket_scopes)
 def view_ticket():
     ticket_id = request.args.get("id")
-    print(ticket_id)
-    ticket = read_ticket(db, id = ticket_id)
     if ticket_id:
-        priority_map = {0:"Whenever", 1:"Nice to Have", 2: "Important", 3 : "CRITICAL"}
-        username_func = lambda x : read_user(db, user_id = x).username
+        detail = ticket_detail(ticket_id)
+        if detail is None:
+            abort(404)
+        ticket, author_name, comment_authors = detail
         if ticket.group_id:
-            admin_perms = int(read_rank(user_id = current_user.id, group_id = ticket.group_id).rank_in_group) >= 2
+            admin_perms = user_ranks(current_user.id).get(ticket.group_id, 0) >= 2
         else:
             admin_perms = True #anyone can modify tickets in the no-group section
-        return render_template("viewticket.html", user = current_user, ticket = ticket, priority_map = priority_map, username_func = username_func, admin_perms = admin_perms)
+        return render_template("viewticket.html", user = current_user, ticket = ticket, priority_map = ticket_priority_map, author_name = author_name, \
+            comment_authors = comment_authors, admin_perms = admin_perms)
     else:
         return render_template("viewticket.html", user = current_user)
\ No newline at end of file
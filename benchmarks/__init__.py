@@ -0,0 +1,2 @@
+from .dataset import generate_dataset, DATASET_PASSWORD
+from .runner import run_benchmarks
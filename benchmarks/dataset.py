@@ -0,0 +1,104 @@
+import random
+from datetime import datetime, timedelta
+from SupportTicketSystem import db
+from SupportTicketSystem.crud_operations import create_users_bulk, create_groups_bulk, create_user_groups_bulk, create_tickets_bulk, create_comments_bulk
+
+'''
+Reproducible synthetic dataset of a large organisation.
+
+Rows are written with the bulk create functions in batches, one transaction per batch, so datasets
+with millions of tickets and comments can be generated without holding them all in memory.
+The same sizes and seed always produce the same rows.
+'''
+
+DATASET_PASSWORD = "benchmark-password" #every generated user can log in with it
+EPOCH = datetime(2022, 1, 1) #tickets are posted during the year after this
+DEFAULT_SIZES = {"users" : 1000, "groups" : 50, "memberships" : 3, "tickets" : 10000, "comments" : 4}
+
+PRIORITY_WEIGHTS = (40, 30, 20, 10) #most tickets are low priority
+RESOLVED_SHARE = 0.5
+NO_GROUP_SHARE = 0.1 #tickets posted to the universal group
+WORDS = ("printer", "network", "server", "login", "password", "email", "laptop", "monitor", "vpn", "database",
+    "backup", "deploy", "build", "release", "invoice", "payroll", "badge", "office", "meeting", "calendar",
+    "license", "install", "update", "crash", "error", "timeout", "slow", "broken", "missing", "request",
+    "access", "permission", "account", "reset", "upgrade", "scanner", "keyboard", "mouse", "phone", "wifi",
+    "firewall", "certificate", "storage", "quota", "sync", "report", "dashboard", "alert", "outage", "ticket")
+
+def generate_dataset(users = DEFAULT_SIZES["users"], groups = DEFAULT_SIZES["groups"], memberships = DEFAULT_SIZES["memberships"],
+    tickets = DEFAULT_SIZES["tickets"], comments = DEFAULT_SIZES["comments"], seed = 0, batch_size = 5000, progress = None):
+    '''
+    Fills the database with a synthetic organisation. Existing rows are left alone.
+
+    Parameters
+    ----------
+    users : number of users
+    groups : number of groups
+    memberships : average number of groups each user is in. The first member of a group is its admin.
+    tickets : number of tickets, posted by random users to one of their groups or to no group
+    comments : average number of comments on each ticket
+    seed : seed of the random generator, the same seed gives the same dataset
+    batch_size : number of rows written per transaction
+    progress : optional callable(table, written, total) called after every batch
+
+    Returns
+    -------
+    counts : dict of the number of rows written to each table
+    '''
+    rng = random.Random(seed)
+    report = progress or (lambda table, written, total: None)
+    counts = {"users" : 0, "groups" : 0, "memberships" : 0, "tickets" : 0, "comments" : 0}
+
+    user_ids = []
+    for start in range(0, users, batch_size):
+        user_ids += create_users_bulk(db, [{"email" : f"user{i}@benchmark.example", "password" : DATASET_PASSWORD, "username" : f"user{i}"}
+            for i in range(start, min(start + batch_size, users))])
+        report("users", len(user_ids), users)
+    counts["users"] = len(user_ids)
+
+    group_ids = []
+    for start in range(0, groups, batch_size):
+        group_ids += create_groups_bulk(db, [f"Benchmark group {i}" for i in range(start, min(start + batch_size, groups))])
+        report("groups", len(group_ids), groups)
+    counts["groups"] = len(group_ids)
+
+    groups_of = {} #user id -> ids of the groups they are in
+    has_admin = set()
+    for start in range(0, len(user_ids), batch_size):
+        rows = []
+        for user_id in user_ids[start:start + batch_size]:
+            joined = rng.sample(group_ids, min(len(group_ids), rng.randint(0, 2 * memberships)))
+            groups_of[user_id] = joined
+            for group_id in joined:
+                rank = 2 if group_id not in has_admin else rng.choices((0, 1), (80, 20))[0]
+                has_admin.add(group_id)
+                rows.append({"user_id" : user_id, "group_id" : group_id, "rank_in_group" : rank})
+        create_user_groups_bulk(db, rows)
+        counts["memberships"] += len(rows)
+        report("memberships", min(start + batch_size, len(user_ids)), len(user_ids))
+
+    for start in range(0, tickets, batch_size):
+        ticket_rows = [_ticket(rng, user_ids, groups_of) for _ in range(min(batch_size, tickets - start))]
+        ticket_ids = create_tickets_bulk(db, ticket_rows, commit = False)
+        comment_rows = []
+        for ticket_id, ticket in zip(ticket_ids, ticket_rows):
+            for _ in range(rng.randint(0, 2 * comments)):
+                comment_rows.append({"user_id" : rng.choice(user_ids), "ticket_id" : ticket_id, "content" : _sentence(rng, 5, 40),
+                    "time_posted" : ticket["time_posted"] + timedelta(seconds = rng.randrange(14 * 86400))})
+        create_comments_bulk(db, comment_rows, commit = False)
+        db.session.commit()
+        counts["tickets"] += len(ticket_ids)
+        counts["comments"] += len(comment_rows)
+        report("tickets", counts["tickets"], tickets)
+    return counts
+
+def _ticket(rng, user_ids, groups_of):
+    user_id = rng.choice(user_ids)
+    group_id = rng.choice(groups_of[user_id]) if groups_of[user_id] and rng.random() >= NO_GROUP_SHARE else None
+    time_posted = EPOCH + timedelta(seconds = rng.randrange(365 * 86400))
+    resolved = rng.random() < RESOLVED_SHARE
+    return {"user_id" : user_id, "group_id" : group_id, "title" : _sentence(rng, 3, 8)[:120], "content" : _sentence(rng, 10, 60),
+        "priority" : rng.choices(range(4), PRIORITY_WEIGHTS)[0], "resolved" : resolved, "time_posted" : time_posted,
+        "time_resolved" : time_posted + timedelta(seconds = rng.randrange(7 * 86400)) if resolved else None}
+
+def _sentence(rng, shortest, longest):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(shortest, longest)))
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+from collections import namedtuple
+from datetime import datetime
+from statistics import mean, median
+from time import perf_counter
+from sqlalchemy import func, select
+from SupportTicketSystem import create_app, db
+from SupportTicketSystem.instrumentation import record_statements
+from SupportTicketSystem.models import User, Ticket, Comment, Groups, User_Groups
+from SupportTicketSystem.common_queries import all_unrestickets_for_user, all_tickets_by_user, unrestickets_for_user_query
+from SupportTicketSystem.crud_operations import read_ticket, read_user_group, create_user_group, update_user_group, delete_user_group,\
+    create_comment, create_tickets_bulk, create_comments_bulk
+from .dataset import DATASET_PASSWORD, DEFAULT_SIZES, WORDS, generate_dataset
+
+'''
+Times the hot read paths and every write endpoint against a synthetic dataset.
+
+    python -m benchmarks --tickets 1000000 --comments 5
+    python -m benchmarks --compare benchmarks/results/<earlier run>.json
+
+Each case runs a few untimed warmup iterations, then reports latency percentiles in milliseconds and
+the number of SQL statements per iteration. Results are written as JSON so runs can be compared.
+'''
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+DEFAULT_DATABASE = os.path.join(os.path.dirname(__file__), "benchmark.db")
+SAMPLE_TICKETS = 50 #tickets cycled through by the view ticket case
+
+#setup runs untimed before every iteration and may return a tuple of arguments for run
+Case = namedtuple("Case", ["name", "run", "setup"], defaults = [None])
+
+def run_benchmarks(app, iterations = 30, warmup = 3, seed = 0, only = None):
+    '''
+    Runs every case against the app's database, which must already hold a dataset.
+
+    Parameters
+    ----------
+    app : the app to benchmark
+    iterations : number of timed iterations per case
+    warmup : number of untimed iterations run first
+    seed : seed used to pick the sample tickets
+    only : optional collection of case names to run
+
+    Returns
+    -------
+    results : dict of case name -> latency and statement count statistics
+    '''
+    with app.app_context(), record_statements() as statements:
+        results = {}
+        for case in build_cases(app, random.Random(seed)):
+            if only and case.name not in only:
+                continue
+            results[case.name] = measure(case, statements, iterations, warmup)
+        return results
+
+def measure(case, statements, iterations, warmup):
+    timings, counts = [], []
+    for i in range(warmup + iterations):
+        db.session.remove() #every iteration starts with an empty session, like a new request
+        args = (case.setup() or ()) if case.setup else ()
+        statements.clear()
+        start = perf_counter()
+        case.run(*args)
+        elapsed = perf_counter() - start
+        if i >= warmup:
+            timings.append(elapsed * 1000)
+            counts.append(len(statements))
+    timings.sort()
+    return {"iterations" : iterations, "p50_ms" : percentile(timings, 50), "p90_ms" : percentile(timings, 90),
+        "p99_ms" : percentile(timings, 99), "mean_ms" : mean(timings), "max_ms" : timings[-1],
+        "queries" : median(counts), "max_queries" : max(counts)}
+
+def percentile(ordered, percent):
+    '''
+    Nearest rank percentile of an already sorted list
+    '''
+    rank = max(1, -(-percent * len(ordered) // 100))
+    return ordered[int(rank) - 1]
+
+def build_cases(app, rng):
+    '''
+    The benchmarked cases, run as the user who posted the most tickets
+    '''
+    user_id = db.session.execute(select(Ticket.user_id).group_by(Ticket.user_id).order_by(func.count().desc(), Ticket.user_id).limit(1)).scalar()
+    if user_id is None:
+        raise ValueError("The database holds no tickets, generate a dataset first")
+    user = db.session.query(User).get(user_id)
+    other_id = db.session.execute(select(User.id).where(User.id != user_id).order_by(User.id).limit(1)).scalar()
+    visible = db.session.execute(unrestickets_for_user_query(user_id).with_entities(Ticket.id).order_by(Ticket.id).statement).scalars().all()
+    sample_tickets = rng.sample(visible, min(SAMPLE_TICKETS, len(visible))) or [db.session.execute(select(Ticket.id).limit(1)).scalar()]
+    busiest_ticket = db.session.execute(select(Comment.ticket_id).group_by(Comment.ticket_id).order_by(func.count().desc()).limit(1)).scalar()
+    own_ticket = db.session.execute(select(Ticket.id).where(Ticket.user_id == user_id).limit(1)).scalar()
+    group_id = db.session.execute(select(User_Groups.group_id).where(User_Groups.user_id == user_id).limit(1)).scalar()\
+        or db.session.execute(select(Groups.id).limit(1)).scalar()
+    join_group = db.session.execute(select(Groups.id).where(Groups.id != group_id).order_by(Groups.id.desc()).limit(1)).scalar() or group_id
+    comments_per_ticket = round(db.session.query(Comment).count() / max(db.session.query(Ticket).count(), 1))
+    word = rng.choice(WORDS)
+
+    client = app.test_client()
+    response = client.post("/login", data = {"email" : user.email, "password" : DATASET_PASSWORD})
+    if response.status_code != 302:
+        raise ValueError(f"Could not log in as {user.email}, was the dataset generated with the benchmark password?")
+
+    cycle = iter(sample_tickets * (1 + 10000 // len(sample_tickets)))
+    def get(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+    def send(method, url, body):
+        response = client.open(url, method = method, data = json.dumps(body))
+        if response.status_code != 200:
+            raise RuntimeError(f"{method} {url} returned {response.status_code}")
+    def membership(member_id, member_group_id, member):
+        user_group = read_user_group(db, member_id, member_group_id)
+        if member and user_group is None:
+            create_user_group(db, member_id, member_group_id)
+        elif not member and user_group is not None:
+            delete_user_group(db, member_id, member_group_id)
+    def without_flashes():
+        with client.session_transaction() as session:
+            session.pop("_flashes", None)
+    def new_ticket():
+        ticket_id = create_tickets_bulk(db, [{"user_id" : user_id, "group_id" : group_id, "title" : "benchmark ticket", "content" : "to be deleted"}])[0]
+        create_comments_bulk(db, [{"user_id" : user_id, "ticket_id" : ticket_id, "content" : "to be deleted"} for _ in range(comments_per_ticket)])
+        return (ticket_id,)
+    def ranked(rank):
+        membership(user_id, group_id, True)
+        update_user_group(db, user_id, group_id, rank_in_group = rank)
+
+    return [
+        Case("all_unrestickets_for_user", lambda: all_unrestickets_for_user(user_id)),
+        Case("all_tickets_by_user", lambda: all_tickets_by_user(user_id)),
+        Case("read_ticket priority", lambda: read_ticket(db, priority = 3)),
+        Case("read_ticket group_id", lambda: read_ticket(db, group_id = group_id)),
+        Case("read_ticket user_id", lambda: read_ticket(db, user_id = user_id)),
+        Case("read_ticket unresolved", lambda: read_ticket(db, resolved = False)),
+        Case("read_ticket title", lambda: read_ticket(db, title = word)),
+        Case("views.index", lambda: get("/")),
+        Case("views.my_tickets", lambda: get("/mytickets")),
+        Case("views.groups", lambda: get("/groups")),
+        Case("views.view_ticket", lambda ticket_id: get(f"/view-ticket?id={ticket_id}"), lambda: (next(cycle),)),
+        Case("views.view_ticket most comments", lambda: get(f"/view-ticket?id={busiest_ticket}")),
+        Case("views.search", lambda: get(f"/search?q={word}")),
+        Case("request_endpoints.post_comment", lambda ticket_id: send("POST", "/post-comment",
+            {"userID" : user_id, "ticketID" : ticket_id, "commentContent" : "benchmark comment"}), lambda: (next(cycle),)),
+        Case("request_endpoints.delete_comment", lambda comment_id: send("DELETE", "/delete-comment", {"commentID" : comment_id}),
+            lambda: (create_comment(db, user_id, next(cycle), "to be deleted").id,)),
+        Case("request_endpoints.delete_ticket", lambda ticket_id: send("DELETE", "/delete-ticket", {"ticketID" : ticket_id}), new_ticket),
+        Case("request_endpoints.resolve_ticket", lambda: send("PATCH", "/resolve-ticket", {"ticketID" : own_ticket}), without_flashes),
+        Case("request_endpoints.join_group", lambda: send("POST", "/join-group", {"userID" : user_id, "groupID" : join_group}),
+            lambda: membership(user_id, join_group, False)),
+        Case("request_endpoints.leave_group", lambda: send("DELETE", "/leave-group", {"userID" : user_id, "groupID" : join_group}),
+            lambda: membership(user_id, join_group, True)),
+        Case("request_endpoints.rerank_user", lambda: send("PATCH", "/rerank-user", {"userID" : user_id, "groupID" : group_id, "newRank" : 1}),
+            lambda: ranked(0)),
+        Case("request_endpoints.kick_user", lambda: send("DELETE", "/kick-user", {"userID" : other_id, "groupID" : group_id}),
+            lambda: membership(other_id, group_id, True)),
+    ]
+
+def environment():
+    '''
+    What the results were measured on, stored with them so runs can be told apart
+    '''
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {"created" : datetime.utcnow().isoformat(timespec = "seconds"), "git_revision" : revision,
+        "python" : platform.python_version(), "sqlite" : sqlite3.sqlite_version, "platform" : platform.platform()}
+
+def dataset_counts():
+    return {"users" : db.session.query(User).count(), "groups" : db.session.query(Groups).count(),
+        "memberships" : db.session.query(User_Groups).count(), "tickets" : db.session.query(Ticket).count(),
+        "comments" : db.session.query(Comment).count()}
+
+def compare(previous, current):
+    '''
+    Lines comparing the median latency and statement count of every case found in both result files
+    '''
+    lines = [f"{'case':<40} {'p50 before':>11} {'p50 after':>11} {'change':>8} {'queries':>11}"]
+    for name, after in current["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        change = (after["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0
+        lines.append(f"{name:<40} {before['p50_ms']:>9.2f}ms {after['p50_ms']:>9.2f}ms {change:>+7.1f}% {before['queries']:>5g} -> {after['queries']:<3g}")
+    return lines
+
+def table(results):
+    lines = [f"{'case':<40} {'p50':>9} {'p90':>9} {'p99':>9} {'queries':>8}"]
+    for name, stats in results.items():
+        lines.append(f"{name:<40} {stats['p50_ms']:>7.2f}ms {stats['p90_ms']:>7.2f}ms {stats['p99_ms']:>7.2f}ms {stats['queries']:>8g}")
+    return lines
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "python -m benchmarks", description = "Benchmark the support ticket system against a synthetic dataset")
+    parser.add_argument("--database", default = DEFAULT_DATABASE, help = "SQLite file to benchmark, the dataset is generated if it is empty")
+    parser.add_argument("--regenerate", action = "store_true", help = "drop the database and generate a new dataset")
+    for name, default in DEFAULT_SIZES.items():
+        parser.add_argument(f"--{name}", type = int, default = default, help = f"dataset size (default {default})")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--iterations", type = int, default = 30)
+    parser.add_argument("--warmup", type = int, default = 3)
+    parser.add_argument("--case", action = "append", dest = "only", help = "only run this case, may be repeated")
+    parser.add_argument("--output", help = "where to write the JSON results (default benchmarks/results/<time>.json)")
+    parser.add_argument("--compare", help = "JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    app = create_app(config = {"SECRET_KEY" : "benchmark", "SQLALCHEMY_DATABASE_URI" : f"sqlite:///{os.path.abspath(args.database)}",
+        "SQLALCHEMY_TRACK_MODIFICATIONS" : False})
+    with app.app_context():
+        if args.regenerate:
+            db.drop_all()
+        db.create_all()
+        if db.session.query(Ticket).count() == 0:
+            start = perf_counter()
+            progress = lambda table, written, total: print(f"\r{table}: {written}/{total}", end = "", file = sys.stderr, flush = True)
+            generate_dataset(args.users, args.groups, args.memberships, args.tickets, args.comments, seed = args.seed, progress = progress)
+            print(f"\nGenerated the dataset in {perf_counter() - start:.1f}s", file = sys.stderr)
+        dataset = dataset_counts()
+
+    results = {"environment" : environment(), "dataset" : dataset, "iterations" : args.iterations,
+        "results" : run_benchmarks(app, args.iterations, args.warmup, seed = args.seed, only = args.only)}
+    print("\n".join(table(results["results"])))
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.utcnow().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok = True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent = 2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            print("\n".join(compare(json.load(file), results)))
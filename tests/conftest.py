@@ -3,7 +3,9 @@ from venv import create
 import pytest
 from SupportTicketSystem import create_app, crud_operations, db
 from SupportTicketSystem.models import User
+from SupportTicketSystem.cache import clear_entity_caches
 from datetime import datetime
+from SupportTicketSystem.instrumentation import record_statements
 
 config = {
     "TESTING":True,
@@ -27,6 +29,8 @@ def init_database(client):
     db.session.add(User(email = "user@place.com", password = "password", username = "user_one"))
     db.session.commit()
     yield
+    db.session.remove()
+    clear_entity_caches()
     db.drop_all()
 
 @pytest.fixture(scope = "function")
@@ -36,6 +40,14 @@ def login_default_user(client):
     yield
     client.get("/logout", follow_redirects=True)
 
+@pytest.fixture(scope = "function")
+def count_queries(client):
+    '''
+    Records every statement executed against the engine for the duration of the test
+    '''
+    with record_statements() as statements:
+        yield statements
+
 @pytest.fixture(scope = "function")
 def init_large_database(client, time_posted):
     db.create_all()
@@ -72,6 +84,8 @@ def init_large_database(client, time_posted):
     crud_operations.create_comment(db, u1.id, t1.id, "comment content", time_posted=time_posted)
     
     yield
+    db.session.remove()
+    clear_entity_caches()
     db.drop_all()
 
 
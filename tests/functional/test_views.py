@@ -1,4 +1,13 @@
 from flask import request
+import base64
+import json
+import logging
+from datetime import timedelta
+from werkzeug.http import http_date, parse_date
+from SupportTicketSystem import db
+from SupportTicketSystem.crud_operations import create_user, create_group, create_user_group, create_ticket, create_comment, read_group, read_user_group, read_ticket, read_comment
+from SupportTicketSystem.instrumentation import query_budget, STATEMENTS_HEADER, TIME_HEADER
+from SupportTicketSystem.events import event_broker
 
 '''
 All non-authenticated page view requests to anything except the login or signup page should redirect to the login page
@@ -78,4 +87,340 @@ def test_groups_authed(client, init_database,login_default_user):
 def test_viewticket_authed(client, init_database,login_default_user):
     with client as test_client:
         response = test_client.get("/view-ticket", follow_redirects = False)
-        assert response.status_code == 200
\ No newline at end of file
+        assert response.status_code == 200
+'''
+The feed views load every ticket with its author and group in a fixed number of statements
+'''
+def statements_for(test_client, count_queries, url):
+    del count_queries[:]
+    response = test_client.get(url, follow_redirects = False)
+    assert response.status_code == 200
+    return len(count_queries)
+
+def test_home_page_query_count(client, init_database, login_default_user, count_queries):
+    with client as test_client:
+        author = create_user(db, email = "author@place.com", password = "password", username = "author")
+        group = create_group(db, "feed group")
+        create_user_group(db, user_id = 1, group_id = group.id)
+        for i in range(2):
+            create_ticket(db, author.id, group.id, f"title {i}", "content", priority = i % 4)
+            create_ticket(db, author.id, None, f"universal title {i}", "content")
+        few = statements_for(test_client, count_queries, "/")
+        for i in range(30):
+            create_ticket(db, author.id, group.id, f"title {i}", "content", priority = i % 4)
+            create_ticket(db, author.id, None, f"universal title {i}", "content")
+        many = statements_for(test_client, count_queries, "/")
+        assert few == many
+
+def test_mytickets_query_count(client, init_database, login_default_user, count_queries):
+    with client as test_client:
+        group = create_group(db, "my group")
+        create_user_group(db, user_id = 1, group_id = group.id)
+        for i in range(2):
+            create_ticket(db, 1, group.id, f"title {i}", "content")
+            create_ticket(db, 1, None, f"universal title {i}", "content", resolved = True)
+        few = statements_for(test_client, count_queries, "/mytickets")
+        for i in range(30):
+            create_ticket(db, 1, group.id, f"title {i}", "content")
+            create_ticket(db, 1, None, f"universal title {i}", "content", resolved = True)
+        many = statements_for(test_client, count_queries, "/mytickets")
+        assert few == many
+
+def test_home_page_pagination(client, init_database, login_default_user):
+    with client as test_client:
+        author = create_user(db, email = "author@place.com", password = "password", username = "author")
+        for i in range(3):
+            create_ticket(db, author.id, None, f"paged title {i}", "content")
+        response = test_client.get("/?per_page=2")
+        assert b"paged title 0" in response.data and b"paged title 2" not in response.data
+        assert b"after=" in response.data
+        assert test_client.get("/?after=garbage").status_code == 400
+
+def test_groups_query_count(client, init_database, login_default_user, count_queries):
+    with client as test_client:
+        def add_groups(start, stop):
+            for i in range(start, stop):
+                group = create_group(db, f"group {i}")
+                member = create_user(db, email = f"member{i}@place.com", password = "password", username = f"member{i}")
+                create_user_group(db, user_id = member.id, group_id = group.id, rank_in_group = 2)
+                if i % 2:
+                    create_user_group(db, user_id = 1, group_id = group.id)
+        add_groups(0, 2)
+        few = statements_for(test_client, count_queries, "/groups")
+        add_groups(2, 20)
+        many = statements_for(test_client, count_queries, "/groups")
+        assert few == many
+        response = test_client.get("/groups")
+        assert b"group 19 (2)" in response.data and b"group 18 (1)" in response.data
+
+def test_view_ticket_query_count(client, init_database, login_default_user, count_queries):
+    with client as test_client:
+        commenters = [create_user(db, email = f"commenter{i}@place.com", password = "password", username = f"commenter{i}") for i in range(5)]
+        ticket = create_ticket(db, 1, None, "title", "content")
+        def add_comments(count):
+            for i in range(count):
+                create_comment(db, commenters[i % len(commenters)].id, ticket.id, f"comment {i}")
+        add_comments(2)
+        few = statements_for(test_client, count_queries, f"/view-ticket?id={ticket.id}")
+        add_comments(40)
+        many = statements_for(test_client, count_queries, f"/view-ticket?id={ticket.id}")
+        assert few == many
+        assert test_client.get("/view-ticket?id=1000").status_code == 404
+
+def test_search_page(client, init_database, login_default_user):
+    with client as test_client:
+        create_ticket(db, 1, None, "searchable title", "content")
+        response = test_client.get("/search?q=searchable")
+        assert response.status_code == 200
+        assert b"searchable title" in response.data
+        assert b"No tickets found" in test_client.get("/search?q=nothing+here").data
+
+'''
+Query budgets, a page going over its budget is an N+1 regression in common_queries or the templates
+'''
+VIEW_BUDGETS = {"/" : 3, "/mytickets" : 3, "/groups" : 3, "/view-ticket?id=1" : 3, "/search?q=budget" : 3}
+
+def test_view_query_budgets(client, init_database, login_default_user):
+    with client as test_client:
+        author = create_user(db, email = "author@place.com", password = "password", username = "author")
+        group = create_group(db, "budget group")
+        create_user_group(db, user_id = 1, group_id = group.id, rank_in_group = 2)
+        create_user_group(db, user_id = author.id, group_id = group.id)
+        for i in range(10):
+            ticket = create_ticket(db, author.id if i % 2 else 1, group.id if i % 3 else None, f"budget title {i}", "content", priority = i % 4)
+            create_comment(db, author.id, ticket.id, f"budget comment {i}")
+        for url, budget in VIEW_BUDGETS.items():
+            with query_budget(budget):
+                assert test_client.get(url).status_code == 200
+
+def test_statement_count_headers(client, init_database, login_default_user, caplog):
+    with client as test_client:
+        with caplog.at_level(logging.INFO, logger = "SupportTicketSystem.instrumentation"):
+            with query_budget(10) as statements:
+                response = test_client.get("/groups")
+        assert int(response.headers[STATEMENTS_HEADER]) == len(statements)
+        assert float(response.headers[TIME_HEADER]) >= 0
+        line = json.loads(caplog.records[-1].getMessage())
+        assert line["endpoint"] == "views.groups"
+        assert line["statements"] == len(statements)
+        assert line["status"] == 200
+
+def test_export(client, init_database, login_default_user):
+    with client as test_client:
+        other = create_user(db, email = "other@place.com", password = "password", username = "other")
+        hidden = create_group(db, "hidden group")
+        create_ticket(db, other.id, hidden.id, "hidden ticket", "content")
+        create_ticket(db, other.id, None, "visible ticket", "content")
+        response = test_client.get("/export?format=csv")
+        assert response.status_code == 200
+        assert response.mimetype == "text/csv"
+        assert b"visible ticket" in response.data and b"hidden ticket" not in response.data
+        assert test_client.get(f"/export?group_id={hidden.id}").status_code == 403
+        assert test_client.get("/export?format=xml").status_code == 400
+        assert test_client.get("/export?since=garbage").status_code == 400
+
+def test_join_and_leave_group(client, init_database, login_default_user):
+    with client as test_client:
+        other = create_user(db, email = "other@place.com", password = "password", username = "other").id
+        group = create_group(db, "joinable group").id
+        test_client.post("/join-group", data = json.dumps({"userID" : 1, "groupID" : group}))
+        test_client.post("/join-group", data = json.dumps({"userID" : other, "groupID" : group}))
+        assert read_user_group(db, 1, group).rank_in_group == 2 #the first member is the admin
+        assert read_user_group(db, other, group).rank_in_group == 0
+        test_client.delete("/leave-group", data = json.dumps({"userID" : 1, "groupID" : group}))
+        assert read_user_group(db, other, group).rank_in_group == 2 #the last member left is promoted
+        assert read_group(db, id = group).member_count == 1
+
+def test_conditional_get(client, init_database, login_default_user):
+    with client as test_client:
+        other = create_user(db, email = "other@place.com", password = "password", username = "other").id
+        mine = create_group(db, "my group").id
+        elsewhere = create_group(db, "other group").id
+        create_user_group(db, 1, mine)
+        ticket = create_ticket(db, other, mine, "watched ticket", "content").id
+        revalidate = lambda url, response, **headers: test_client.get(url, headers = {"If-None-Match" : response.headers["ETag"], **headers})
+        pages = {url : test_client.get(url) for url in ["/", "/mytickets", "/groups", f"/view-ticket?id={ticket}"]}
+        for url, response in pages.items():
+            assert response.status_code == 200 and response.headers["ETag"]
+            with query_budget(2): #the version stamps, and the user when it is not cached
+                revalidated = revalidate(url, response)
+            assert revalidated.status_code == 304 and revalidated.data == b""
+            assert test_client.get(url, headers = {"If-Modified-Since" : response.headers["Last-Modified"]}).status_code == 200 #may have changed later in that second
+            next_second = http_date(parse_date(response.headers["Last-Modified"]) + timedelta(seconds = 1))
+            assert test_client.get(url, headers = {"If-Modified-Since" : next_second}).status_code == 304
+        test_client.application.config["PAGE_ETAG_SALT"] = "another salt"
+        assert revalidate("/", pages["/"]).status_code == 200
+        del test_client.application.config["PAGE_ETAG_SALT"] #every worker derives the same salt from the SECRET_KEY
+        assert revalidate("/", pages["/"]).status_code == 304
+        create_ticket(db, other, elsewhere, "unseen ticket", "content") #in a group the user is not in
+        assert revalidate("/", pages["/"]).status_code == 304
+        assert revalidate("/groups", pages["/groups"]).status_code == 200 #its open ticket count changed
+        create_comment(db, other, ticket, "new comment")
+        assert revalidate(f"/view-ticket?id={ticket}", pages[f"/view-ticket?id={ticket}"]).status_code == 200
+        assert revalidate("/", pages["/"]).status_code == 304
+        create_ticket(db, other, mine, "new ticket", "content")
+        assert revalidate("/", pages["/"]).status_code == 200
+        assert revalidate("/mytickets", pages["/mytickets"]).status_code == 304
+        create_ticket(db, 1, None, "my ticket", "content")
+        assert revalidate("/mytickets", pages["/mytickets"]).status_code == 200
+        assert revalidate("/?per_page=5", pages["/"]).status_code == 200 #other URLs are other pages
+        current = test_client.get("/")
+        with test_client.session_transaction() as session:
+            session["_flashes"] = [("success", "Flashed message")]
+        flashed = revalidate("/", current)
+        assert flashed.status_code == 200 and b"Flashed message" in flashed.data #waiting messages are always shown
+        assert revalidate("/", current).status_code == 304
+        test_client.delete("/delete-ticket", data = json.dumps({"ticketID" : ticket}))
+        assert revalidate(f"/view-ticket?id={ticket}", pages[f"/view-ticket?id={ticket}"]).status_code == 404
+
+def test_feed_api(client, init_database, login_default_user):
+    with client as test_client:
+        author = create_user(db, email = "author@place.com", password = "password", username = "author")
+        for i in range(3):
+            create_ticket(db, author.id, None, f"paged title {i}", "content")
+        first = test_client.get("/api/feed?per_page=2").get_json()
+        assert [item["title"] for item in first["items"]] == ["paged title 0", "paged title 1"]
+        assert first["items"][0]["author"] == "author" and b"paged title 0" in first["items"][0]["html"].encode()
+        assert first["prev_cursor"] is None and first["next_cursor"]
+        second = test_client.get(f"/api/feed?per_page=2&after={first['next_cursor']}").get_json()
+        assert [item["title"] for item in second["items"]] == ["paged title 2"] and second["next_cursor"] is None
+        back = test_client.get(f"/api/feed?per_page=2&before={second['prev_cursor']}").get_json()
+        assert [item["title"] for item in back["items"]] == ["paged title 0", "paged title 1"]
+        assert test_client.get("/api/feed?after=garbage").status_code == 400
+        for values in ([{"x" : 1}, "2022-01-01T00:00:00", 1], [1, "2022-01-01T00:00:00", [1]], [True, "2022-01-01T00:00:00", 1], [1, 5, 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            assert test_client.get(f"/api/feed?after={cursor}").status_code == 400
+        assert test_client.get("/api/mytickets").get_json()["items"] == []
+
+def test_actions_return_changes(client, init_database, login_default_user):
+    with client as test_client:
+        other = create_user(db, email = "other@place.com", password = "password", username = "other").id
+        hidden = create_group(db, "hidden group").id
+        create_user_group(db, other, hidden)
+        secret = create_ticket(db, other, hidden, "secret ticket", "content").id
+        ticket = create_ticket(db, 1, None, "open ticket", "content").id
+        assert test_client.get(f"/api/comments?ticket_id={secret}").status_code == 404 #not a member
+        assert test_client.get("/api/comments?ticket_id=1000").status_code == 404
+        comment = test_client.post("/post-comment", data = json.dumps({"userID" : 1, "ticketID" : ticket, "commentContent" : "hello"})).get_json()["comment"]
+        assert comment["author"] == "user_one" and comment["content"] == "hello" and comment["ticket_id"] == ticket
+        assert [listed["id"] for listed in test_client.get(f"/api/comments?ticket_id={ticket}").get_json()["comments"]] == [comment["id"]]
+        assert test_client.delete("/delete-comment", data = json.dumps({"commentID" : comment["id"]})).get_json() == {"deleted" : comment["id"]}
+        resolved = test_client.patch("/resolve-ticket", data = json.dumps({"ticketID" : ticket})).get_json()["ticket"]
+        assert resolved["resolved"] and resolved["time_resolved_display"]
+        joined = test_client.post("/join-group", data = json.dumps({"userID" : 1, "groupID" : hidden})).get_json()
+        assert joined["membership"] == {"user_id" : 1, "group_id" : hidden, "rank" : 0}
+        assert joined["group"]["member_count"] == 2 and joined["group"]["viewer_rank"] == 0 and joined["group"]["open_tickets"] == 1
+        assert f'data-group-id="{hidden}"' in joined["html"] and "Leave Group" in joined["html"]
+        assert test_client.get(f"/api/comments?ticket_id={secret}").status_code == 200
+        left = test_client.delete("/leave-group", data = json.dumps({"userID" : 1, "groupID" : hidden})).get_json()
+        assert left["membership"]["rank"] is None and left["group"]["viewer_rank"] is None and "Join Group" in left["html"]
+        assert test_client.get(f"/api/group?id={hidden}").get_json()["group"]["member_count"] == 1
+        assert test_client.get("/api/group?id=1000").status_code == 404
+
+def test_event_stream(client, init_database, login_default_user):
+    with client as test_client:
+        group = create_group(db, "streamed group").id
+        other = create_user(db, email = "other@place.com", password = "password", username = "other").id
+        create_user_group(db, 1, group)
+        response = test_client.get("/events", buffered = False)
+        assert response.mimetype == "text/event-stream"
+        chunks = iter(response.response)
+        assert next(chunks).startswith(b"retry:")
+        create_ticket(db, 1, group, "own ticket", "content") #the feed leaves out the user's own tickets, so it is not sent
+        create_ticket(db, other, group, "live ticket", "content")
+        event = json.loads(next(chunks).decode()[len("data: "):])
+        assert event["type"] == "ticket_created" and event["ticket"]["title"] == "live ticket"
+        assert event["ticket"]["group_name"] == "streamed group" and "live ticket" in event["html"]
+        response.close()
+        assert not event_broker().listening() #closing the stream unsubscribes it
+
+def test_resolve_ticket_posts_comment(client, init_database, login_default_user):
+    with client as test_client:
+        ticket = create_ticket(db, 1, None, "to resolve", "content").id
+        resolved = test_client.patch("/resolve-ticket", data = json.dumps({"ticketID" : ticket})).get_json()
+        assert resolved["ticket"]["resolved"] and resolved["comment"]["content"] == "I resolved this ticket"
+        assert [comment.id for comment in read_comment(db, ticket_id = ticket)] == [resolved["comment"]["id"]]
+        reopened = test_client.patch("/resolve-ticket", data = json.dumps({"ticketID" : ticket})).get_json()
+        assert not reopened["ticket"]["resolved"] and reopened["comment"] is None
+        assert test_client.patch("/resolve-ticket", data = json.dumps({"ticketID" : 1000})).status_code == 404
+
+def test_batch(client, init_database, login_default_user):
+    with client as test_client:
+        other = create_user(db, email = "other@place.com", password = "password", username = "other").id
+        third = create_user(db, email = "third@place.com", password = "password", username = "third").id
+        admin_of, member_of, outside = create_group(db, "admin of").id, create_group(db, "member of").id, create_group(db, "outside").id
+        create_user_group(db, 1, admin_of, rank_in_group = 2)
+        create_user_group(db, other, admin_of)
+        create_user_group(db, third, admin_of)
+        create_user_group(db, 1, member_of)
+        tickets = [create_ticket(db, other, admin_of, f"ticket {i}", "content").id for i in range(2)]
+        members_ticket = create_ticket(db, other, member_of, "member ticket", "content").id
+        hidden = create_ticket(db, other, outside, "hidden ticket", "content").id
+        operations = [
+            {"op" : "resolve", "ticketID" : tickets[0]},
+            {"op" : "comment", "ticketID" : tickets[1], "commentContent" : "triaged"},
+            {"op" : "delete", "ticketID" : tickets[1]},
+            {"op" : "comment", "ticketID" : tickets[1], "commentContent" : "too late"}, #deleted by the operation before
+            {"op" : "resolve", "ticketID" : hidden},
+            {"op" : "delete", "ticketID" : members_ticket}, #only admins may delete
+            {"op" : "rerank", "userID" : other, "groupID" : admin_of, "newRank" : 1},
+            {"op" : "rerank", "userID" : third, "groupID" : admin_of, "newRank" : 7},
+            {"op" : "kick", "userID" : third, "groupID" : admin_of},
+            {"op" : "kick", "userID" : 1, "groupID" : member_of},
+            {"op" : "resolve"},
+            {"op" : "explode"},
+        ]
+        with query_budget(60): #a SAVEPOINT and RELEASE per operation, and the ranks of the user are read once
+            results = test_client.post("/batch", data = json.dumps({"operations" : operations})).get_json()["results"]
+        assert [result["ok"] for result in results] == [True, True, True, False, False, False, True, False, True, False, False, False]
+        assert results[0]["ticket"]["resolved"] and results[0]["comment"]["content"] == "I resolved this ticket"
+        assert results[2] == {"ok" : True, "deleted" : tickets[1]} and results[6]["membership"]["rank"] == 1
+        assert results[5]["error"] == "Only the group's admins can delete its tickets and comments"
+        assert results[10]["error"] == "Missing field 'ticketID'" and results[11]["error"] == "Unknown operation"
+        assert read_ticket(db, id = tickets[0]).resolved and read_ticket(db, id = tickets[1]) is None
+        assert read_ticket(db, id = hidden).resolved == False and read_ticket(db, id = members_ticket) is not None
+        assert read_user_group(db, other, admin_of).rank_in_group == 1 and read_user_group(db, third, admin_of) is None
+        assert read_group(db, id = admin_of).member_count == 2
+        assert test_client.post("/batch", data = json.dumps({"operations" : [{"op" : "resolve"}] * 101})).status_code == 400
+        assert test_client.post("/batch", data = "not json").status_code == 400
+
+def test_update_tickets(client, init_database, login_default_user):
+    with client as test_client:
+        other = create_user(db, email = "other@place.com", password = "password", username = "other").id
+        admin_of, member_of, outside = create_group(db, "admin of").id, create_group(db, "member of").id, create_group(db, "outside").id
+        create_user_group(db, 1, admin_of, rank_in_group = 2)
+        create_user_group(db, 1, member_of)
+        create_user_group(db, other, outside)
+        administered = [create_ticket(db, other, admin_of, f"admin ticket {i}", "content").id for i in range(3)]
+        loose = create_ticket(db, other, None, "loose", "content").id
+        members = create_ticket(db, other, member_of, "member ticket", "content").id
+        hidden = create_ticket(db, other, outside, "hidden ticket", "content").id
+        patch = lambda **body: test_client.patch("/update-tickets", data = json.dumps(body))
+        assert [group["group_name"] for group in test_client.get("/api/groups").get_json()["groups"]] == ["admin of", "member of"]
+        with query_budget(10): #the groups of the tickets and the user's ranks are read once, however many tickets there are
+            response = patch(ticketIDs = administered + [loose, members], resolved = True)
+        assert response.get_json()["updated"] == 5 and all(read_ticket(db, id = ticket).resolved for ticket in administered + [loose, members])
+        assert patch(ticketIDs = administered + [hidden], resolved = False).status_code == 403
+        assert patch(ticketIDs = [members], priority = 2).status_code == 403 #members may resolve, but not reprioritize
+        assert patch(ticketIDs = administered, groupID = outside).status_code == 403
+        assert patch(ticketIDs = administered, resolved = False, priority = 3, groupID = member_of).get_json()["updated"] == 3
+        assert [(ticket.resolved, ticket.priority, ticket.group_id) for ticket in [read_ticket(db, id = id) for id in administered]] == [(False, 3, member_of)] * 3
+        assert patch(ticketIDs = administered, priority = 1).status_code == 403 #they are in a group the user is only a member of now
+        assert patch(ticketIDs = [loose], groupID = admin_of).get_json()["message"] == "Updated 1 ticket"
+        assert patch(ticketIDs = [loose], priority = 9).status_code == 400
+        assert patch(ticketIDs = ["x"]).status_code == 400
+        assert patch(ticketIDs = [loose], resolved = "false").status_code == 400
+        assert patch(ticketIDs = [loose], groupID = [admin_of]).status_code == 400
+        assert patch(ticketIDs = [loose], groupID = {"id" : admin_of}).status_code == 400
+        assert patch(ticketIDs = [loose], priority = True).status_code == 400
+        assert b'class = "ticket-select"' in test_client.get("/").data and b'id = "bulk-toolbar"' in test_client.get("/mytickets").data
+
+def test_cache_stats_are_for_admins(client, init_database, login_default_user):
+    with client as test_client:
+        assert test_client.get("/cache-stats").status_code == 403
+        test_client.application.config["ADMIN_EMAILS"] = ["user@place.com"]
+        try:
+            stats = test_client.get("/cache-stats").get_json()
+        finally:
+            del test_client.application.config["ADMIN_EMAILS"]
+        assert {"user", "groups", "fragments"} <= set(stats)
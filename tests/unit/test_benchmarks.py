@@ -0,0 +1,36 @@
+from conftest import db
+from SupportTicketSystem.models import *
+from benchmarks import generate_dataset, run_benchmarks
+from benchmarks.runner import percentile, compare
+
+'''
+Smoke tests of the benchmark suite on a tiny dataset, the real runs are made with python -m benchmarks
+'''
+
+def test_generate_dataset(client, init_database):
+    with client as test_client:
+        counts = generate_dataset(users = 20, groups = 4, memberships = 2, tickets = 50, comments = 2, seed = 1, batch_size = 8)
+        assert counts["users"] == 20 and counts["groups"] == 4 and counts["tickets"] == 50
+        assert db.session.query(User).count() == 21 #the fixture's user is left alone
+        assert db.session.query(Ticket).count() == 50
+        assert db.session.query(Comment).count() == counts["comments"]
+        assert db.session.query(User_Groups).count() == counts["memberships"]
+        assert db.session.query(User_Groups).filter(User_Groups.rank_in_group == 2).count() <= 4 #one admin per group
+
+def test_run_benchmarks(client, init_database):
+    with client as test_client:
+        generate_dataset(users = 10, groups = 3, tickets = 30, comments = 2, seed = 1)
+        results = run_benchmarks(test_client.application, iterations = 2, warmup = 0)
+        assert "views.view_ticket" in results and "request_endpoints.delete_ticket" in results
+        for stats in results.values():
+            assert stats["iterations"] == 2
+            assert stats["p50_ms"] <= stats["p99_ms"] <= stats["max_ms"]
+            assert stats["queries"] >= 1
+        lines = compare({"results" : results}, {"results" : results})
+        assert len(lines) == len(results) + 1
+
+def test_percentile():
+    ordered = list(range(1, 101))
+    assert percentile(ordered, 50) == 50
+    assert percentile(ordered, 99) == 99
+    assert percentile([5], 90) == 5
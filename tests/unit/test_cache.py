@@ -0,0 +1,147 @@
+import pytest
+from SupportTicketSystem import cache
+from SupportTicketSystem.cache import LRUCache, SizedLRUCache, entity_cache, entity_cache_stats, memberships
+from SupportTicketSystem.crud_operations import *
+from SupportTicketSystem.common_queries import read_username, user_ranks
+from SupportTicketSystem.versions import bump, user_scope
+from conftest import db
+
+'''
+LRU cache behaviour, then the User and Groups entity caches read through by crud_operations, and the membership cache
+'''
+
+def test_lru_eviction():
+    lru = LRUCache(max_entries = 2, ttl = 60)
+    lru.set(1, "one")
+    lru.set(2, "two")
+    assert lru.get(1) == "one" #1 is now the most recently used
+    lru.set(3, "three")
+    assert lru.get(2) is None
+    assert lru.get(1) == "one"
+    assert lru.get(3) == "three"
+    assert lru.stats() == {"hits" : 3, "misses" : 1, "evictions" : 1, "entries" : 2, "max_entries" : 2}
+    lru.invalidate(1)
+    assert lru.get(1) is None
+
+def test_sized_lru_eviction():
+    lru = SizedLRUCache(max_bytes = 10, ttl = 60, sizeof = len)
+    lru.set("a", "aaaa")
+    lru.set("b", "bbbb")
+    lru.set("a", "aaa") #replacing a value frees the old one
+    assert lru.stats()["bytes"] == 7
+    lru.set("c", "cccc") #over the limit, b is the least recently used
+    assert lru.get("b") is None
+    assert lru.get("a") == "aaa" and lru.get("c") == "cccc"
+    assert lru.stats()["bytes"] == 7 and lru.stats()["evictions"] == 1
+    lru.set("d", "d" * 11) #too big to keep at all
+    assert lru.get("d") is None
+    assert lru.stats()["entries"] == 0 and lru.stats()["bytes"] == 0
+
+def test_lru_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    lru = LRUCache(max_entries = 10, ttl = 5)
+    lru.set("key", "value")
+    now[0] += 4
+    assert lru.get("key") == "value"
+    now[0] += 2
+    assert lru.get("key") is None
+    assert lru.stats()["entries"] == 0
+
+def test_read_user_is_cached(client, init_database, count_queries):
+    with client as test_client:
+        assert read_username(1) == "user_one"
+        db.session.remove() #new request
+        del count_queries[:]
+        assert read_username(1) == "user_one"
+        assert read_user(db, user_id = 1).email == "user@place.com"
+        assert count_queries == []
+        assert entity_cache_stats()["user"]["hits"] >= 1
+        assert read_user(db, user_id = 1000) == []
+
+def test_user_writes_invalidate(client, init_database):
+    with client as test_client:
+        read_user(db, user_id = 1)
+        update_user(db, 1, username = "renamed")
+        db.session.remove()
+        assert read_username(1) == "renamed"
+        user = create_user(db, email = "other@place.com", password = "password", username = "other")
+        read_user(db, user_id = user.id)
+        delete_user(db, user.id)
+        db.session.remove()
+        assert read_user(db, user_id = user.id) == []
+
+def test_group_writes_invalidate(client, init_database, count_queries):
+    with client as test_client:
+        group = create_group(db, "cached group")
+        group_id = group.id
+        db.session.remove()
+        read_group(db, id = group_id)
+        db.session.remove()
+        del count_queries[:]
+        assert read_group(db, id = group_id).group_name == "cached group"
+        assert count_queries == []
+        update_group(db, group_id, group_name = "renamed group")
+        db.session.remove()
+        assert read_group(db, id = group_id).group_name == "renamed group"
+        delete_group(db, group_id)
+        db.session.remove()
+        assert read_group(db, id = group_id) is None
+        assert entity_cache(Groups).stats()["entries"] == 0
+
+def test_memberships_are_cached(client, init_database, count_queries):
+    with client as test_client:
+        expected = {user_group.group_id : user_group.rank_in_group for user_group in read_user_group(db, user_id = 1)}
+        db.session.remove()
+        del count_queries[:]
+        assert dict(user_ranks(1)) == expected
+        assert len(count_queries) == 2 #the user's version stamp and the memberships
+        db.session.remove() #new request
+        assert dict(user_ranks(1)) == expected
+        assert len(count_queries) == 3 #only the stamp
+        assert user_ranks(1000) == {}
+        with pytest.raises(TypeError):
+            user_ranks(1)[5] = 2 #shared between requests, so read only
+
+def test_membership_writes_invalidate(client, init_database):
+    with client as test_client:
+        group_id = create_group(db, "members").id
+        assert group_id not in user_ranks(1)
+        create_user_group(db, 1, group_id)
+        assert user_ranks(1)[group_id] == 0
+        update_user_group(db, 1, group_id, rank_in_group = 2)
+        assert user_ranks(1)[group_id] == 2
+        delete_user_group(db, 1, group_id)
+        assert group_id not in user_ranks(1)
+        create_user_groups_bulk(db, [{"user_id" : 1, "group_id" : group_id}, {"user_id" : 2, "group_id" : group_id, "rank_in_group" : 1}])
+        assert user_ranks(1)[group_id] == 0 and user_ranks(2)[group_id] == 1
+        delete_group(db, group_id)
+        assert group_id not in user_ranks(1) and group_id not in user_ranks(2)
+
+def test_membership_read_before_commit_is_dropped(client, init_database):
+    with client as test_client:
+        group_id = create_group(db, "uncommitted").id
+        create_user_group(db, 1, group_id, commit = False)
+        memberships(db.session, 1) #e.g. read by a permission check later in the same transaction
+        db.session.rollback()
+        assert group_id not in user_ranks(1)
+
+def test_membership_writes_of_other_processes(client, init_database):
+    with client as test_client:
+        group_id = create_group(db, "elsewhere").id
+        create_user_group(db, 1, group_id, rank_in_group = 2)
+        assert user_ranks(1)[group_id] == 2
+        #another worker demotes the user, this process's cache is not invalidated
+        db.session.execute(User_Groups.__table__.update().where(User_Groups.user_id == 1).values(rank_in_group = 0))
+        bump(db, [user_scope(1)])
+        db.session.commit()
+        assert user_ranks(1)[group_id] == 0
+
+def test_password_is_not_cached(client, init_database):
+    with client as test_client:
+        read_user(db, user_id = 1)
+        db.session.remove()
+        assert "password" not in entity_cache(User).get(1)
+        stored = db.session.query(User.password).filter(User.id == 1).scalar()
+        user = read_user(db, user_id = 1) #from the cache, the password is read when it is needed
+        assert user.username == "user_one" and user.password == stored
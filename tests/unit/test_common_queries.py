@@ -1,4 +1,6 @@
 from SupportTicketSystem.common_queries import *
+import pytest
+from datetime import datetime
 
 '''
 Test common database query methods.
@@ -68,4 +70,84 @@ def test_read_username(client, init_large_database):
         assert read_username(1) == "username1"
         assert read_username(2) == "username2"
         assert read_username(3) == "username3"
-        assert read_username(4) == "username4"
\ No newline at end of file
+        assert read_username(4) == "username4"
+
+def walk_pages(page_func, user_id, per_page):
+    pages = []
+    rows, prev_cursor, next_cursor = page_func(user_id, per_page = per_page)
+    pages.append(rows)
+    assert prev_cursor is None
+    while next_cursor:
+        rows, prev_cursor, next_cursor = page_func(user_id, after = next_cursor, per_page = per_page)
+        assert prev_cursor
+        pages.append(rows)
+    return pages, prev_cursor
+
+def test_unrestickets_page_for_user(client, init_large_database, time_posted):
+    with client as test_client:
+        for i in range(12):
+            create_ticket(db, 3, None, f"universal {i}", "content", priority = i % 4, time_posted = time_posted)
+        expected = [ticket.id for ticket, _, _, _ in all_unrestickets_for_user(2)]
+        pages, prev_cursor = walk_pages(unrestickets_page_for_user, 2, 5)
+        assert [len(page) for page in pages] == [5, 5, 4]
+        assert [row[0].id for page in pages for row in page] == expected
+        #Walking backwards returns the same pages
+        rows, _, _ = unrestickets_page_for_user(2, before = prev_cursor, per_page = 5)
+        assert [row[0].id for row in rows] == [row[0].id for row in pages[1]]
+        rows, back_prev, _ = unrestickets_page_for_user(2, before = encode_cursor(pages[1][0][0], HOME_FEED_ORDER), per_page = 5)
+        assert [row[0].id for row in rows] == [row[0].id for row in pages[0]]
+        assert back_prev is None
+
+def test_tickets_page_by_user(client, init_large_database, time_posted):
+    with client as test_client:
+        expected = [ticket.id for ticket, _, _, _ in all_tickets_by_user(1)]
+        pages, _ = walk_pages(tickets_page_by_user, 1, 2)
+        assert [len(page) for page in pages] == [2, 1]
+        assert [row[0].id for page in pages for row in page] == expected
+        assert tickets_page_by_user(3) == ([], None, None)
+
+def test_page_size_and_cursor_validation(client, init_large_database):
+    with client as test_client:
+        for i in range(MAX_PAGE_SIZE + 1):
+            create_ticket(db, 3, None, f"universal {i}", "content")
+        rows, _, next_cursor = unrestickets_page_for_user(6, per_page = 10 * MAX_PAGE_SIZE)
+        assert len(rows) == MAX_PAGE_SIZE
+        assert next_cursor
+        assert len(unrestickets_page_for_user(6)[0]) == FEED_PAGE_SIZE
+        with pytest.raises(ValueError):
+            unrestickets_page_for_user(6, after = "not a cursor")
+        with pytest.raises(ValueError):
+            unrestickets_page_for_user(6, after = next_cursor, before = next_cursor)
+
+def test_group_memberships(client, init_large_database):
+    with client as test_client:
+        members = group_memberships()
+        assert [member.id for member in members[1]] == [1, 2, 3, 4, 5]
+        assert [member.rank for member in members[2]] == [2, 0, 0]
+        assert members[3][0].username == "username4"
+        assert 4 not in members #empty group
+        assert list(group_memberships([2])) == [2]
+
+def test_groups_page(client, init_large_database):
+    with client as test_client:
+        users_groups, out_groups = groups_page(2)
+        assert [group.group_name for group in users_groups] == ["group1", "group2"]
+        assert [group.viewer_rank for group in users_groups] == [1, 2]
+        assert [group.group_name for group in out_groups] == ["group3", "group4"]
+        assert [group.member_count for group in out_groups] == [1, 0]
+        assert all(group.viewer_rank is None for group in out_groups)
+        users_groups, out_groups = groups_page(6)
+        assert not users_groups
+        assert len(out_groups) == 4
+
+def test_ticket_detail(client, init_large_database, time_posted):
+    with client as test_client:
+        create_comment(db, 3, 1, "first", time_posted = datetime(year = 1999, month = 1, day = 1))
+        create_comment(db, 2, 1, "last", time_posted = datetime(year = 2001, month = 1, day = 1))
+        ticket, author_name, comment_authors = ticket_detail(1)
+        assert ticket.id == 1
+        assert author_name == "username1"
+        assert [(comment.content, name) for comment, name in comment_authors] == \
+            [("first", "username3"), ("comment content", "username1"), ("last", "username2")]
+        assert ticket_detail(2)[2] == []
+        assert ticket_detail(100) is None
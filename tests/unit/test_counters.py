@@ -0,0 +1,107 @@
+from SupportTicketSystem import db
+from SupportTicketSystem.crud_operations import *
+from SupportTicketSystem.counters import member_count, unresolved_counts, reconcile_counters
+from SupportTicketSystem.cache import entity_cache
+from sqlalchemy import text
+
+def test_member_counts(client, init_database):
+    with client as test_client:
+        group = create_group(db, "Counted group").id
+        other = create_user(db, email = "other@email.com", password = "password", username = "other").id
+        assert member_count(db, group) == 0
+        create_user_group(db, 1, group, rank_in_group = 2)
+        create_user_group(db, other, group)
+        assert member_count(db, group) == 2
+        delete_user_group(db, other, group)
+        assert member_count(db, group) == 1
+        delete_user_group(db, other, group) #already gone
+        assert member_count(db, group) == 1
+        users = create_users_bulk(db, [{"email" : f"bulk{i}@email.com", "password" : "password", "username" : f"bulk{i}"} for i in range(3)])
+        create_user_groups_bulk(db, [{"user_id" : user, "group_id" : group} for user in users])
+        assert member_count(db, group) == 4
+        delete_user(db, users[0])
+        assert member_count(db, group) == 3
+        assert read_group(db, id = group).member_count == 3
+        assert reconcile_counters(db) == {"groups" : 0, "ticket_counts" : 0}
+
+def test_deleting_a_user_invalidates_cached_member_counts(client, init_database):
+    with client as test_client:
+        group = create_group(db, "Cached count").id
+        other = create_user(db, email = "other@email.com", password = "password", username = "other").id
+        create_user_group(db, 1, group, rank_in_group = 2)
+        create_user_group(db, other, group)
+        db.session.remove()
+        assert read_group(db, id = group).member_count == 2 #now in the Groups entity cache
+        db.session.remove()
+        delete_user(db, other)
+        db.session.remove()
+        assert read_group(db, id = group).member_count == 1
+
+def test_member_counts_are_invalidated_on_commit(client, init_database):
+    with client as test_client:
+        group = create_group(db, "Committed count").id
+        db.session.remove()
+        assert read_group(db, id = group).member_count == 0 #now in the Groups entity cache
+        committed = entity_cache(Groups).get(group)
+        db.session.remove()
+        create_user_group(db, 1, group, commit = False)
+        entity_cache(Groups).set(group, committed) #another request reads the group before the commit
+        db.session.commit()
+        db.session.remove()
+        assert read_group(db, id = group).member_count == 1
+
+def test_unresolved_counts(client, init_database):
+    with client as test_client:
+        group = create_group(db, "Ticket group").id
+        kept = create_group(db, "Kept group").id
+        first = create_ticket(db, 1, group, "first", "content", priority = 3).id
+        second = create_ticket(db, 1, group, "second", "content", priority = 3).id
+        create_ticket(db, 1, group, "resolved", "content", priority = 1, resolved = True)
+        create_ticket(db, 1, None, "no group", "content", priority = 0)
+        create_tickets_bulk(db, [{"user_id" : 1, "group_id" : kept, "title" : f"bulk {i}", "content" : "content", "priority" : i % 2} for i in range(4)])
+        assert unresolved_counts(db, group) == {3 : 2}
+        assert unresolved_counts(db, None) == {0 : 1}
+        assert unresolved_counts(db, kept) == {0 : 2, 1 : 2}
+        update_ticket(db, first, priority = 2)
+        assert unresolved_counts(db, group) == {2 : 1, 3 : 1}
+        update_ticket(db, first, resolved = True)
+        assert unresolved_counts(db, group) == {3 : 1}
+        update_ticket(db, second, group_id = kept)
+        assert unresolved_counts(db, group) == {}
+        assert unresolved_counts(db, kept) == {0 : 2, 1 : 2, 3 : 1}
+        delete_ticket(db, second)
+        assert unresolved_counts(db, kept) == {0 : 2, 1 : 2}
+        delete_group(db, kept)
+        assert unresolved_counts(db, kept) == {}
+        assert reconcile_counters(db) == {"groups" : 0, "ticket_counts" : 0}
+
+def test_reconcile_counters(client, init_database):
+    with client as test_client:
+        group = create_group(db, "Drifted group").id
+        create_user_group(db, 1, group)
+        create_ticket(db, 1, group, "drifted", "content", priority = 2)
+        create_ticket(db, 1, None, "drifted too", "content", priority = 1)
+        db.session.execute(text("UPDATE groups SET member_count = 7"))
+        db.session.execute(text("UPDATE group__ticket__counts SET unresolved = 0 WHERE group_id = 0"))
+        db.session.execute(text("INSERT INTO group__ticket__counts (group_id, priority, unresolved) VALUES (99, 0, 4)"))
+        db.session.commit()
+        assert reconcile_counters(db) == {"groups" : 1, "ticket_counts" : 2}
+        assert member_count(db, group) == 1
+        assert unresolved_counts(db, group) == {2 : 1}
+        assert unresolved_counts(db, None) == {1 : 1}
+        assert unresolved_counts(db, 99) == {}
+        result = test_client.application.test_cli_runner().invoke(args = ["reconcile-counters"])
+        assert result.exit_code == 0
+        assert "Corrected 0 member counts and 0 unresolved ticket counts" in result.output
+
+def test_reconcile_adds_missing_counters(client, init_database):
+    with client as test_client:
+        group = create_group(db, "Old group").id
+        create_user_group(db, 1, group)
+        create_ticket(db, 1, group, "old ticket", "content")
+        db.session.execute(text("ALTER TABLE groups DROP COLUMN member_count"))
+        db.session.execute(text("DROP TABLE group__ticket__counts"))
+        db.session.commit()
+        reconcile_counters(db)
+        assert member_count(db, group) == 1
+        assert unresolved_counts(db, group) == {0 : 1}
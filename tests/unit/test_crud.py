@@ -5,6 +5,8 @@ from werkzeug.security import check_password_hash
 from conftest import db
 from SupportTicketSystem.crud_operations import *
 from SupportTicketSystem.models import *
+from SupportTicketSystem.counters import unresolved_counts, reconcile_counters
+from SupportTicketSystem.instrumentation import query_budget
 import pytest
 
 
@@ -81,6 +83,67 @@ def test_create_user_group(client, init_database):
         with pytest.raises(ValueError):
             create_user_group(db, None, None)
 
+def test_create_without_commit(client, init_database):
+    with client as test_client:
+        group = create_group(db, "uncommitted group", commit = False)
+        ticket = create_ticket(db, 1, group.id, title = "uncommitted title", content = "uncommitted content", commit = False)
+        create_user_group(db, 1, group.id, commit = False)
+        assert group.id and ticket.id #flushed, so ids are assigned
+        db.session.rollback()
+        assert read_group(db, group_name = "uncommitted group") == []
+        assert read_ticket(db, title = "uncommitted") == []
+
+def test_create_users_bulk(client, init_database):
+    with client as test_client:
+        ids = create_users_bulk(db, [{"email" : f"bulk{i}@bulk.com", "password" : "password", "username" : f"bulk{i}"} for i in range(3)])
+        assert len(ids) == 3
+        for i, id in enumerate(ids):
+            user = read_user(db, user_id = id)
+            assert user.email == f"bulk{i}@bulk.com"
+            assert check_password_hash(user.password, "password")
+        with pytest.raises(ValueError):
+            create_users_bulk(db, [{"email" : "twice@bulk.com", "password" : "password", "username" : "a"}] * 2)
+        with pytest.raises(ValueError):
+            create_users_bulk(db, [{"email" : "valid@bulk.com", "password" : "password", "username" : "a"}, {"email" : "invalid", "password" : "password", "username" : "b"}])
+        assert read_user(db, email = "valid@bulk.com") == [] #nothing is written when a row is invalid
+
+def test_create_tickets_and_comments_bulk(client, init_database, time_posted):
+    with client as test_client:
+        ticket_ids = create_tickets_bulk(db, [{"user_id" : 1, "group_id" : 1, "title" : f"bulk title {i}", "content" : f"bulk content {i}",
+            "priority" : i % 4, "time_posted" : time_posted} for i in range(5)], commit = False)
+        comment_ids = create_comments_bulk(db, [{"user_id" : 1, "ticket_id" : id, "content" : f"bulk comment {id}"} for id in ticket_ids], commit = False)
+        db.session.commit()
+        assert [ticket.id for ticket in read_ticket(db, title = "bulk title")] == ticket_ids
+        assert read_ticket(db, id = ticket_ids[3]).priority == 3
+        assert read_ticket(db, id = ticket_ids[3]).time_posted == time_posted
+        assert read_ticket(db, id = ticket_ids[3]).resolved == False
+        assert read_ticket(db, content = "bulk content 4")[0].id == ticket_ids[4] #searchable right away
+        assert read_comment(db, content = f"bulk comment {ticket_ids[2]}")[0].id == comment_ids[2]
+        assert read_comment(db, id = comment_ids[0]).ticket_id == ticket_ids[0]
+        with pytest.raises(ValueError):
+            create_tickets_bulk(db, [{"user_id" : 1, "title" : "title", "content" : "content", "priority" : 7}])
+        with pytest.raises(ValueError):
+            create_comments_bulk(db, [{"user_id" : 1, "ticket_id" : None, "content" : "content"}])
+        assert create_tickets_bulk(db, []) == []
+
+def test_create_groups_bulk(client, init_database):
+    with client as test_client:
+        ids = create_groups_bulk(db, ["Bulk group 1", "Bulk group 2"])
+        assert [read_group(db, id = id).group_name for id in ids] == ["Bulk group 1", "Bulk group 2"]
+        with pytest.raises(ValueError):
+            create_groups_bulk(db, ["Bulk group 1"]) #already exists
+        with pytest.raises(ValueError):
+            create_groups_bulk(db, ["Bulk group 3", "Bulk group 3"])
+
+def test_create_user_groups_bulk(client, init_database):
+    with client as test_client:
+        keys = create_user_groups_bulk(db, [{"user_id" : 1, "group_id" : 2}, {"user_id" : 1, "group_id" : 3, "rank_in_group" : 2}])
+        assert keys == [(1, 2), (1, 3)]
+        assert read_user_group(db, 1, 2).rank_in_group == 0
+        assert read_user_group(db, 1, 3).rank_in_group == 2
+        with pytest.raises(ValueError):
+            create_user_groups_bulk(db, [{"user_id" : 1, "group_id" : 4, "rank_in_group" : 5}])
+
 '''READ'''
 
 def test_read_user(client, init_database):
@@ -192,6 +255,30 @@ def test_read_user_group(client, init_database):
         assert len(read_user_group(db, group_id = 1)) == 3
         assert len(read_user_group(db, user_id = 3)) == 2
     
+def test_read_streaming(client, init_database):
+    with client as test_client:
+        ticket_ids = create_tickets_bulk(db, [{"user_id" : 1, "group_id" : i % 2, "title" : f"streamed {i}", "content" : "content"} for i in range(25)])
+        create_comments_bulk(db, [{"user_id" : 1, "ticket_id" : id, "content" : "streamed comment"} for id in ticket_ids])
+        streamed = read_ticket(db, stream = True, batch_size = 4)
+        assert not isinstance(streamed, list)
+        assert sorted(ticket.id for ticket in streamed) == ticket_ids
+        assert sorted(ticket.id for ticket in read_ticket(db, group_id = 1, stream = True, batch_size = 4)) == ticket_ids[1::2]
+        assert [ticket.id for ticket in read_ticket(db, id = ticket_ids[0], stream = True)] == [ticket_ids[0]]
+        assert len(list(read_comment(db, ticket_id = ticket_ids[3], stream = True))) == 1
+        assert len(list(read_comment(db, stream = True, batch_size = 7))) == 25
+        assert [user.id for user in read_user(db, stream = True)] == [1]
+        assert list(read_user_group(db, stream = True)) == []
+        assert list(read_group(db, stream = True)) == []
+
+def test_read_columns(client, init_database):
+    with client as test_client:
+        ticket = create_ticket(db, 1, None, "projected title", "projected content", priority = 2)
+        assert read_ticket(db, priority = 2, columns = [Ticket.id, Ticket.title]) == [(ticket.id, "projected title")]
+        rows = list(read_ticket(db, stream = True, columns = [Ticket.id, Ticket.priority]))
+        assert rows[0].id == ticket.id and rows[0].priority == 2
+        assert read_user(db, user_id = 1, columns = [User.username]) == [("user_one",)]
+        assert read_ticket(db, id = ticket.id, columns = [Ticket.title]) == [("projected title",)]
+
 '''UPDATE'''
 def test_update_user(client, init_database):
     with client as test_client:
@@ -292,6 +379,45 @@ def test_update_ticket(client, init_database, time_posted):
         update_ticket(db, id = ticket.id, nullgroup = True)
         assert ticket.group_id == None
 
+def test_update_tickets_bulk(client, init_database):
+    with client as test_client:
+        group, other_group = create_group(db, "bulk group").id, create_group(db, "other group").id
+        tickets = [create_ticket(db, user_id = 1, group_id = group, title = f"title {i}", content = "content", priority = i % 2) for i in range(6)]
+        ids = [ticket.id for ticket in tickets]
+        update_ticket(db, ids[0], resolved = True, time_resolved = datetime(2022, 1, 1))
+        with pytest.raises(ValueError):
+            update_tickets_bulk(db, ids)
+        with pytest.raises(ValueError):
+            update_tickets_bulk(db, ids, priority = 7)
+        assert update_tickets_bulk(db, [], resolved = True) == 0
+        with query_budget(6): #the same statements for any number of tickets
+            assert update_tickets_bulk(db, ids[:4] + [1000], resolved = True) == 4
+        assert all(ticket.resolved for ticket in tickets[:4]) and not tickets[4].resolved #loaded tickets are refreshed
+        assert tickets[0].time_resolved == datetime(2022, 1, 1) and tickets[1].time_resolved is not None
+        assert unresolved_counts(db, group) == {0 : 1, 1 : 1}
+        update_tickets_bulk(db, ids[3:], priority = 3, group_id = other_group)
+        assert unresolved_counts(db, group) == {} and unresolved_counts(db, other_group) == {3 : 2}
+        assert [ticket.group_id for ticket in tickets] == [group] * 3 + [other_group] * 3
+        update_tickets_bulk(db, ids, resolved = False, nullgroup = True)
+        assert unresolved_counts(db, None) == {0 : 2, 1 : 1, 3 : 3}
+        assert all(ticket.time_resolved is None for ticket in tickets) #reopened tickets are no longer resolved at any time
+        assert db.session.query(Ticket).filter(Ticket.id.in_(ids), Ticket.time_resolved != None).count() == 0
+        assert reconcile_counters(db) == {"groups" : 0, "ticket_counts" : 0}
+
+def test_resolve_ticket(client, init_database):
+    with client as test_client:
+        ticket = create_ticket(db, user_id = 1, group_id = None, title = "title", content = "content").id
+        with pytest.raises(ValueError):
+            resolve_ticket(db, 1000, user_id = 1)
+        resolved, comment = resolve_ticket(db, ticket, user_id = 1, commit = False)
+        db.session.rollback() #the comment and the resolution are undone together
+        assert read_ticket(db, id = ticket).resolved == False and read_comment(db, ticket_id = ticket) == []
+        resolved, comment = resolve_ticket(db, ticket, user_id = 1)
+        assert resolved.resolved and resolved.time_resolved is not None
+        assert comment.content == RESOLVE_COMMENT and comment.user_id == 1 and comment.ticket_id == ticket
+        with pytest.raises(ValueError):
+            resolve_ticket(db, ticket, user_id = 1)
+
 def test_update_user_group(client, init_database):
     with client as test_client:
         user_group = create_user_group(db, user_id = 1, group_id = 2, rank_in_group = 0)
@@ -353,6 +479,51 @@ def test_delete_ticket(client, init_database):
         assert read_ticket(db, id = t2.id).id == t2.id
         assert read_ticket(db, id = t3.id).id == t3.id
 
+def test_delete_ticket_cascades(client, init_database, count_queries):
+    with client as test_client:
+        ticket = create_ticket(db, 1, 1, title = "doomed ticket", content = "doomed content").id
+        other = create_ticket(db, 1, 1, title = "other ticket", content = "other content").id
+        create_comments_bulk(db, [{"user_id" : 1, "ticket_id" : ticket, "content" : f"doomed comment {i}"} for i in range(500)])
+        create_comment(db, 1, other, "surviving comment")
+        count_queries.clear()
+        delete_ticket(db, id = ticket)
+        assert len(count_queries) <= 8 #independent of the number of comments
+        assert read_comment(db, ticket_id = ticket) == []
+        assert read_comment(db, content = "doomed") == [] #index rows are gone too
+        assert len(read_comment(db, ticket_id = other)) == 1
+
+def test_delete_group_cascades(client, init_database):
+    with client as test_client:
+        group = create_group(db, "Doomed group").id
+        kept = create_group(db, "Kept group").id
+        create_user_group(db, 1, group)
+        create_user_group(db, 1, kept)
+        ticket = create_ticket(db, 1, group, title = "group ticket", content = "group content").id
+        kept_ticket = create_ticket(db, 1, kept, title = "kept ticket", content = "kept content").id
+        create_comment(db, 1, ticket, "group comment")
+        delete_group(db, group)
+        assert read_ticket(db, group_id = group) == []
+        assert read_comment(db, ticket_id = ticket) == []
+        assert read_user_group(db, group_id = group) == []
+        assert read_ticket(db, id = kept_ticket)
+        assert read_user_group(db, 1, kept)
+
+def test_delete_user_cascades(client, init_database):
+    with client as test_client:
+        user = create_user(db, email = "leaving@email.com", password = "password", username = "leaving").id
+        create_user_group(db, user, 1)
+        ticket = create_ticket(db, user, 1, title = "leaving ticket", content = "leaving content").id
+        other = create_ticket(db, 1, 1, title = "staying ticket", content = "staying content").id
+        create_comment(db, 1, ticket, "comment on their ticket")
+        create_comment(db, user, other, "their comment elsewhere")
+        create_comment(db, 1, other, "staying comment")
+        delete_user(db, user)
+        assert read_ticket(db, user_id = user) == []
+        assert read_comment(db, ticket_id = ticket) == []
+        assert read_comment(db, user_id = user) == []
+        assert read_user_group(db, group_id = 1) == []
+        assert [comment.content for comment in read_comment(db, ticket_id = other)] == ["staying comment"]
+
 def test_delete_user_group(client, init_database):
     with client as test_client:
         ug1 = create_user_group(db, user_id = 1, group_id = 2, rank_in_group = 0)
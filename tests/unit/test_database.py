@@ -0,0 +1,143 @@
+from SupportTicketSystem import create_app, db
+from SupportTicketSystem.crud_operations import *
+from SupportTicketSystem.common_queries import all_unrestickets_for_user
+from SupportTicketSystem.database import pragma, reader, read_session
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from threading import Thread, Barrier
+import pytest
+import shutil
+
+'''
+Database profiles. These tests build their own apps on a file database instead of using the in memory test database.
+'''
+
+def file_app(tmp_path, **config):
+    app = create_app(config = {"TESTING" : True, "SECRET_KEY" : "TEST", "SQLALCHEMY_TRACK_MODIFICATIONS" : False,
+        "SQLALCHEMY_DATABASE_URI" : f"sqlite:///{tmp_path / 'profile.db'}", **config})
+    with app.app_context():
+        db.create_all()
+        create_user(db, email = "writer@place.com", password = "password", username = "writer")
+        create_user(db, email = "reader@place.com", password = "password", username = "reader")
+        db.session.remove()
+    return app
+
+def test_production_profile_pragmas(tmp_path):
+    app = file_app(tmp_path, DATABASE_PROFILE = "production", SQLITE_PRAGMAS = {"busy_timeout" : 2000})
+    with app.app_context():
+        engine = db.get_engine()
+        assert pragma(engine, "journal_mode") == "wal"
+        assert pragma(engine, "synchronous") == 1 #NORMAL
+        assert pragma(engine, "foreign_keys") == 1
+        assert pragma(engine, "busy_timeout") == 2000 #overridden through the config
+        assert engine.pool.size() == 5
+        with pytest.raises(Exception):
+            create_comment(db, 1, 12345, "comment on a ticket that does not exist") #foreign keys are enforced
+        db.session.rollback()
+        db.drop_all()
+
+def test_default_profile(tmp_path):
+    app = file_app(tmp_path)
+    with app.app_context():
+        assert pragma(db.get_engine(), "journal_mode") == "delete"
+        db.drop_all()
+    with pytest.raises(ValueError):
+        create_app(config = {"SECRET_KEY" : "TEST", "SQLALCHEMY_DATABASE_URI" : "sqlite:///", "SQLALCHEMY_TRACK_MODIFICATIONS" : False, "DATABASE_PROFILE" : "fastest"})
+
+def test_production_profile_concurrency(tmp_path):
+    '''
+    Parallel writers and readers must all succeed, without "database is locked" errors
+    '''
+    app = file_app(tmp_path, DATABASE_PROFILE = "production")
+    writers, readers, writes = 4, 4, 25
+    barrier = Barrier(writers + readers)
+    errors = []
+    def write(number):
+        with app.app_context():
+            try:
+                barrier.wait()
+                for i in range(writes):
+                    ticket = create_ticket(db, 1, None, f"writer {number} ticket {i}", "content")
+                    create_comment(db, 1, ticket.id, f"writer {number} comment {i}")
+            except Exception as error:
+                errors.append(error)
+            finally:
+                db.session.remove()
+    def read():
+        with app.app_context():
+            try:
+                barrier.wait()
+                for i in range(writes):
+                    all_unrestickets_for_user(2)
+                    read_ticket(db, title = "writer")
+                    db.session.remove()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                db.session.remove()
+    threads = [Thread(target = write, args = (number,)) for number in range(writers)] + [Thread(target = read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with app.app_context():
+        assert len(read_ticket(db)) == writers * writes
+        assert len(read_comment(db)) == writers * writes
+        assert len(read_ticket(db, title = "ticket")) == writers * writes #the search index kept up
+        db.drop_all()
+
+def test_separate_reads(tmp_path):
+    app = file_app(tmp_path, DATABASE_PROFILE = "production")
+    client = app.test_client()
+    with app.app_context():
+        read_engine = app.extensions["read_engine"]
+        assert reader() is read_session
+        assert read_engine is not db.get_engine() and "mode=ro" in str(read_engine.url)
+        assert pragma(read_engine, "query_only") == 1
+        ticket = create_ticket(db, 1, None, "routed", "content")
+        read_statements = []
+        event.listen(read_engine, "before_cursor_execute", lambda *args: read_statements.append(args[2]))
+        assert [row[0].id for row in all_unrestickets_for_user(2)] == [ticket.id]
+        assert read_statements #the feed was read through the read engine
+        with pytest.raises(OperationalError):
+            reader().execute(text("DELETE FROM ticket"))
+        read_session.rollback()
+        assert len(read_ticket(db)) == 1 #writes still go to the primary
+    client.post("/login", data = dict(email = "reader@place.com", password = "password"))
+    assert client.get("/groups").status_code == 200
+    for url in ["/", f"/view-ticket?id={ticket.id}", "/search?q=routed"]:
+        response = client.get(url)
+        assert response.status_code == 200 and b"routed" in response.data
+    with app.app_context():
+        db.drop_all()
+
+def test_read_replica(tmp_path):
+    file_app(tmp_path)
+    shutil.copy(tmp_path / "profile.db", tmp_path / "replica.db")
+    app = create_app(config = {"TESTING" : True, "SECRET_KEY" : "TEST", "SQLALCHEMY_TRACK_MODIFICATIONS" : False,
+        "SQLALCHEMY_DATABASE_URI" : f"sqlite:///{tmp_path / 'profile.db'}", "SQLALCHEMY_READ_DATABASE_URI" : f"sqlite:///{tmp_path / 'replica.db'}"})
+    with app.app_context():
+        create_ticket(db, 1, None, "not replicated yet", "content")
+        assert all_unrestickets_for_user(2) == [] #the replica is behind the primary
+        assert len(read_ticket(db)) == 1
+
+def test_shared_reads(tmp_path):
+    app = file_app(tmp_path)
+    with app.app_context():
+        assert app.extensions["read_engine"] is None and reader() is db.session
+        db.drop_all()
+    app = file_app(tmp_path, DATABASE_PROFILE = "production", SEPARATE_READS = False)
+    with app.app_context():
+        assert reader() is db.session
+        db.drop_all()
+
+def test_savepoint_as_first_statement(tmp_path):
+    app = file_app(tmp_path)
+    with app.app_context():
+        savepoint = db.session.begin_nested() #before anything else, so the driver has not begun a transaction
+        create_group(db, "kept until commit", commit = False)
+        savepoint.commit()
+        db.session.rollback()
+        assert read_group(db, group_name = "kept until commit") == [] #releasing the savepoint did not commit
+        db.session.remove()
@@ -0,0 +1,101 @@
+import pytest
+from SupportTicketSystem import db
+from SupportTicketSystem.crud_operations import *
+from SupportTicketSystem.events import EventBroker, event_broker, OVERFLOW
+from SupportTicketSystem.instrumentation import query_budget
+
+'''
+Committed writes are published to the subscribers that may see them, and nothing is built while no one listens
+'''
+
+@pytest.fixture(scope = "function")
+def subscribe(client):
+    subscriptions = []
+    def subscribe(user_id, group_ids):
+        subscriptions.append(event_broker().subscribe(user_id, group_ids))
+        return subscriptions[-1]
+    yield subscribe
+    for subscription in subscriptions:
+        event_broker().unsubscribe(subscription)
+
+def drain(subscription):
+    events = []
+    event = subscription.next(timeout = 0)
+    while event is not None:
+        events.append(event["type"])
+        event = subscription.next(timeout = 0)
+    return events
+
+def test_events_are_filtered_by_group(client, init_database, subscribe):
+    other = create_user(db, email = "other@place.com", password = "password", username = "other").id
+    mine, theirs = create_group(db, "mine").id, create_group(db, "theirs").id
+    create_user_group(db, 1, mine)
+    member, outsider = subscribe(1, [mine]), subscribe(other, [])
+    ticket = create_ticket(db, other, mine, "group ticket", "content").id
+    create_ticket(db, other, theirs, "unseen ticket", "content")
+    universal = create_ticket(db, other, None, "universal ticket", "content").id
+    create_comment(db, other, ticket, "comment")
+    update_ticket(db, ticket, resolved = True)
+    delete_ticket(db, universal)
+    assert drain(member) == ["ticket_created", "ticket_created", "comment_created", "ticket_resolved", "ticket_deleted"]
+    assert drain(outsider) == ["ticket_deleted"] #only the ticket without a group, which they posted so it is not added to their feed
+    create_user_group(db, other, mine)
+    create_ticket(db, 1, mine, "now seen", "content")
+    assert drain(outsider) == ["membership_created", "ticket_created"]
+    delete_user_group(db, other, mine)
+    create_ticket(db, 1, mine, "no longer seen", "content")
+    assert drain(outsider) == ["membership_deleted"]
+
+def test_events_wait_for_commit(client, init_database, subscribe):
+    subscription = subscribe(2, [])
+    create_ticket(db, 1, None, "flushed ticket", "content", commit = False)
+    assert drain(subscription) == []
+    db.session.rollback()
+    db.session.commit()
+    assert drain(subscription) == [] #rolled back writes are never published
+    ticket = create_ticket(db, 1, None, "committed ticket", "content")
+    events = [subscription.next(timeout = 0)]
+    assert events[0]["ticket"].title == "committed ticket" and events[0]["group_id"] is None
+    update_ticket(db, ticket.id, title = "renamed") #edits that do not change what pages show are not published
+    assert drain(subscription) == []
+
+def test_savepoint_rollback_drops_its_events(client, init_database, subscribe):
+    subscription = subscribe(2, [])
+    create_ticket(db, 1, None, "kept ticket", "content", commit = False)
+    savepoint = db.session.begin_nested()
+    create_ticket(db, 1, None, "undone ticket", "content", commit = False)
+    savepoint.rollback()
+    db.session.commit()
+    events = [subscription.next(timeout = 0), subscription.next(timeout = 0)]
+    assert events[0]["ticket"].title == "kept ticket" and events[1] is None
+
+def test_bulk_updates_publish_each_ticket(client, init_database, subscribe):
+    group = create_group(db, "triaged").id
+    create_user_group(db, 1, group)
+    tickets = [create_ticket(db, 1, group, f"ticket {i}", "content").id for i in range(3)]
+    subscription, author = subscribe(2, [group]), subscribe(1, [group])
+    update_tickets_bulk(db, tickets, resolved = True)
+    update_tickets_bulk(db, tickets[:1], nullgroup = True)
+    update_tickets_bulk(db, tickets, priority = 2) #the feed order changes, but nothing appears or disappears
+    assert drain(subscription) == ["ticket_resolved"] * 3 + ["ticket_deleted", "ticket_created"]
+    update_tickets_bulk(db, tickets[1:], resolved = False)
+    assert drain(subscription) == ["ticket_reopened"] * 2
+    assert drain(author) == ["ticket_resolved"] * 3 + ["ticket_deleted"] #their own tickets are never added to their feed
+
+def test_no_events_without_subscribers(client, init_database):
+    assert not event_broker().listening()
+    ticket = create_ticket(db, 1, None, "quiet ticket", "content").id
+    with query_budget(4): #the comment, its index row (delete and insert), and the version stamp, no lookup of the ticket's group
+        create_comment(db, 1, ticket, "no one is listening")
+    assert "pending_events" not in db.session.info
+
+def test_slow_subscribers_overflow():
+    broker = EventBroker(queue_size = 2)
+    slow = broker.subscribe(1, [])
+    broker.publish([{"type" : "ticket_deleted", "group_id" : None, "ticket_id" : i} for i in range(3)])
+    assert slow.next(timeout = 0) == OVERFLOW
+    assert slow.next(timeout = 0) is None #the missed events are dropped
+    broker.publish([{"type" : "ticket_deleted", "group_id" : None, "ticket_id" : 3}])
+    assert slow.next(timeout = 0)["ticket_id"] == 3
+    broker.unsubscribe(slow)
+    assert not broker.listening() and broker.stats()["published"] == 4
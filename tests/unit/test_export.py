@@ -0,0 +1,64 @@
+from conftest import db
+from SupportTicketSystem.crud_operations import *
+from SupportTicketSystem.export import export_tickets, parse_time
+from datetime import datetime
+import csv
+import io
+import json
+import pytest
+
+'''
+Export of tickets and comments as NDJSON and CSV
+'''
+
+def make_tickets(count):
+    group = create_group(db, "export group")
+    ids = create_tickets_bulk(db, [{"user_id" : 1, "group_id" : group.id if i % 2 else None, "title" : f"export {i}", "content" : f"content, \"{i}\"",
+        "time_posted" : datetime(2022, 1, 1 + i)} for i in range(count)])
+    create_comments_bulk(db, [{"user_id" : 1, "ticket_id" : ids[0], "content" : f"comment {i}", "time_posted" : datetime(2022, 2, 1 + i)} for i in range(3)])
+    return group.id, ids
+
+def test_export_ndjson(client, init_database):
+    with client as test_client:
+        group_id, ids = make_tickets(7)
+        chunks = list(export_tickets(db, batch_size = 3))
+        assert len(chunks) == 3 #batches of 3, 3, and 1
+        records = [json.loads(line) for line in "".join(chunks).splitlines()]
+        assert [record["id"] for record in records] == ids
+        assert records[1]["group_name"] == "export group" and records[0]["group_name"] is None
+        assert records[0]["author_email"] == "user@place.com"
+        assert records[0]["time_posted"] == "2022-01-01T00:00:00"
+        assert "comments" not in records[0]
+        with_comments = [json.loads(line) for line in "".join(export_tickets(db, comments = True)).splitlines()]
+        assert [comment["content"] for comment in with_comments[0]["comments"]] == ["comment 0", "comment 1", "comment 2"]
+        assert with_comments[1]["comments"] == []
+
+def test_export_filters(client, init_database):
+    with client as test_client:
+        group_id, ids = make_tickets(7)
+        in_group = [json.loads(line)["id"] for line in "".join(export_tickets(db, group_id = group_id, batch_size = 2)).splitlines()]
+        assert in_group == ids[1::2]
+        in_range = [json.loads(line)["id"] for line in "".join(export_tickets(db, since = parse_time("2022-01-02"), until = parse_time("2022-01-04", end = True))).splitlines()]
+        assert in_range == ids[1:4]
+        assert "".join(export_tickets(db, visible_to = 1)).count("\n") == 4 #only the tickets in no group
+        with pytest.raises(ValueError):
+            list(export_tickets(db, format = "xml"))
+
+def test_export_csv(client, init_database):
+    with client as test_client:
+        group_id, ids = make_tickets(3)
+        rows = list(csv.DictReader(io.StringIO("".join(export_tickets(db, format = "csv", batch_size = 2)))))
+        assert [int(row["id"]) for row in rows] == ids
+        assert rows[0]["content"] == 'content, "0"'
+        rows = list(csv.DictReader(io.StringIO("".join(export_tickets(db, format = "csv", comments = True)))))
+        assert len(rows) == 5 #3 rows for the ticket with comments, and 1 each for the others
+        assert [row["comment_content"] for row in rows[:3]] == ["comment 0", "comment 1", "comment 2"]
+        assert rows[3]["comment_id"] == ""
+
+def test_export_command(client, init_database):
+    with client as test_client:
+        make_tickets(2)
+        result = test_client.application.test_cli_runner().invoke(args = ["export-tickets", "--format", "csv", "--since", "2022-01-02"])
+        assert result.exit_code == 0
+        assert result.output.splitlines()[1].split(",")[1] == "export 1"
+        assert test_client.application.test_cli_runner().invoke(args = ["export-tickets", "--since", "yesterday"]).exit_code != 0
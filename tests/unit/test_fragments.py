@@ -0,0 +1,39 @@
+from SupportTicketSystem import db
+from SupportTicketSystem.crud_operations import *
+from SupportTicketSystem.fragments import fragment_cache
+
+'''
+Ticket cards are rendered once and served from the fragment cache until something they show changes
+'''
+
+def test_cards_are_cached(client, init_database, login_default_user):
+    with client as test_client:
+        author = create_user(db, email = "author@place.com", password = "password", username = "card author")
+        tickets = [create_ticket(db, author.id, None, f"card title {i}", "content").id for i in range(5)]
+        fragment_cache().clear()
+        first = test_client.get("/").data
+        misses = fragment_cache().stats()["misses"]
+        assert fragment_cache().stats()["entries"] == 5
+        assert test_client.get("/").data == first
+        assert fragment_cache().stats()["misses"] == misses #every card came from the cache
+        update_ticket(db, tickets[0], title = "changed title")
+        update_user(db, author.id, username = "renamed author")
+        page = test_client.get("/").data
+        assert b"changed title" in page and b"card title 0" not in page
+        assert b"renamed author" in page and b"card author" not in page
+        assert fragment_cache().stats()["entries"] == 5 #one card per ticket
+        delete_ticket(db, tickets[1])
+        assert fragment_cache().stats()["entries"] == 4
+
+def test_card_variants_and_escaping(client, init_database, login_default_user):
+    with client as test_client:
+        ticket = create_ticket(db, 1, None, "<script>alert(1)</script>", "content").id
+        update_ticket(db, ticket, resolved = True, time_resolved = datetime(2022, 1, 1))
+        update_ticket(db, ticket, resolved = False) #reopened tickets keep their time resolved
+        page = test_client.get("/mytickets").data
+        assert b"<script>alert(1)" not in page and b"&lt;script&gt;" in page
+        assert b"Resolved:" in page
+        other = create_user(db, email = "other@place.com", password = "password", username = "other")
+        test_client.get("/logout")
+        test_client.post("/login", data = dict(email = "other@place.com", password = "password"))
+        assert b"Resolved:" not in test_client.get("/").data #the feed shows the card without it
@@ -0,0 +1,85 @@
+from conftest import db
+from SupportTicketSystem.crud_operations import *
+from SupportTicketSystem.models import *
+from SupportTicketSystem.export import export_tickets
+from SupportTicketSystem.importer import import_tickets, read_records
+import io
+import json
+import pytest
+
+'''
+Imports of NDJSON and CSV exports, including resuming an interrupted import
+'''
+
+def record(i, email = "migrated@tracker.com", group_name = "Migrated group", comments = 1):
+    return {"title" : f"migrated {i}", "content" : f"content {i}", "priority" : i % 4, "resolved" : i % 2 == 0, "time_posted" : f"2021-03-0{1 + i % 9}T10:00:00",
+        "author_email" : email, "group_name" : group_name, "comments" : [{"content" : f"reply {j}", "author_email" : "user@place.com",
+        "time_posted" : "2021-04-01T00:00:00"} for j in range(comments)]}
+
+def ndjson(records):
+    return io.StringIO("".join(json.dumps(record) + "\n" for record in records))
+
+def test_import_ndjson(client, init_database):
+    with client as test_client:
+        summary = import_tickets(db, read_records(ndjson([record(i) for i in range(5)] + [record(5, group_name = None)]), "ndjson"), "test", batch_size = 2)
+        assert summary["tickets"] == 6 and summary["comments"] == 6
+        assert summary["users"] == 1 and summary["groups"] == 1
+        assert summary["memberships"] == 2 #the author and the commenter
+        author = read_user(db, email = "migrated@tracker.com")
+        group = read_group(db, group_name = "Migrated group")[0]
+        assert read_user_group(db, author.id, group.id).rank_in_group == 2 #first member becomes the admin
+        assert read_user_group(db, 1, group.id).rank_in_group == 0
+        tickets = sorted(read_ticket(db, user_id = author.id), key = lambda ticket: ticket.id)
+        assert len(tickets) == 6 and tickets[0].title == "migrated 0" and tickets[0].resolved and tickets[1].priority == 1
+        assert tickets[5].group_id is None
+        assert read_comment(db, content = "reply")[0].user_id == 1 #comments are searchable
+        assert db.session.get(Import_Checkpoint, "test").position == 6
+
+def test_import_resumes_after_failure(client, init_database):
+    with client as test_client:
+        records = [record(i) for i in range(7)]
+        records[5]["priority"] = 9
+        with pytest.raises(ValueError) as error:
+            import_tickets(db, read_records(ndjson(records), "ndjson"), "resumable", batch_size = 2)
+        assert "Record 6" in str(error.value)
+        assert len(read_ticket(db)) == 4 #the first 2 batches were committed
+        records[5]["priority"] = 3
+        summary = import_tickets(db, read_records(ndjson(records), "ndjson"), "resumable", batch_size = 2)
+        assert summary["resumed_after"] == 4 and summary["tickets"] == 3
+        assert sorted(ticket.title for ticket in read_ticket(db)) == [f"migrated {i}" for i in range(7)]
+        assert import_tickets(db, read_records(ndjson(records), "ndjson"), "resumable")["tickets"] == 0 #already done
+        assert import_tickets(db, read_records(ndjson(records), "ndjson"), "resumable", restart = True)["tickets"] == 7
+
+def test_import_missing_users(client, init_database):
+    with client as test_client:
+        with pytest.raises(ValueError):
+            import_tickets(db, read_records(ndjson([record(0)]), "ndjson"), "strict", create_missing_users = False)
+        assert read_ticket(db) == [] and read_user(db, email = "migrated@tracker.com") == []
+
+def test_export_import_round_trip(client, init_database):
+    with client as test_client:
+        group = create_group(db, "Round trip")
+        ticket = create_ticket(db, 1, group.id, "round trip", "content, with \"quotes\"", priority = 2)
+        create_comment(db, 1, ticket.id, "first")
+        create_comment(db, 1, ticket.id, "second")
+        create_ticket(db, 1, None, "no comments", "content")
+        for format in ("csv", "ndjson"):
+            exported = io.StringIO("".join(export_tickets(db, format = format, comments = True)))
+            records = list(read_records(exported, format))
+            assert [len(record["comments"]) for record in records] == [2, 0]
+            assert records[0]["content"] == "content, with \"quotes\"" and records[0]["group_name"] == "Round trip"
+        summary = import_tickets(db, iter(records), "round trip")
+        assert summary["tickets"] == 2 and summary["comments"] == 2 and summary["users"] == 0 and summary["groups"] == 0
+        copy = read_ticket(db, title = "round trip")[1]
+        assert copy.group_id == group.id and copy.priority == 2
+        assert [comment.content for comment in read_comment(db, ticket_id = copy.id)] == ["first", "second"]
+
+def test_import_command(client, init_database, tmp_path):
+    with client as test_client:
+        path = tmp_path / "tickets.ndjson"
+        path.write_text(ndjson([record(i) for i in range(3)]).getvalue())
+        result = test_client.application.test_cli_runner().invoke(args = ["import-tickets", str(path), "--batch-size", "2"])
+        assert result.exit_code == 0, result.output
+        assert "Imported 3 tickets and 3 comments" in result.output
+        result = test_client.application.test_cli_runner().invoke(args = ["import-tickets", str(path)])
+        assert "Resumed after record 3" in result.output
@@ -0,0 +1,24 @@
+from conftest import db
+from SupportTicketSystem.crud_operations import *
+from SupportTicketSystem.instrumentation import query_budget, record_statements, QueryBudgetExceeded
+import pytest
+
+def test_record_statements(client, init_database):
+    with client as test_client:
+        with record_statements() as statements:
+            read_ticket(db, priority = 1)
+            read_comment(db, user_id = 1)
+        assert len(statements) == 2
+        assert "FROM ticket" in statements[0][0]
+        read_ticket(db) #no longer recorded
+        assert len(statements) == 2
+
+def test_query_budget(client, init_database):
+    with client as test_client:
+        with query_budget(1):
+            read_ticket(db, priority = 1)
+        with pytest.raises(QueryBudgetExceeded) as error:
+            with query_budget(1):
+                read_ticket(db, priority = 1)
+                read_comment(db, user_id = 1)
+        assert "2 statements" in str(error.value) and "FROM comment" in str(error.value)
@@ -0,0 +1,46 @@
+import re
+import pytest
+from SupportTicketSystem.common_queries import *
+
+'''
+Runs EXPLAIN QUERY PLAN on every statement the hot queries issue, and fails if any of them scans a whole table.
+Lines like "SCAN ticket USING INDEX ..." walk an index, a bare "SCAN ticket" reads every row.
+
+read_all_groups_not_userin is left out, it lists every group by design.
+'''
+hot_queries = {
+    "all_unrestickets_for_user" : lambda: all_unrestickets_for_user(2),
+    "unrestickets_page_for_user" : lambda: unrestickets_page_for_user(2, after = unrestickets_page_for_user(2, per_page = 1)[2]),
+    "all_tickets_by_user" : lambda: all_tickets_by_user(1),
+    "tickets_page_by_user" : lambda: tickets_page_by_user(1, after = tickets_page_by_user(1, per_page = 1)[2]),
+    "read_all_tickets_in_group" : lambda: read_all_tickets_in_group(1),
+    "read_comment_by_ticket" : lambda: read_comment(db, ticket_id = 1),
+    "read_all_users_in_group" : lambda: read_all_users_in_group(1),
+    "read_users_groups" : lambda: read_users_groups(2),
+    "read_rank" : lambda: read_rank(1, 1),
+}
+
+def full_scans(statements):
+    '''
+    Returns the query plan lines of the given statements that scan a table without an index
+    '''
+    scans = []
+    for statement, parameters in statements:
+        if not statement.lstrip().upper().startswith("SELECT"):
+            continue
+        plan = db.session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+        scans += [row[3] for row in plan if re.fullmatch(r"SCAN \w+", row[3]) and row[3] != "SCAN CONSTANT ROW"]
+    return scans
+
+@pytest.mark.parametrize("name", hot_queries)
+def test_hot_queries_use_indexes(client, init_large_database, count_queries, name):
+    with client as test_client:
+        hot_queries[name]()
+        statements = list(count_queries)
+        assert statements
+        assert full_scans(statements) == []
+
+def test_full_scans_are_detected(client, init_large_database, count_queries):
+    with client as test_client:
+        read_ticket(db, priority = 1)
+        assert full_scans(list(count_queries)) == ["SCAN ticket"]
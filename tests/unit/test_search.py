@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import select
+from SupportTicketSystem import search
+from SupportTicketSystem.search import search_enabled, ticket_fts, comment_fts
+from SupportTicketSystem.common_queries import *
+from conftest import db
+
+'''
+The full text index is kept in sync by crud_operations, and search_tickets ranks matches
+among the tickets the user can see.
+'''
+
+def indexed(table):
+    return sorted(row[0] for row in db.session.execute(select(table.c.rowid)))
+
+def test_index_is_kept_in_sync(client, init_large_database):
+    with client as test_client:
+        assert search_enabled(db)
+        assert indexed(ticket_fts) == [1, 2, 3, 4, 5]
+        assert indexed(comment_fts) == [1]
+        ticket = create_ticket(db, 1, None, "printer on fire", "smoke everywhere")
+        comment = create_comment(db, 2, ticket.id, "extinguisher requested")
+        assert [t.id for t in read_ticket(db, title = "on fi")] == [ticket.id]
+        assert [c.id for c in read_comment(db, content = "EXTINGUISH")] == [comment.id]
+        update_ticket(db, ticket.id, title = "printer jammed")
+        update_comment(db, comment.id, content = "paper removed")
+        assert not read_ticket(db, title = "fire")
+        assert read_ticket(db, title = "jammed")[0].id == ticket.id
+        assert not read_comment(db, content = "extinguisher")
+        delete_comment(db, comment.id)
+        delete_ticket(db, ticket.id)
+        assert ticket.id not in indexed(ticket_fts)
+        assert comment.id not in indexed(comment_fts)
+
+def test_search_tickets_ranked_and_visible(client, init_large_database):
+    with client as test_client:
+        best = create_ticket(db, 3, 1, "database outage", "the database is down, database logs attached")
+        other = create_ticket(db, 3, None, "slow page", "maybe the database")
+        by_comment = create_ticket(db, 3, 1, "login broken", "cannot log in")
+        create_comment(db, 2, by_comment.id, "database password expired")
+        hidden = create_ticket(db, 3, 3, "database migration", "group 3 only")
+        results = [ticket.id for ticket, _, _, _ in search_tickets(1, "database")]
+        assert results[0] == best.id
+        assert set(results) == {best.id, other.id, by_comment.id}
+        assert hidden.id in [ticket.id for ticket, _, _, _ in search_tickets(4, "database")]
+        assert [ticket.id for ticket, _, _, _ in search_tickets(1, "database expired")] == [by_comment.id]
+        assert search_tickets(1, "no such words") == []
+
+def test_search_tickets_without_index(client, init_large_database, monkeypatch):
+    with client as test_client:
+        create_comment(db, 2, 3, "db is up")
+        assert [row[0].id for row in search_tickets(2, "db")] == [3] #too short for the index
+        monkeypatch.setattr(search, "_search_enabled", {db.engine : False})
+        assert [row[0].id for row in search_tickets(2, "title 4")] == [4]
+        assert len(read_ticket(db, title = "ticket")) == 5
@@ -0,0 +1,40 @@
+import pytest
+from SupportTicketSystem import create_app, db
+from SupportTicketSystem.startup import missing_tables
+
+'''
+What create_app does at boot: the schema check modes, the template bytecode cache, and the phase timings
+'''
+
+def startup_app(tmp_path, **config):
+    return create_app(config = {"TESTING" : True, "SECRET_KEY" : "TEST", "SQLALCHEMY_TRACK_MODIFICATIONS" : False,
+        "SQLALCHEMY_DATABASE_URI" : f"sqlite:///{tmp_path / 'startup.db'}", "TEMPLATE_CACHE_DIR" : str(tmp_path), **config})
+
+def test_schema_check_modes(tmp_path):
+    app = startup_app(tmp_path, SCHEMA_CHECK = "off")
+    assert missing_tables(app) == sorted(db.metadata.tables)
+    app = startup_app(tmp_path, SCHEMA_CHECK = "lazy")
+    assert missing_tables(app) == sorted(db.metadata.tables)
+    app.test_client().get("/login")
+    assert missing_tables(app) == []
+    app = startup_app(tmp_path)
+    assert list(app.extensions["startup_timings"]) == ["initialize", "create_database", "register_blueprints", "register_commands", "precompile_templates"]
+    with app.app_context():
+        db.drop_all()
+    assert missing_tables(app) == sorted(db.metadata.tables)
+    startup_app(tmp_path, SCHEMA_CHECK = "startup")
+    assert missing_tables(app) == []
+    with app.app_context():
+        db.drop_all()
+    with pytest.raises(ValueError):
+        startup_app(tmp_path, SCHEMA_CHECK = "sometimes")
+
+def test_template_bytecode_cache(tmp_path):
+    app = startup_app(tmp_path, SCHEMA_CHECK = "off", PRECOMPILE_TEMPLATES = True)
+    cached = list(tmp_path.glob("__jinja2_*.cache"))
+    assert len(cached) == len([name for name in app.jinja_env.list_templates() if name.endswith(".html")])
+    app = startup_app(tmp_path, SCHEMA_CHECK = "off") #a new worker reads them instead of compiling
+    assert app.test_client().get("/login").status_code == 200
+    assert list(tmp_path.glob("__jinja2_*.cache")) == cached
+    app = startup_app(tmp_path, SCHEMA_CHECK = "off", TEMPLATE_BYTECODE_CACHE = False)
+    assert app.jinja_env.bytecode_cache is None